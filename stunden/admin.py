@@ -1,4 +1,5 @@
 from .models import StundenAufzeichnung, Firma, Arbeitnehmer, Einstellungen, Rechnungsnummer
+from .signals import bezahlt_setzen
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User, Group
@@ -35,7 +36,7 @@ class StundenAufzeichnungAdmin(admin.ModelAdmin):
         """
         Admin Aktion, die Einträge als bezahlt markiert.
         """
-        rows_updated = queryset.update(bezahlt=True)
+        rows_updated = bezahlt_setzen(queryset, True)
         if rows_updated == 1:
             result = "1 Eintrag wurde"
         else:
@@ -47,7 +48,7 @@ class StundenAufzeichnungAdmin(admin.ModelAdmin):
         """
         Admin Aktion, die Einträge als unbezahlt markiert.
         """
-        rows_updated = queryset.update(bezahlt=False)
+        rows_updated = bezahlt_setzen(queryset, False)
         if rows_updated == 1:
             result = "1 Eintrag wurde"
         else:
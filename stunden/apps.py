@@ -0,0 +1,18 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class StundenConfig(AppConfig):
+    """
+    Die App Konfiguration für stunden.
+    Registriert beim Start die Signale und kompiliert mit
+    STUNDEN_TEMPLATES_VORKOMPILIEREN = True alle Templates vor.
+    """
+    name = "stunden"
+    verbose_name = "Stunden"
+
+    def ready(self):
+        from . import signals
+        if getattr(settings, "STUNDEN_TEMPLATES_VORKOMPILIEREN", False):
+            from .template_cache import templates_vorkompilieren
+            templates_vorkompilieren()
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import zipfile
+from itertools import chain
+from .models import StundenAufzeichnung, Firma, Arbeitnehmer, Einstellungen, Rechnungsnummer
+from .importer import import_objects, iter_json_array, deserialize_rows, validate_rows, batches
+from django.core.serializers import python as python_serializer
+from django.core.serializers.base import DeserializationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+# Alle Models in der Reihenfolge der Foreign Keys.
+BACKUP_MODELS = [Firma, Arbeitnehmer, Einstellungen, Rechnungsnummer, StundenAufzeichnung]
+
+BACKUP_FORMAT = "webpystunden3-backup"
+BACKUP_VERSION = 1
+BACKUP_MANIFEST = "manifest.json"
+BACKUP_BATCH_SIZE = 1000
+
+
+class ZipStreamBuffer(object):
+    """
+    Ein Datei Objekt, in das zipfile schreibt und aus dem die geschriebenen
+    Bytes stückweise wieder abgeholt werden, um sie zu streamen.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        """
+        Liefert die seit dem letzten Aufruf geschriebenen Bytes.
+        """
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class PruefsummenLeser(object):
+    """
+    Liest aus einem Datei Objekt und berechnet dabei die SHA256 Prüfsumme.
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def backup_filename(model):
+    """
+    Der Dateiname eines Models im Backup Archiv.
+    """
+    return "{}.json".format(model._meta.label_lower)
+
+
+def stream_backup(batch_size=BACKUP_BATCH_SIZE):
+    """
+    Erstellt ein ZIP Archiv mit allen Models und liefert es stückweise.
+    Jedes Model liegt als JSON Datei im Format von jsonexport im Archiv,
+    das manifest.json enthält Anzahl und SHA256 Prüfsumme jeder Datei.
+    Das Schreiben mit archiv.open(name, "w") braucht Python 3.6.
+    """
+    buffer = ZipStreamBuffer()
+    manifest = {
+        "format": BACKUP_FORMAT,
+        "version": BACKUP_VERSION,
+        "erstellt": timezone.now().isoformat(),
+        "dateien": [],
+    }
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archiv:
+        for model in BACKUP_MODELS:
+            name = backup_filename(model)
+            sha256 = hashlib.sha256()
+            anzahl = 0
+            with archiv.open(name, "w", force_zip64=True) as datei:
+                def schreiben(text):
+                    data = text.encode("utf-8")
+                    sha256.update(data)
+                    datei.write(data)
+
+                schreiben("[")
+                queryset = model._default_manager.order_by("pk").iterator(chunk_size=batch_size)
+                for batch in batches(queryset, batch_size):
+                    objects = python_serializer.Serializer().serialize(batch)
+                    for obj in objects:
+                        schreiben(",\n" if anzahl else "\n")
+                        schreiben(json.dumps(obj, cls=DjangoJSONEncoder, ensure_ascii=False))
+                        anzahl += 1
+                    yield buffer.pop()
+                schreiben("\n]\n")
+            manifest["dateien"].append({
+                "name": name,
+                "model": model._meta.label_lower,
+                "anzahl": anzahl,
+                "sha256": sha256.hexdigest(),
+            })
+            yield buffer.pop()
+        archiv.writestr(BACKUP_MANIFEST, json.dumps(manifest, indent=4))
+    yield buffer.pop()
+
+
+def read_manifest(archiv):
+    """
+    Liest und prüft das manifest.json eines Backup Archivs.
+    """
+    try:
+        manifest = json.loads(archiv.read(BACKUP_MANIFEST).decode("utf-8"))
+    except (KeyError, ValueError):
+        raise DeserializationError("Das Archiv enthält kein gültiges manifest.json.")
+    if manifest.get("format") != BACKUP_FORMAT or manifest.get("version") != BACKUP_VERSION:
+        raise DeserializationError("Das Archiv ist kein webpystunden3 Backup.")
+    bekannte_models = [model._meta.label_lower for model in BACKUP_MODELS]
+    for datei in manifest["dateien"]:
+        if datei["model"] not in bekannte_models:
+            raise DeserializationError("Unbekanntes Model {} im Backup.".format(datei["model"]))
+    return manifest
+
+
+def iter_backup_rows(archiv, datei):
+    """
+    Liest die Zeilen einer Datei aus dem Archiv und prüft am Ende die
+    Prüfsumme und die Anzahl laut manifest.json.
+    """
+    with archiv.open(datei["name"]) as fileobj:
+        leser = PruefsummenLeser(fileobj)
+        anzahl = 0
+        for row in iter_json_array(leser):
+            if not isinstance(row, dict) or row.get("model") != datei["model"]:
+                raise DeserializationError("{} enthält fremde Objekte.".format(datei["name"]))
+            anzahl += 1
+            yield row
+        if leser.hexdigest() != datei["sha256"] or anzahl != datei["anzahl"]:
+            raise DeserializationError("Die Prüfsumme von {} stimmt nicht.".format(datei["name"]))
+
+
+def open_backup(archiv_file):
+    """
+    Öffnet ein Backup Archiv und liest das manifest.json.
+    """
+    try:
+        archiv = zipfile.ZipFile(archiv_file)
+    except zipfile.BadZipFile:
+        raise DeserializationError("Die Datei ist kein ZIP Archiv.")
+    try:
+        manifest = read_manifest(archiv)
+    except Exception:
+        archiv.close()
+        raise
+    return archiv, manifest
+
+
+def backup_rows(archiv, manifest):
+    """
+    Alle Zeilen des Archivs in der Reihenfolge laut manifest.json.
+    """
+    return chain.from_iterable(iter_backup_rows(archiv, datei) for datei in manifest["dateien"])
+
+
+def restore_backup(archiv_file, fortschritt=None):
+    """
+    Spielt ein Backup Archiv in einem Durchgang und einer Transaktion ein.
+    Die Foreign Key Prüfungen werden wie bei loaddata erst am Ende gemacht.
+    Returniert wird ein ImportErgebnis.
+    """
+    archiv, manifest = open_backup(archiv_file)
+    gesamt = sum(datei["anzahl"] for datei in manifest["dateien"])
+
+    def fortschritt_mit_gesamt(ergebnis):
+        ergebnis.gesamt = gesamt
+        if fortschritt:
+            fortschritt(ergebnis)
+
+    with archiv:
+        deserialized_objects = deserialize_rows(backup_rows(archiv, manifest))
+        with transaction.atomic():
+            with connection.constraint_checks_disabled():
+                ergebnis = import_objects(
+                    deserialized_objects,
+                    transaktion="gesamt",
+                    fortschritt=fortschritt_mit_gesamt
+                )
+            connection.check_constraints(
+                table_names=[model._meta.db_table for model in BACKUP_MODELS]
+            )
+    ergebnis.gesamt = gesamt
+    return ergebnis
+
+
+def validate_backup(archiv_file, fortschritt=None):
+    """
+    Prüft ein Backup Archiv, ohne etwas zu schreiben (Dry-Run).
+    Returniert wird ein ImportErgebnis mit den Fehlern pro Zeile.
+    """
+    archiv, manifest = open_backup(archiv_file)
+    gesamt = sum(datei["anzahl"] for datei in manifest["dateien"])
+
+    def fortschritt_mit_gesamt(ergebnis):
+        ergebnis.gesamt = gesamt
+        if fortschritt:
+            fortschritt(ergebnis)
+
+    with archiv:
+        ergebnis = validate_rows(backup_rows(archiv, manifest), fortschritt=fortschritt_mit_gesamt)
+    ergebnis.gesamt = gesamt
+    return ergebnis
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import threading
+import time
+from collections import namedtuple
+from functools import wraps
+from .models import Einstellungen, Firma, Rechnungsnummer
+from .utils import naechste_rechnungsnummer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+
+# Der Umsatzsteuersatz, falls keine Einstellungen gespeichert sind.
+STANDARD_UST = 20
+
+VERSION_KEY = "stunden:version:{}"
+STUNDENSAETZE_KEY = "stunden:stundensaetze:{}"
+VIEW_KEY = "stunden:view:{}:{}:{}:{}"
+CHOICES_KEY = "stunden:choices:{}:{}"
+RECHNUNGSNUMMER_KEY = "stunden:rechnungsnummer:{}"
+ZEILEN_KEY = "stunden:zeilen:{}:{}"
+
+# Standardwert, falls in den Django Settings nichts eingestellt ist.
+# Die Versionen sorgen für die Invalidierung, die Zeit nur fürs Aufräumen.
+VIEW_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Die Einstellungen mit Typen, siehe get_einstellungen.
+EinstellungenWerte = namedtuple("EinstellungenWerte", ["ust"])
+
+_einstellungen = {"version": None, "werte": None}
+_einstellungen_lock = threading.Lock()
+
+
+def model_name(model):
+    """
+    Der Name eines Models für die Versionen, z.B. "stunden.firma".
+    """
+    return model._meta.label_lower
+
+
+def get_version(name):
+    """
+    Liefert die aktuelle Version eines Namens aus dem Cache.
+    Fehlt sie, wird sie mit der aktuellen Zeit in Millisekunden angelegt,
+    damit sie sich von allen älteren Versionen unterscheidet.
+    """
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """
+    Erhöht die Version eines Namens. Alles, was mit der alten Version
+    gespeichert wurde, ist damit in allen Prozessen ungültig.
+    """
+    key = VERSION_KEY.format(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = int(time.time() * 1000)
+        cache.set(key, version, None)
+        return version
+
+
+def bump_model_version(model):
+    """
+    Erhöht die Version eines Models, sofort und noch einmal nach dem
+    Commit. Sonst könnte ein anderer Prozess zwischen dem Erhöhen und dem
+    Commit die alten Daten mit der neuen Version laden.
+    """
+    name = model_name(model)
+    bump_version(name)
+    transaction.on_commit(lambda: bump_version(name))
+
+
+def get_einstellungen():
+    """
+    Liefert die Einstellungen als EinstellungenWerte ohne Datenbank Abfrage.
+    Die Werte liegen im Speicher des Prozesses und werden neu geladen, wenn
+    sich die Version von Einstellungen im Cache geändert hat.
+    Ohne gespeicherte Einstellungen gilt STANDARD_UST.
+    """
+    version = get_version(model_name(Einstellungen))
+    with _einstellungen_lock:
+        if _einstellungen["version"] == version:
+            return _einstellungen["werte"]
+    einstellungen = Einstellungen.objects.filter(pk=1).first()
+    werte = EinstellungenWerte(ust=einstellungen.ust if einstellungen else STANDARD_UST)
+    with _einstellungen_lock:
+        _einstellungen["version"] = version
+        _einstellungen["werte"] = werte
+    return werte
+
+
+def get_stundensaetze():
+    """
+    Liefert die Stundensätze aller Firmen als JSON Text und den Zeitpunkt
+    der letzten Änderung einer Firma. Beides liegt im Cache unter der
+    Version von Firma, eine Abfrage gibt es nur nach einer Änderung.
+    """
+    version = get_version(model_name(Firma))
+    key = STUNDENSAETZE_KEY.format(version)
+    daten = cache.get(key)
+    if daten is None:
+        stundensaetze = {}
+        last_modified = None
+        for pk, stundensatz, updated in Firma.objects.values_list("pk", "stundensatz", "updated"):
+            stundensaetze[str(pk)] = stundensatz
+            if last_modified is None or updated > last_modified:
+                last_modified = updated
+        daten = {
+            "version": version,
+            "json": json.dumps(stundensaetze, separators=(",", ":")),
+            "last_modified": last_modified,
+        }
+        cache.set(key, daten, None)
+    return daten
+
+
+def get_choices(model):
+    """
+    Liefert die Auswahl eines Models für Formulare als Liste von
+    (pk, Text), sortiert nach pk wie Model.objects.all().
+    Die Liste liegt im Cache unter der Version des Models.
+    """
+    key = CHOICES_KEY.format(model_name(model), get_version(model_name(model)))
+    choices = cache.get(key)
+    if choices is None:
+        choices = [(obj.pk, str(obj)) for obj in model._default_manager.order_by("pk")]
+        cache.set(key, choices, None)
+    return choices
+
+
+def get_zeilen(model):
+    """
+    Liefert alle Einträge eines kleinen Models als dict von pk auf die
+    Werte aller Felder (in der Reihenfolge von model._meta.concrete_fields).
+    Das dict liegt im Cache unter der Version des Models und darf nicht
+    verändert werden, Objekte daraus baut die IdentityMap.
+    """
+    key = ZEILEN_KEY.format(model_name(model), get_version(model_name(model)))
+    zeilen = cache.get(key)
+    if zeilen is None:
+        attnames = [field.attname for field in model._meta.concrete_fields]
+        pk_index = attnames.index(model._meta.pk.attname)
+        zeilen = {
+            values[pk_index]: values
+            for values in model._default_manager.order_by("pk").values_list(*attnames)
+        }
+        cache.set(key, zeilen, None)
+    return zeilen
+
+
+def get_naechste_rechnungsnummer():
+    """
+    Liefert den Vorschlag für die nächste Rechnungsnummer aus dem Cache.
+    Der Vorschlag liegt unter der Version von Rechnungsnummer, nur nach
+    einer Änderung, die nicht über rechnungsnummer_merken ging, wird die
+    letzte Rechnungsnummer abgefragt.
+    """
+    key = RECHNUNGSNUMMER_KEY.format(get_version(model_name(Rechnungsnummer)))
+    naechste = cache.get(key)
+    if naechste is None:
+        letzte = Rechnungsnummer.objects.order_by("-rechnungsnummer_datum").values_list(
+            "rechnungsnummer", flat=True
+        ).first()
+        naechste = naechste_rechnungsnummer(letzte)
+        cache.set(key, naechste, None)
+    return naechste
+
+
+def rechnungsnummer_merken(rechnungsnummer):
+    """
+    Speichert den Vorschlag nach einer neuen Rechnungsnummer unter der
+    aktuellen Version, damit das nächste Formular keine Abfrage braucht.
+    """
+    key = RECHNUNGSNUMMER_KEY.format(get_version(model_name(Rechnungsnummer)))
+    cache.set(key, naechste_rechnungsnummer(rechnungsnummer), None)
+
+
+def model_versionen(models):
+    """
+    Die Versionen mehrerer Models als ein Text für Keys und ETags.
+    """
+    return "-".join(str(get_version(model_name(model))) for model in models)
+
+
+def versioned_cache(*models):
+    """
+    Ein Decorator, der die Antwort eines Views im Cache speichert.
+    Der Key enthält die Versionen der angegebenen Models, den User und
+    die URL mit Query String. Jede Änderung an einem der Models erhöht
+    dessen Version, danach wird die Seite neu erstellt.
+    Gecacht werden nur GET Requests mit Status 200, ohne Cookies, ohne
+    CSRF Token (das Cookie setzt erst die Middleware nach dem View) und
+    nicht innerhalb einer offenen Transaktion, deren Daten noch
+    zurückgerollt werden könnten. Gespeichert werden Inhalt und Header.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            versionen = model_versionen(models)
+            key = VIEW_KEY.format(
+                view.__name__,
+                request.user.pk,
+                versionen,
+                hashlib.md5(request.get_full_path().encode("utf-8")).hexdigest(),
+            )
+            gecacht = cache.get(key)
+            if gecacht is not None:
+                content, headers = gecacht
+                response = HttpResponse(content)
+                for name, value in headers:
+                    response[name] = value
+                return response
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming and not response.cookies \
+                    and not request.META.get("CSRF_COOKIE_USED") \
+                    and not transaction.get_connection().in_atomic_block:
+                timeout = getattr(settings, "STUNDEN_VIEW_CACHE_TIMEOUT", VIEW_CACHE_TIMEOUT)
+                cache.set(key, (response.content, list(response.items())), timeout)
+            return response
+        return wrapper
+    return decorator
+
+
+def versioned_etag(*models):
+    """
+    Ein Decorator für bedingte GET Requests. Der ETag wird aus den Versionen
+    der angegebenen Models, dem User und der URL mit Query String gebildet.
+    Stimmt If-None-Match, kommt ein 304, ohne dass der View läuft.
+    Der Browser muss jedes Mal nachfragen (private, no-cache).
+    Nicht für Views, die ein CSRF Token rendern: Nach einem neuen Login
+    bliebe der ETag gleich und der Browser würde das alte Token senden.
+    """
+    def etag(request, *args, **kwargs):
+        return hashlib.md5("{}:{}:{}".format(
+            request.user.pk,
+            model_versionen(models),
+            request.get_full_path(),
+        ).encode("utf-8")).hexdigest()
+
+    def decorator(view):
+        return cache_control(private=True, no_cache=True)(condition(etag_func=etag)(view))
+    return decorator
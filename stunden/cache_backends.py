@@ -0,0 +1,187 @@
+import threading
+import time
+from collections import OrderedDict
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+# Standardwerte für die OPTIONS des ZweistufigerCache.
+LOKAL_MAX_EINTRAEGE = 1000
+LOKAL_PREFIXE = ("stunden:", "template.cache.")
+VERSION_PREFIX = "stunden:version:"
+VERSION_TIMEOUT = 1.0
+
+# Django legt pro Thread eine eigene Instanz des Backends an. Der lokale
+# Speicher ist daher pro Prozess und LOCATION hier abgelegt, wie beim
+# LocMemCache.
+_speicher = {}
+_speicher_lock = threading.Lock()
+
+
+class LokalerSpeicher(object):
+    """
+    Der LRU im Speicher des Prozesses mit Zählern für Treffer und
+    Fehlschläge.
+    """
+    def __init__(self):
+        self.eintraege = OrderedDict()
+        self.lock = threading.Lock()
+        self.treffer_lokal = 0
+        self.treffer_shared = 0
+        self.fehlschlaege = 0
+
+
+def get_speicher(name):
+    """
+    Liefert den lokalen Speicher für eine LOCATION, legt ihn bei Bedarf an.
+    """
+    with _speicher_lock:
+        if name not in _speicher:
+            _speicher[name] = LokalerSpeicher()
+        return _speicher[name]
+
+
+class ZweistufigerCache(BaseCache):
+    """
+    Ein Cache mit zwei Stufen: ein begrenzter LRU im Speicher des Prozesses
+    vor einem geteilten Cache (z.B. FileBasedCache oder DatabaseCache), der
+    unter OPTIONS["SHARED"] in CACHES eingetragen ist.
+
+    Lokal gehalten werden nur Keys mit einem der LOKAL_PREFIXE. Diese Keys
+    enthalten die Version eines Models oder den Zeitstempel der letzten
+    Änderung (Template Fragmente) und ändern ihren Wert nie, sie sind
+    lokal gültig, bis sie ablaufen oder verdrängt werden. Die Versionen
+    selbst (VERSION_PREFIX) werden höchstens VERSION_TIMEOUT Sekunden lokal
+    gehalten, danach wird im geteilten Cache nachgesehen. Eine Änderung in
+    einem anderen Prozess ist so nach spätestens VERSION_TIMEOUT Sekunden
+    überall sichtbar. Alle anderen Keys gehen direkt an den geteilten Cache.
+
+    Schreiben geht immer an beide Stufen. Lokal werden die Werte nicht
+    kopiert, gelieferte Werte dürfen daher nicht verändert werden.
+    """
+    def __init__(self, location, params):
+        super(ZweistufigerCache, self).__init__(params)
+        options = params.get("OPTIONS", {})
+        self.shared_alias = options.get("SHARED", "shared")
+        self.max_eintraege = options.get("LOKAL_MAX_EINTRAEGE", LOKAL_MAX_EINTRAEGE)
+        self.lokal_prefixe = tuple(options.get("LOKAL_PREFIXE", LOKAL_PREFIXE))
+        self.version_prefix = options.get("VERSION_PREFIX", VERSION_PREFIX)
+        self.version_timeout = options.get("VERSION_TIMEOUT", VERSION_TIMEOUT)
+        self.speicher = get_speicher(location)
+
+    @property
+    def shared(self):
+        """
+        Der geteilte Cache, pro Thread von Django verwaltet.
+        """
+        return caches[self.shared_alias]
+
+    def lokal_erlaubt(self, key):
+        """
+        Ob ein Key im Speicher des Prozesses gehalten werden darf.
+        """
+        return key.startswith(self.lokal_prefixe)
+
+    def lokal_ablauf(self, key, timeout):
+        """
+        Bis wann ein Eintrag lokal gültig ist, als time.time() Wert oder
+        None für unbegrenzt. Versionen höchstens VERSION_TIMEOUT Sekunden.
+        """
+        ablauf = self.get_backend_timeout(timeout)
+        if key.startswith(self.version_prefix):
+            version_ablauf = time.time() + self.version_timeout
+            if ablauf is None or version_ablauf < ablauf:
+                ablauf = version_ablauf
+        return ablauf
+
+    def lokal_setzen(self, key, version, value, timeout=DEFAULT_TIMEOUT):
+        if not self.lokal_erlaubt(key):
+            return
+        lokal_key = self.make_key(key, version)
+        ablauf = self.lokal_ablauf(key, timeout)
+        with self.speicher.lock:
+            self.speicher.eintraege[lokal_key] = (value, ablauf)
+            self.speicher.eintraege.move_to_end(lokal_key)
+            while len(self.speicher.eintraege) > self.max_eintraege:
+                self.speicher.eintraege.popitem(last=False)
+
+    def lokal_holen(self, key, version):
+        """
+        Liefert (True, Wert) bei einem gültigen lokalen Eintrag,
+        sonst (False, None).
+        """
+        if not self.lokal_erlaubt(key):
+            return False, None
+        lokal_key = self.make_key(key, version)
+        with self.speicher.lock:
+            eintrag = self.speicher.eintraege.get(lokal_key)
+            if eintrag is None:
+                return False, None
+            value, ablauf = eintrag
+            if ablauf is not None and ablauf <= time.time():
+                del self.speicher.eintraege[lokal_key]
+                return False, None
+            self.speicher.eintraege.move_to_end(lokal_key)
+            self.speicher.treffer_lokal += 1
+            return True, value
+
+    def lokal_loeschen(self, key, version):
+        with self.speicher.lock:
+            self.speicher.eintraege.pop(self.make_key(key, version), None)
+
+    def get(self, key, default=None, version=None):
+        gefunden, value = self.lokal_holen(key, version)
+        if gefunden:
+            return value
+        value = self.shared.get(key, version=version)
+        if value is None:
+            with self.speicher.lock:
+                self.speicher.fehlschlaege += 1
+            return default
+        with self.speicher.lock:
+            self.speicher.treffer_shared += 1
+        # Die Restlaufzeit im geteilten Cache ist nicht bekannt. Versionierte
+        # Keys ändern sich nicht, daher reicht das Timeout dieses Caches.
+        self.lokal_setzen(key, version, value)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        self.lokal_setzen(key, version, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self.shared.add(key, value, timeout, version=version):
+            self.lokal_setzen(key, version, value, timeout)
+            return True
+        return False
+
+    def delete(self, key, version=None):
+        self.lokal_loeschen(key, version)
+        self.shared.delete(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta, version=version)
+        self.lokal_setzen(key, version, value, None)
+        return value
+
+    def has_key(self, key, version=None):
+        gefunden, value = self.lokal_holen(key, version)
+        return gefunden or self.shared.has_key(key, version=version)
+
+    def clear(self):
+        with self.speicher.lock:
+            self.speicher.eintraege.clear()
+        self.shared.clear()
+
+    def statistik(self):
+        """
+        Die Zähler seit dem Start des Prozesses, für Logging und Messungen.
+        """
+        with self.speicher.lock:
+            return {
+                "treffer_lokal": self.speicher.treffer_lokal,
+                "treffer_shared": self.speicher.treffer_shared,
+                "fehlschlaege": self.speicher.fehlschlaege,
+                "lokal_eintraege": len(self.speicher.eintraege),
+                "lokal_max_eintraege": self.max_eintraege,
+            }
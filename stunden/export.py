@@ -0,0 +1,169 @@
+import csv
+from decimal import Decimal
+from .models import StundenAufzeichnung, Firma, Arbeitnehmer, Rechnungsnummer, ExportVerlauf
+from .utils import calculate_stunden
+from .xlsx import stream_xlsx
+from django.core import serializers
+from django.utils import timezone
+
+
+# So viele Zeilen werden pro Abfrage vom Datenbank Cursor geholt.
+EXPORT_CHUNK_SIZE = 2000
+
+# Die Bereiche des JSON Exports.
+JSON_EXPORT_BEREICHE = [
+    ("json_export_select_stundenaufzeichnung", "Stundenaufzeichnung", StundenAufzeichnung),
+    ("json_export_select_firma", "Firma", Firma),
+    ("json_export_select_arbeitnehmer", "Arbeitnehmer", Arbeitnehmer),
+    ("json_export_select_rechnungsnummer", "Rechnungsnummer", Rechnungsnummer),
+]
+JSON_EXPORT_BACKUP = "json_export_select_backup"
+
+# Aus so vielen Einträgen wird die Größe eines Exports geschätzt.
+EXPORT_STICHPROBE = 20
+
+# Die Spalten des Exports der Stundenaufzeichnungen.
+STUNDEN_SPALTEN = [
+    "Datum",
+    "Firma",
+    "Arbeitnehmer",
+    "Startzeit",
+    "Endzeit",
+    "Stunden",
+    "Protokoll",
+    "Bezahlt",
+]
+STUNDEN_SPALTEN_BREITEN = [12, 30, 25, 10, 10, 10, 60, 10]
+
+# Die Spalten des Exports der Rechnungsnummern.
+RECHNUNGSNUMMER_SPALTEN = ["Rechnungsnummer", "Datum"]
+RECHNUNGSNUMMER_SPALTEN_BREITEN = [20, 18]
+
+
+class Echo(object):
+    """
+    Ein Datei Objekt für csv.writer, das die geschriebene Zeile returniert,
+    statt sie zu speichern.
+    """
+    def write(self, value):
+        return value
+
+
+def stunden_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Liefert die Stundenaufzeichnungen eines Querysets Zeile für Zeile.
+    Firma und Arbeitnehmer werden in der Abfrage mit einem JOIN geholt,
+    iterator() liest mit einem Cursor stückweise (unter PostgreSQL ein
+    server-side Cursor), der Speicherbedarf bleibt dadurch konstant.
+    """
+    rows = queryset.order_by("datum", "startzeit", "pk").values_list(
+        "datum",
+        "firma__firma",
+        "arbeitnehmer__name",
+        "startzeit",
+        "endzeit",
+        "protokoll",
+        "bezahlt",
+    ).iterator(chunk_size=chunk_size)
+    for datum, firma, arbeitnehmer, startzeit, endzeit, protokoll, bezahlt in rows:
+        stunden = Decimal(calculate_stunden(startzeit, endzeit))
+        yield datum, firma, arbeitnehmer, startzeit, endzeit, stunden, protokoll, bezahlt
+
+
+def stream_csv(queryset):
+    """
+    Liefert die Stundenaufzeichnungen als CSV Zeilen für eine
+    StreamingHttpResponse. Trennzeichen und Dezimalkomma wie bei Excel
+    im deutschen Sprachraum, das BOM am Anfang kennzeichnet UTF-8.
+    """
+    writer = csv.writer(Echo(), delimiter=";")
+    yield "\ufeff" + writer.writerow(STUNDEN_SPALTEN)
+    for datum, firma, arbeitnehmer, startzeit, endzeit, stunden, protokoll, bezahlt in stunden_rows(queryset):
+        yield writer.writerow([
+            datum.strftime("%d.%m.%Y"),
+            firma,
+            arbeitnehmer,
+            startzeit.strftime("%H:%M"),
+            endzeit.strftime("%H:%M"),
+            "{:.2f}".format(stunden).replace(".", ","),
+            protokoll,
+            "ja" if bezahlt else "nein",
+        ])
+
+
+def stream_stunden_xlsx(queryset):
+    """
+    Liefert die Stundenaufzeichnungen als XLSX Datei für eine
+    StreamingHttpResponse, mit Datum, Zeiten und Stunden als Zahlen.
+    """
+    return stream_xlsx(
+        "Stunden",
+        STUNDEN_SPALTEN,
+        stunden_rows(queryset),
+        STUNDEN_SPALTEN_BREITEN
+    )
+
+
+def stream_rechnungsnummern_xlsx(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Liefert die Rechnungsnummern als XLSX Datei für eine StreamingHttpResponse.
+    """
+    rows = queryset.values_list(
+        "rechnungsnummer",
+        "rechnungsnummer_datum",
+    ).iterator(chunk_size=chunk_size)
+    return stream_xlsx(
+        "Rechnungsnummern",
+        RECHNUNGSNUMMER_SPALTEN,
+        rows,
+        RECHNUNGSNUMMER_SPALTEN_BREITEN
+    )
+
+
+def geschaetzte_groesse(model, anzahl):
+    """
+    Schätzt die Größe des JSON Exports eines Models in Bytes.
+    Serialisiert werden nur die neuesten EXPORT_STICHPROBE Einträge.
+    """
+    if not anzahl:
+        return 0
+    stichprobe = list(model._default_manager.order_by("-pk")[:EXPORT_STICHPROBE])
+    groesse = len(serializers.serialize("json", stichprobe).encode("utf-8"))
+    return int(groesse / len(stichprobe) * anzahl)
+
+
+def export_uebersicht():
+    """
+    Die Übersicht für die JSON Export Seite: Anzahl der Einträge,
+    geschätzte Größe und letzter Export pro Bereich.
+    Gelesen werden nur COUNT, eine kleine Stichprobe pro Bereich und der
+    Export Verlauf mit einem Eintrag pro Bereich.
+    """
+    letzte_exporte = dict(ExportVerlauf.objects.values_list("bereich", "exportiert"))
+    uebersicht = []
+    for bereich, name, model in JSON_EXPORT_BEREICHE:
+        anzahl = model._default_manager.count()
+        uebersicht.append({
+            "bereich": bereich,
+            "name": name,
+            "anzahl": anzahl,
+            "groesse": geschaetzte_groesse(model, anzahl),
+            "letzter_export": letzte_exporte.get(bereich),
+        })
+    uebersicht.append({
+        "bereich": JSON_EXPORT_BACKUP,
+        "name": "Komplettes Backup (unkomprimiert)",
+        "anzahl": sum(zeile["anzahl"] for zeile in uebersicht),
+        "groesse": sum(zeile["groesse"] for zeile in uebersicht),
+        "letzter_export": letzte_exporte.get(JSON_EXPORT_BACKUP),
+    })
+    return uebersicht
+
+
+def export_merken(bereich):
+    """
+    Merkt sich den Zeitpunkt eines JSON Exports, einen Eintrag pro Bereich.
+    Gemerkt wird, wann der Export angefordert wurde. Der Download wird
+    erst danach gestreamt und kann noch abbrechen.
+    """
+    ExportVerlauf.objects.update_or_create(bereich=bereich, defaults={"exportiert": timezone.now()})
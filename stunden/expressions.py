@@ -0,0 +1,48 @@
+from django.db.models import DecimalField, Func
+
+
+class StundenDauer(Func):
+    """
+    Die Stunden zwischen startzeit und endzeit einer Stundenaufzeichnung in
+    SQL, auf zwei Dezimalstellen gerundet. Wie bei calculate_stunden zählen
+    nur ganze Sekunden, die Rundung passiert pro Eintrag.
+    Unterstützt werden SQLite, PostgreSQL und MySQL.
+    """
+    template = "ROUND((%(sekunden_ende)s - %(sekunden_start)s) / 3600.0, 2)"
+    sekunden = "strftime('%%s', {})"
+
+    def __init__(self, startzeit="startzeit", endzeit="endzeit", **extra):
+        super(StundenDauer, self).__init__(
+            startzeit,
+            endzeit,
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+            **extra
+        )
+
+    def as_sql(self, compiler, connection, function=None, template=None, sekunden=None, **extra_context):
+        sekunden = sekunden or self.sekunden
+        startzeit, start_params = compiler.compile(self.source_expressions[0])
+        endzeit, end_params = compiler.compile(self.source_expressions[1])
+        template = template or self.template
+        sql = template % {
+            "sekunden_start": sekunden.format(startzeit),
+            "sekunden_ende": sekunden.format(endzeit),
+        }
+        return sql, end_params + start_params
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            template="ROUND(CAST((%(sekunden_ende)s - %(sekunden_start)s) AS numeric) / 3600, 2)",
+            sekunden="FLOOR(EXTRACT(EPOCH FROM {}))",
+            **extra_context
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            sekunden="TIME_TO_SEC({})",
+            **extra_context
+        )
@@ -1,4 +1,6 @@
-from .models import StundenAufzeichnung, Firma, Arbeitnehmer, Rechnungsnummer
+from .models import StundenAufzeichnung, Firma, Arbeitnehmer
+from .cache import get_choices, get_naechste_rechnungsnummer
+from .identity_map import IDENTITY_MAP_MODELS, get_identity_map
 from django import forms
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Field
@@ -8,6 +10,59 @@ from dateutil.relativedelta import relativedelta
 from django.core.exceptions import ObjectDoesNotExist
 
 
+class CachedChoices(object):
+    """
+    Die Auswahl eines CachedModelChoiceField, erst beim Iterieren aus dem
+    Cache geholt, wie der ModelChoiceIterator von Django. Sonst würde schon
+    das Anlegen der Formular Klassen beim Import auf Cache und Datenbank
+    zugreifen.
+    """
+    def __init__(self, field):
+        self.field = field
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for choice in get_choices(self.field.queryset.model):
+            yield choice
+
+    def __len__(self):
+        return len(get_choices(self.field.queryset.model)) + (self.field.empty_label is not None)
+
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """
+    Ein ModelChoiceField, dessen Auswahl aus dem Cache kommt, siehe
+    get_choices. Beim Anzeigen gibt es keine Abfrage, beim Prüfen wird die
+    übermittelte ID zuerst mit der gecachten Auswahl verglichen und nur ein
+    gültiger Eintrag geholt, bei Firma und Arbeitnehmer aus der IdentityMap
+    des Requests.
+    """
+
+    def _get_choices(self):
+        if hasattr(self, "_choices"):
+            return self._choices
+        return CachedChoices(self)
+
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            pk = int(getattr(value, "pk", value))
+        except (ValueError, TypeError):
+            raise forms.ValidationError(self.error_messages["invalid_choice"], code="invalid_choice")
+        if pk not in {choice_pk for choice_pk, label in get_choices(self.queryset.model)}:
+            raise forms.ValidationError(self.error_messages["invalid_choice"], code="invalid_choice")
+        try:
+            if self.queryset.model in IDENTITY_MAP_MODELS:
+                return get_identity_map().get(self.queryset.model, pk)
+            return self.queryset.get(pk=pk)
+        except self.queryset.model.DoesNotExist:
+            raise forms.ValidationError(self.error_messages["invalid_choice"], code="invalid_choice")
+
+
 class FirmaForm(forms.ModelForm):
     """
     Das Formular für einen neuen Firma Eintrag.
@@ -58,7 +113,7 @@ class StundenAufzeichnungForm(forms.ModelForm):
     <i class="glyphicon glyphicon-plus"></i> Neue Firma erstellen</a>
     """
 
-    firma = forms.ModelChoiceField(
+    firma = CachedModelChoiceField(
         label="Firma",
         queryset=Firma.objects.all(),
         help_text=button_firma,
@@ -74,7 +129,7 @@ class StundenAufzeichnungForm(forms.ModelForm):
     <i class="glyphicon glyphicon-plus"></i> Neuen Arbeitnehmer erstellen</a>
     """
 
-    arbeitnehmer = forms.ModelChoiceField(
+    arbeitnehmer = CachedModelChoiceField(
         label="Arbeitnehmer",
         queryset=Arbeitnehmer.objects.all(),
         help_text=button_arbeitnehmer,
@@ -104,6 +159,17 @@ class StundenAufzeichnungForm(forms.ModelForm):
         )
         super(StundenAufzeichnungForm, self).__init__(*args, **kwargs)
 
+    def _get_validation_exclusions(self):
+        """
+        Firma und Arbeitnehmer hat das CachedModelChoiceField schon geprüft,
+        ForeignKey.validate würde sie mit je einer Abfrage noch einmal suchen.
+        """
+        exclude = super(StundenAufzeichnungForm, self)._get_validation_exclusions()
+        for name, field in self.fields.items():
+            if isinstance(field, CachedModelChoiceField) and name not in exclude:
+                exclude.append(name)
+        return exclude
+
 
 class RechnungsForm(forms.Form):
     """
@@ -112,7 +178,7 @@ class RechnungsForm(forms.Form):
     last_month = date.today() + relativedelta(months=-1)
     last_month_formated = last_month.strftime("%m-%Y")
 
-    firma = forms.ModelChoiceField(
+    firma = CachedModelChoiceField(
         label="Rechnungsempfänger",
         queryset=Firma.objects.all(),
         required=True,
@@ -171,7 +237,7 @@ class RechnungsForm(forms.Form):
         required=False,
     )
 
-    meine_daten = forms.ModelChoiceField(
+    meine_daten = CachedModelChoiceField(
     label="Arbeitnehmer",
     queryset=Arbeitnehmer.objects.all(),
     initial = "1",
@@ -182,15 +248,9 @@ class RechnungsForm(forms.Form):
         """
         Fügt Feldern CSS und Bootstrap Styling hinzu.
         """
-        try:
-            letzte_rechnungsnummer = Rechnungsnummer.objects.latest(
-                "rechnungsnummer_datum").rechnungsnummer
-            neue_rechnungsnummer = "IT-{}".format(int(letzte_rechnungsnummer.split("-")[-1]) + 1)
-        except:
-            neue_rechnungsnummer = ""
-        kwargs.update(initial={
-            "rechnungs_nummer": neue_rechnungsnummer,
-        })
+        initial = {"rechnungs_nummer": get_naechste_rechnungsnummer()}
+        initial.update(kwargs.get("initial") or {})
+        kwargs["initial"] = initial
         self.helper = FormHelper()
         self.helper.form_tag = False
         self.helper.help_text_inline = True
@@ -215,7 +275,7 @@ class RechnungsSummeForm(forms.Form):
     Das Formular für die Rechnung.
     """
 
-    firma = forms.ModelChoiceField(
+    firma = CachedModelChoiceField(
         label="Rechnungsempfänger",
         queryset=Firma.objects.all(),
         required=True,
@@ -273,7 +333,7 @@ class RechnungsSummeForm(forms.Form):
         required=False,
     )
 
-    meine_daten = forms.ModelChoiceField(
+    meine_daten = CachedModelChoiceField(
         label="Arbeitnehmer",
         queryset=Arbeitnehmer.objects.all(),
         initial = "1",
@@ -284,14 +344,8 @@ class RechnungsSummeForm(forms.Form):
         """
         Fügt Feldern CSS und Bootstrap Styling hinzu.
         """
-        try:
-            letzte_rechnungsnummer = Rechnungsnummer.objects.latest(
-                "rechnungsnummer_datum").rechnungsnummer
-            neue_rechnungsnummer = "IT-{}".format(int(letzte_rechnungsnummer.split("-")[-1]) + 1)
-        except:
-            neue_rechnungsnummer = ""
         kwargs.update(initial={
-            "rechnungs_nummer": neue_rechnungsnummer,
+            "rechnungs_nummer": get_naechste_rechnungsnummer(),
         })
         self.helper = FormHelper()
         self.helper.form_tag = False
@@ -312,15 +366,197 @@ class RechnungsSummeForm(forms.Form):
         super(RechnungsSummeForm, self).__init__(*args, **kwargs)
 
 
+class StundenFilterForm(forms.Form):
+    """
+    Das Formular für die Filter der Stundenaufzeichnungen beim Export und
+    in den Listen. Alle Felder sind optional.
+    """
+    BEZAHLT_CHOICES = (
+        ("", "Alle"),
+        ("ja", "Bezahlt"),
+        ("nein", "Nicht bezahlt"),
+    )
+
+    von = forms.DateField(label="Von", required=False)
+
+    bis = forms.DateField(label="Bis", required=False)
+
+    firma = CachedModelChoiceField(
+        label="Firma",
+        queryset=Firma.objects.all(),
+        empty_label="Alle",
+        required=False,
+    )
+
+    arbeitnehmer = CachedModelChoiceField(
+        label="Arbeitnehmer",
+        queryset=Arbeitnehmer.objects.all(),
+        empty_label="Alle",
+        required=False,
+    )
+
+    bezahlt = forms.ChoiceField(label="Bezahlt", choices=BEZAHLT_CHOICES, required=False)
+
+    def __init__(self, *args, **kwargs):
+        self.helper = FormHelper()
+        self.helper.form_tag = False
+        self.helper.label_class = "col-lg-2"
+        self.helper.field_class = "col-lg-4"
+        self.helper.layout = Layout(
+            Field(AppendedText("von", '<span class="glyphicon glyphicon-calendar"</span>',)),
+            Field(AppendedText("bis", '<span class="glyphicon glyphicon-calendar"</span>',)),
+            Field("firma"),
+            Field("arbeitnehmer"),
+            Field("bezahlt"),
+        )
+        super(StundenFilterForm, self).__init__(*args, **kwargs)
+
+    def clean(self):
+        """
+        Ein Validator, der prüft, ob "Von" vor "Bis" liegt.
+        """
+        cleaned_data = super(StundenFilterForm, self).clean()
+        von = cleaned_data.get("von")
+        bis = cleaned_data.get("bis")
+        if von and bis and von > bis:
+            raise forms.ValidationError("Das Datum \"Von\" muss vor \"Bis\" liegen!")
+        return cleaned_data
+
+    def filter(self, queryset):
+        """
+        Filtert ein StundenAufzeichnung Queryset nach den Werten des Formulars.
+        """
+        von = self.cleaned_data.get("von")
+        bis = self.cleaned_data.get("bis")
+        firma = self.cleaned_data.get("firma")
+        arbeitnehmer = self.cleaned_data.get("arbeitnehmer")
+        bezahlt = self.cleaned_data.get("bezahlt")
+        if von:
+            queryset = queryset.filter(datum__gte=von)
+        if bis:
+            queryset = queryset.filter(datum__lte=bis)
+        if firma:
+            queryset = queryset.filter(firma=firma)
+        if arbeitnehmer:
+            queryset = queryset.filter(arbeitnehmer=arbeitnehmer)
+        if bezahlt:
+            queryset = queryset.filter(bezahlt=bezahlt == "ja")
+        return queryset
+
+
+class DashboardForm(forms.Form):
+    """
+    Das Formular für die Auswahl auf dem Dashboard.
+    Ohne Quartal gilt das ganze Jahr, Firma und Arbeitnehmer sind optional.
+    """
+    QUARTAL_CHOICES = (
+        ("", "Ganzes Jahr"),
+        ("1", "1. Quartal"),
+        ("2", "2. Quartal"),
+        ("3", "3. Quartal"),
+        ("4", "4. Quartal"),
+    )
+
+    jahr = forms.IntegerField(label="Jahr", min_value=1900, max_value=2999)
+
+    quartal = forms.ChoiceField(label="Quartal", choices=QUARTAL_CHOICES, required=False)
+
+    firma = CachedModelChoiceField(
+        label="Firma",
+        queryset=Firma.objects.all(),
+        empty_label="Alle",
+        required=False,
+    )
+
+    arbeitnehmer = CachedModelChoiceField(
+        label="Arbeitnehmer",
+        queryset=Arbeitnehmer.objects.all(),
+        empty_label="Alle",
+        required=False,
+    )
+
+    def __init__(self, *args, **kwargs):
+        self.helper = FormHelper()
+        self.helper.form_tag = False
+        self.helper.label_class = "col-lg-2"
+        self.helper.field_class = "col-lg-4"
+        self.helper.layout = Layout(
+            Field("jahr"),
+            Field("quartal"),
+            Field("firma"),
+            Field("arbeitnehmer"),
+        )
+        super(DashboardForm, self).__init__(*args, **kwargs)
+
+    def zeitraum(self):
+        """
+        Der erste und der letzte Monat des gewählten Zeitraums.
+        """
+        jahr = self.cleaned_data["jahr"]
+        quartal = self.cleaned_data.get("quartal")
+        if quartal:
+            erster = (int(quartal) - 1) * 3 + 1
+            return date(jahr, erster, 1), date(jahr, erster + 2, 1)
+        return date(jahr, 1, 1), date(jahr, 12, 1)
+
+    def filter(self, queryset):
+        """
+        Filtert ein MonatsSumme Queryset nach den Werten des Formulars.
+        """
+        von, bis = self.zeitraum()
+        queryset = queryset.filter(monat__gte=von, monat__lte=bis)
+        firma = self.cleaned_data.get("firma")
+        arbeitnehmer = self.cleaned_data.get("arbeitnehmer")
+        if firma:
+            queryset = queryset.filter(firma=firma)
+        if arbeitnehmer:
+            queryset = queryset.filter(arbeitnehmer=arbeitnehmer)
+        return queryset
+
+
+class SucheForm(forms.Form):
+    """
+    Das Formular für die Suche in den Protokollen.
+    """
+    q = forms.CharField(
+        label="Suche",
+        max_length=200,
+        help_text="(Alle Wörter müssen vorkommen, auch als Wortanfang)",
+        required=True,
+    )
+
+    def __init__(self, *args, **kwargs):
+        self.helper = FormHelper()
+        self.helper.form_tag = False
+        self.helper.label_class = "col-lg-2"
+        self.helper.field_class = "col-lg-6"
+        self.helper.layout = Layout(
+            Field("q"),
+        )
+        super(SucheForm, self).__init__(*args, **kwargs)
+
+
 class UploadFileForm(forms.Form):
     """
     Das Formular für den File Upload auf JSON Import.
     """
     json_file = forms.FileField(
-        label="JSON Datei",
+        label="JSON oder Backup Datei",
         required=True,
     )
 
+    dry_run = forms.BooleanField(
+        label="Nur prüfen",
+        help_text="(Prüft alle Einträge, ohne Daten zu ändern)",
+        required=False,
+    )
+
+    upsert = forms.BooleanField(
+        label="Abgleichen",
+        help_text="(Upsert: bestehende Einträge werden aktualisiert, Firma und Arbeitnehmer über den Namen)",
+        required=False,
+    )
+
     def __init__(self, *args, **kwargs):
         self.helper = FormHelper()
         self.helper.form_tag = False
@@ -330,9 +566,10 @@ class UploadFileForm(forms.Form):
 
     def clean_json_file(self):
         """
-        Ein Validator, der prüft, ob die Dateiendung ".json" lautet.
+        Ein Validator, der prüft, ob die Dateiendung ".json" oder bei einem
+        Backup Archiv ".zip" lautet.
         """
         data = self.cleaned_data["json_file"]
-        if str(data).split(".")[-1] != "json":
-            raise forms.ValidationError("Das ist keine JSON Datei!")
+        if str(data).split(".")[-1] not in ("json", "zip"):
+            raise forms.ValidationError("Das ist keine JSON oder Backup Datei!")
         return data
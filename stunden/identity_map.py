@@ -0,0 +1,89 @@
+import threading
+from .models import Firma, Arbeitnehmer
+from .cache import get_zeilen
+from django.db import DEFAULT_DB_ALIAS
+
+
+# Die kleinen Models, deren Einträge pro Request nur einmal erstellt werden.
+IDENTITY_MAP_MODELS = (Firma, Arbeitnehmer)
+
+_lokal = threading.local()
+
+
+class IdentityMap(object):
+    """
+    Hält jede Firma und jeden Arbeitnehmer höchstens einmal als Objekt.
+    Die Werte kommen aus get_zeilen, also aus dem Cache, und nur nach einer
+    Änderung des Models aus der Datenbank. Views, Formulare und Templates
+    eines Requests bekommen damit dasselbe Objekt für denselben Eintrag.
+    """
+    def __init__(self):
+        self.objekte = {}
+        self.zeilen = {}
+
+    def get(self, model, pk):
+        """
+        Liefert den Eintrag eines Models. Löst model.DoesNotExist aus, wenn
+        es ihn nicht gibt.
+        """
+        key = (model, pk)
+        obj = self.objekte.get(key)
+        if obj is None:
+            if model not in self.zeilen:
+                self.zeilen[model] = get_zeilen(model)
+            values = self.zeilen[model].get(pk)
+            if values is None:
+                raise model.DoesNotExist(
+                    "{} mit pk {} existiert nicht.".format(model._meta.verbose_name, pk)
+                )
+            attnames = [field.attname for field in model._meta.concrete_fields]
+            obj = model.from_db(DEFAULT_DB_ALIAS, attnames, values)
+            self.objekte[key] = obj
+        return obj
+
+    def verbinden(self, rows):
+        """
+        Setzt bei jedem Objekt in rows die ForeignKeys auf Models aus
+        IDENTITY_MAP_MODELS auf die Objekte der IdentityMap. Die Abfrage der
+        rows braucht damit kein select_related. Returniert rows als Liste.
+        """
+        rows = list(rows)
+        if not rows:
+            return rows
+        felder = [
+            field for field in rows[0]._meta.concrete_fields
+            if field.many_to_one and field.related_model in IDENTITY_MAP_MODELS
+        ]
+        for row in rows:
+            for field in felder:
+                pk = getattr(row, field.attname)
+                if pk is not None:
+                    setattr(row, field.name, self.get(field.related_model, pk))
+        return rows
+
+
+def get_identity_map():
+    """
+    Die IdentityMap des laufenden Requests. Außerhalb eines Requests mit
+    IdentityMapMiddleware gibt es jedes Mal eine neue.
+    """
+    identity_map = getattr(_lokal, "identity_map", None)
+    if identity_map is None:
+        identity_map = IdentityMap()
+    return identity_map
+
+
+class IdentityMapMiddleware(object):
+    """
+    Legt für jeden Request eine eigene IdentityMap an, siehe
+    get_identity_map.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _lokal.identity_map = IdentityMap()
+        try:
+            return self.get_response(request)
+        finally:
+            _lokal.identity_map = None
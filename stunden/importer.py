@@ -0,0 +1,760 @@
+import codecs
+import json
+import logging
+import queue
+import threading
+import time
+from contextlib import closing
+from .cache import bump_model_version
+from .models import StundenAufzeichnung, ZeitstempelModel
+from .rollup import monatssummen_neu_berechnen, rollup_pausiert
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers import python as python_serializer
+from django.core.serializers.base import DeserializationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+# Standardwerte, falls in den Django Settings nichts eingestellt ist.
+IMPORT_BATCH_SIZE = 500
+IMPORT_TRANSAKTION = "gesamt"
+IMPORT_CHUNK_SIZE = 64 * 1024
+# Höchstens so viele Fehler werden bei einer Prüfung gesammelt.
+IMPORT_MAX_FEHLER = 1000
+# Parser und Writer laufen in eigenen Threads, dazwischen höchstens so
+# viele fertige Batches. Unter SQLite auf einer schnellen Platte bremst
+# der GIL beide Stufen, daher standardmäßig aus.
+IMPORT_PIPELINE = False
+IMPORT_QUEUE_SIZE = 4
+
+# Markiert das Ende der Parser Stufe.
+_PARSER_ENDE = object()
+
+
+class ImportErgebnis(object):
+    """
+    Das Ergebnis eines Imports mit Anzahl, Dauer und Durchsatz.
+    Bei einer Prüfung ohne Schreiben (Dry-Run) enthält fehler die Fehler
+    pro Zeile. gesamt ist die erwartete Anzahl, falls sie bekannt ist.
+    Die Zeiten der Stufen in Sekunden: zeit_parser für Lesen und
+    Deserialisieren, zeit_writer für das Schreiben in die Datenbank und
+    zeit_warten für das Warten des Writers auf den Parser.
+    """
+    def __init__(self, anzahl=0, dauer=0.0, gesamt=None):
+        self.anzahl = anzahl
+        self.dauer = dauer
+        self.gesamt = gesamt
+        self.fehler = []
+        self.zeit_parser = 0.0
+        self.zeit_writer = 0.0
+        self.zeit_warten = 0.0
+        # Nur beim Upsert Import.
+        self.neu = 0
+        self.geaendert = 0
+        self.unveraendert = 0
+
+    @property
+    def zeilen_pro_sekunde(self):
+        """
+        Der Durchsatz des Imports in Zeilen pro Sekunde.
+        """
+        if not self.dauer:
+            return self.anzahl
+        return int(self.anzahl / self.dauer)
+
+
+def get_batch_size():
+    """
+    Liefert die Anzahl der Objekte, die gemeinsam geschrieben werden.
+    Einstellbar über STUNDEN_IMPORT_BATCH_SIZE in den Settings.
+    """
+    return max(1, int(getattr(settings, "STUNDEN_IMPORT_BATCH_SIZE", IMPORT_BATCH_SIZE)))
+
+
+def get_transaktion():
+    """
+    Liefert den Transaktionsmodus des Imports.
+    "gesamt": Der ganze Import läuft in einer Transaktion.
+    "batch": Jeder Batch läuft in einer eigenen Transaktion.
+    Einstellbar über STUNDEN_IMPORT_TRANSAKTION in den Settings.
+    """
+    transaktion = getattr(settings, "STUNDEN_IMPORT_TRANSAKTION", IMPORT_TRANSAKTION)
+    if transaktion not in ("gesamt", "batch"):
+        raise ValueError("STUNDEN_IMPORT_TRANSAKTION muss 'gesamt' oder 'batch' sein.")
+    return transaktion
+
+
+def get_queue_size():
+    """
+    Liefert die Anzahl der Batches, die der Parser dem Writer voraus sein darf.
+    Einstellbar über STUNDEN_IMPORT_QUEUE_SIZE in den Settings.
+    Mit STUNDEN_IMPORT_PIPELINE = False laufen beide Stufen nacheinander
+    im selben Thread.
+    """
+    if not getattr(settings, "STUNDEN_IMPORT_PIPELINE", IMPORT_PIPELINE):
+        return 0
+    return max(1, int(getattr(settings, "STUNDEN_IMPORT_QUEUE_SIZE", IMPORT_QUEUE_SIZE)))
+
+
+def read_chunks(json_file, chunk_size):
+    """
+    Liest eine Datei stückweise und liefert die Stücke als Text.
+    Hochgeladene Dateien von Django werden über chunks() direkt von der
+    temporären Datei gelesen.
+    """
+    if hasattr(json_file, "chunks"):
+        chunks = json_file.chunks(chunk_size)
+    else:
+        chunks = iter(lambda: json_file.read(chunk_size), json_file.read(0))
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        if chunk:
+            yield chunk
+    rest = decoder.decode(b"", final=True)
+    if rest:
+        yield rest
+
+
+def iter_json_array(json_file, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Ein inkrementeller Parser für ein JSON Array, wie es der Export erzeugt.
+    Die Elemente des Arrays werden einzeln geliefert, sobald sie vollständig
+    gelesen sind. Im Speicher liegt nur das aktuelle Stück der Datei und
+    nicht die ganze Datei.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    # Zustände: "start", "wert_oder_ende", "wert", "trenner", "ende"
+    zustand = "start"
+
+    for chunk in read_chunks(json_file, chunk_size):
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\n\r":
+                position += 1
+            if position >= len(buffer):
+                break
+            zeichen = buffer[position]
+
+            if zustand == "start":
+                if zeichen != "[":
+                    raise DeserializationError("Die JSON Datei muss mit einem Array beginnen.")
+                zustand = "wert_oder_ende"
+                position += 1
+            elif zustand == "trenner":
+                if zeichen == ",":
+                    zustand = "wert"
+                elif zeichen == "]":
+                    zustand = "ende"
+                else:
+                    raise DeserializationError(
+                        "Unerwartetes Zeichen {!r} in der JSON Datei.".format(zeichen)
+                    )
+                position += 1
+            elif zustand == "wert_oder_ende" and zeichen == "]":
+                zustand = "ende"
+                position += 1
+            elif zustand in ("wert_oder_ende", "wert"):
+                try:
+                    wert, position_neu = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    # Das Element ist noch nicht vollständig gelesen.
+                    break
+                position = position_neu
+                zustand = "trenner"
+                yield wert
+            else:
+                raise DeserializationError("Daten nach dem Ende des JSON Arrays.")
+        buffer = buffer[position:]
+
+    if zustand != "ende":
+        raise DeserializationError("Die JSON Datei ist unvollständig oder fehlerhaft.")
+
+
+def deserialize_rows(rows):
+    """
+    Deserialisiert Zeilen eines JSON Exports Objekt für Objekt.
+    Fehler werden wie bei serializers.json.Deserializer zu DeserializationError.
+    """
+    try:
+        yield from python_serializer.Deserializer(rows)
+    except (GeneratorExit, DeserializationError):
+        raise
+    except Exception as error:
+        raise DeserializationError(error) from error
+
+
+def deserialize_stream(json_file, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Deserialisiert einen JSON Export Objekt für Objekt.
+    Ersetzt serializers.json.Deserializer, der die ganze Datei auf einmal lädt.
+    """
+    return deserialize_rows(iter_json_array(json_file, chunk_size))
+
+
+def batches(iterable, batch_size):
+    """
+    Teilt ein Iterable in Listen mit höchstens batch_size Elementen auf.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class ParserFehler(object):
+    """
+    Ein Fehler der Parser Stufe, der an den Writer weitergegeben wird.
+    """
+    def __init__(self, error):
+        self.error = error
+
+
+def parser_put(warteschlange, item, stop):
+    """
+    Legt ein Element in die Warteschlange. Wartet, solange sie voll ist,
+    außer der Writer hat aufgehört.
+    """
+    while not stop.is_set():
+        try:
+            warteschlange.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def parser_stage(iterable, batch_size, warteschlange, stop, ergebnis):
+    """
+    Die Parser Stufe: liest und deserialisiert Batches im eigenen Thread.
+    Die Datenbank gehört dem Writer. Nur Dateien mit natürlichen Schlüsseln
+    brauchen hier Abfragen, dafür gibt es den Upsert Import.
+    """
+    try:
+        parser_batches = batches(iterable, batch_size)
+        while not stop.is_set():
+            start = time.perf_counter()
+            batch = next(parser_batches, None)
+            ergebnis.zeit_parser += time.perf_counter() - start
+            if batch is None:
+                break
+            parser_put(warteschlange, batch, stop)
+        parser_put(warteschlange, _PARSER_ENDE, stop)
+    except Exception as error:
+        parser_put(warteschlange, ParserFehler(error), stop)
+    finally:
+        connection.close()
+
+
+def pipeline_batches(iterable, batch_size, ergebnis, queue_size=None):
+    """
+    Liefert die Batches eines Iterables für die Writer Stufe.
+    Das Iterable wird in einem eigenen Thread gelesen, damit Parsen und
+    Schreiben gleichzeitig laufen. Die Warteschlange dazwischen ist auf
+    queue_size Batches begrenzt, damit der Parser nicht die ganze Datei
+    in den Speicher liest. Fehler des Parsers werden hier geworfen.
+    """
+    if queue_size is None:
+        queue_size = get_queue_size()
+
+    if not queue_size:
+        parser_batches = batches(iterable, batch_size)
+        while True:
+            start = time.perf_counter()
+            batch = next(parser_batches, None)
+            ergebnis.zeit_parser += time.perf_counter() - start
+            if batch is None:
+                return
+            yield batch
+
+    warteschlange = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    parser = threading.Thread(
+        target=parser_stage,
+        args=(iterable, batch_size, warteschlange, stop, ergebnis),
+        name="stunden-import-parser",
+        daemon=True,
+    )
+    parser.start()
+    try:
+        while True:
+            start = time.perf_counter()
+            item = warteschlange.get()
+            ergebnis.zeit_warten += time.perf_counter() - start
+            if item is _PARSER_ENDE:
+                return
+            if isinstance(item, ParserFehler):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        parser.join()
+
+
+def log_stufen(ergebnis):
+    """
+    Loggt die Zeiten der Parser und Writer Stufe.
+    """
+    logger.info(
+        "JSON Import Stufen: Parser %.2f s, Writer %.2f s, Writer wartet %.2f s",
+        ergebnis.zeit_parser,
+        ergebnis.zeit_writer,
+        ergebnis.zeit_warten,
+    )
+
+
+def zeitstempel_setzen(objects):
+    """
+    Setzt den Zeitstempel der letzten Änderung auf jetzt. bulk_create und
+    das raw save der deserialisierten Objekte umgehen ZeitstempelModel.save,
+    mit dem Zeitstempel aus der Datei würden importierte Einträge im Delta
+    Export fehlen.
+    """
+    jetzt = timezone.now()
+    for obj in objects:
+        if isinstance(obj, ZeitstempelModel):
+            obj.updated = jetzt
+
+
+def save_batch(deserialized_objects, batch_size):
+    """
+    Speichert einen Batch deserialisierter Objekte.
+    Pro Model wird mit einer Abfrage geprüft, welche Primary Keys schon
+    existieren. Neue Objekte werden mit bulk_create eingefügt, bestehende
+    Objekte ohne weitere Existenzprüfung direkt überschrieben. updated wird
+    für alle auf jetzt gesetzt, siehe zeitstempel_setzen.
+    """
+    zeitstempel_setzen(obj.object for obj in deserialized_objects)
+    models = {}
+    for deserialized_object in deserialized_objects:
+        model = deserialized_object.object.__class__
+        models.setdefault(model, []).append(deserialized_object)
+
+    for model, objects in models.items():
+        pks = [obj.object.pk for obj in objects if obj.object.pk is not None]
+        existing = set(model._default_manager.filter(pk__in=pks).values_list("pk", flat=True))
+        neue = [obj.object for obj in objects if obj.object.pk not in existing]
+        if neue:
+            model._default_manager.bulk_create(neue, batch_size=batch_size)
+        # bulk_update gibt es erst ab Django 2.2, daher ein UPDATE pro Objekt.
+        for obj in objects:
+            if obj.object.pk in existing:
+                obj.save(force_update=True)
+    return models.keys()
+
+
+def reset_sequences(models):
+    """
+    Setzt die Sequenzen der Primary Keys nach dem Import zurück,
+    damit neue Einträge keine importierten Primary Keys verwenden.
+    Wie bei loaddata, unter SQLite passiert hier nichts.
+    """
+    sequence_sql = connection.ops.sequence_reset_sql(no_style(), list(models))
+    if sequence_sql:
+        with connection.cursor() as cursor:
+            for line in sequence_sql:
+                cursor.execute(line)
+
+
+def nach_import(importierte_models):
+    """
+    Räumt nach einem Import auf, auch nach einem Fehler, weil im Modus
+    "batch" schon Batches geschrieben sein können. bulk_create löst keine
+    Signale aus, daher werden die Versionen hier erhöht und die während des
+    Imports pausierten MonatsSummen neu berechnet.
+    """
+    reset_sequences(importierte_models)
+    if StundenAufzeichnung in importierte_models:
+        monatssummen_neu_berechnen()
+    for model in importierte_models:
+        bump_model_version(model)
+
+
+def import_objects(deserialized_objects, batch_size=None, transaktion=None, fortschritt=None):
+    """
+    Importiert deserialisierte Objekte in Batches.
+    Das Deserialisieren läuft als Parser Stufe in einem eigenen Thread
+    und überlappt mit dem Schreiben, siehe pipeline_batches.
+    Im Modus "gesamt" wird bei einem Fehler der ganze Import zurückgerollt,
+    im Modus "batch" nur der Batch, in dem der Fehler aufgetreten ist.
+    fortschritt wird nach jedem Batch mit dem ImportErgebnis aufgerufen.
+    Returniert wird ein ImportErgebnis.
+    """
+    batch_size = batch_size or get_batch_size()
+    transaktion = transaktion or get_transaktion()
+    ergebnis = ImportErgebnis()
+    importierte_models = set()
+    start = time.perf_counter()
+
+    def import_batches():
+        with closing(pipeline_batches(deserialized_objects, batch_size, ergebnis)) as writer_batches:
+            for batch in writer_batches:
+                writer_start = time.perf_counter()
+                if transaktion == "batch":
+                    with transaction.atomic():
+                        importierte_models.update(save_batch(batch, batch_size))
+                else:
+                    importierte_models.update(save_batch(batch, batch_size))
+                ergebnis.zeit_writer += time.perf_counter() - writer_start
+                ergebnis.anzahl += len(batch)
+                if fortschritt:
+                    fortschritt(ergebnis)
+
+    try:
+        with rollup_pausiert():
+            if transaktion == "batch":
+                import_batches()
+            else:
+                with transaction.atomic():
+                    import_batches()
+    finally:
+        nach_import(importierte_models)
+
+    ergebnis.dauer = time.perf_counter() - start
+    logger.info(
+        "JSON Import: %s Einträge in %.2f Sekunden (%s Einträge pro Sekunde)",
+        ergebnis.anzahl,
+        ergebnis.dauer,
+        ergebnis.zeilen_pro_sekunde,
+    )
+    log_stufen(ergebnis)
+    return ergebnis
+
+
+def validate_rows(rows, batch_size=None, fortschritt=None, max_fehler=IMPORT_MAX_FEHLER):
+    """
+    Prüft die Zeilen eines JSON Exports, ohne etwas zu schreiben (Dry-Run).
+    Jede Zeile wird mit build_object erstellt und mit full_clean geprüft.
+    Natürliche Schlüssel, Foreign Keys und eindeutige Felder werden pro
+    Batch und Model mit je einer IN Abfrage gegen die Datenbank geprüft,
+    Einträge aus der Datei selbst zählen dabei mit.
+    Returniert wird ein ImportErgebnis mit den Fehlern pro Zeile.
+    """
+    batch_size = batch_size or get_batch_size()
+    ergebnis = ImportErgebnis()
+    start = time.perf_counter()
+    # Primary Keys und eindeutige Werte aus der Datei, pro Model.
+    gesehen = {}
+    gesehen_unique = {}
+
+    def fehler_melden(zeile, row, meldung):
+        if len(ergebnis.fehler) < max_fehler:
+            ergebnis.fehler.append({
+                "zeile": zeile,
+                "model": row.get("model") if isinstance(row, dict) else None,
+                "pk": row.get("pk") if isinstance(row, dict) else None,
+                "fehler": meldung,
+            })
+
+    for batch in batches(enumerate(rows, 1), batch_size):
+        objekte = []
+        aufgeloest = natural_keys_nachschlagen(row for zeile, row in batch)
+        for zeile, row in batch:
+            try:
+                obj = build_object(natural_keys_einsetzen(row, aufgeloest))
+            except (DeserializationError, LookupError, KeyError, TypeError, AttributeError,
+                    ValueError, FieldDoesNotExist) as error:
+                fehler_melden(zeile, row, "Ungültige Daten: {}".format(error))
+                continue
+            foreign_keys = [field.name for field in obj._meta.fields if field.is_relation]
+            try:
+                obj.full_clean(exclude=foreign_keys, validate_unique=False)
+            except ValidationError as error:
+                fehler_melden(zeile, row, "; ".join(error.messages))
+                continue
+            objekte.append((zeile, row, obj))
+
+        models = {}
+        for zeile, row, obj in objekte:
+            models.setdefault(obj.__class__, []).append((zeile, row, obj))
+
+        for model, model_objekte in models.items():
+            # Fehlende Primary Keys über den natürlichen Schlüssel suchen.
+            key_field = natural_key_field(model)
+            ohne_pk = [obj for zeile, row, obj in model_objekte if obj.pk is None]
+            if key_field and ohne_pk:
+                pks = dict(model._default_manager.filter(**{
+                    "{}__in".format(key_field): [getattr(obj, key_field) for obj in ohne_pk],
+                }).values_list(key_field, "pk"))
+                for obj in ohne_pk:
+                    obj.pk = pks.get(getattr(obj, key_field))
+
+            # Foreign Keys mit einer Abfrage pro Feld prüfen.
+            for field in model._meta.fields:
+                if not field.is_relation:
+                    continue
+                related_model = field.related_model
+                ids = {getattr(obj, field.attname) for zeile, row, obj in model_objekte}
+                ids -= gesehen.get(related_model, set())
+                ids.discard(None)
+                vorhanden = set(related_model._default_manager.filter(
+                    pk__in=ids).values_list("pk", flat=True))
+                for zeile, row, obj in model_objekte:
+                    wert = getattr(obj, field.attname)
+                    if wert in ids and wert not in vorhanden:
+                        fehler_melden(zeile, row, "{} {} existiert nicht.".format(
+                            related_model._meta.verbose_name, wert))
+
+            # Eindeutige Felder mit einer Abfrage pro Feld prüfen.
+            for field in model._meta.fields:
+                if not field.unique or field.primary_key:
+                    continue
+                werte = gesehen_unique.setdefault((model, field.name), {})
+                for zeile, row, obj in model_objekte:
+                    wert = getattr(obj, field.attname)
+                    if wert in werte and werte[wert] != obj.pk:
+                        fehler_melden(zeile, row, "{} {!r} kommt mehrfach in der Datei vor.".format(
+                            field.verbose_name, wert))
+                    werte[wert] = obj.pk
+                belegt = dict(model._default_manager.filter(**{
+                    "{}__in".format(field.name): [
+                        getattr(obj, field.attname) for zeile, row, obj in model_objekte
+                    ],
+                }).values_list(field.name, "pk"))
+                for zeile, row, obj in model_objekte:
+                    wert = getattr(obj, field.attname)
+                    if wert in belegt and belegt[wert] != obj.pk:
+                        fehler_melden(zeile, row, "{} {!r} existiert bereits mit einem anderen "
+                                           "Primary Key.".format(field.verbose_name, wert))
+
+            gesehen.setdefault(model, set()).update(obj.pk for zeile, row, obj in model_objekte)
+
+        ergebnis.anzahl += len(batch)
+        if fortschritt:
+            fortschritt(ergebnis)
+
+    ergebnis.fehler.sort(key=lambda fehler: fehler["zeile"])
+    ergebnis.dauer = time.perf_counter() - start
+    return ergebnis
+
+
+def natural_key_field(model):
+    """
+    Das Feld des natürlichen Schlüssels eines Models oder None.
+    """
+    return getattr(model._default_manager, "natural_key_field", None)
+
+
+def natural_keys_nachschlagen(rows):
+    """
+    Sucht die natürlichen Schlüssel in Foreign Keys, z.B. ["Monty Python"],
+    mit einer IN Abfrage pro Model in der Datenbank.
+    Returniert ein dict {Model: {Schlüssel: Primary Key}}. Zeilen mit
+    ungültigem Model oder Feld und Models ohne natürlichen Schlüssel werden
+    übersprungen, die Fehler liefert natural_keys_einsetzen pro Zeile.
+    """
+    gesucht = {}
+    for row in rows:
+        try:
+            model = apps.get_model(row["model"])
+            for name, value in row["fields"].items():
+                field = model._meta.get_field(name)
+                if field.is_relation and isinstance(value, (list, tuple)) and value:
+                    gesucht.setdefault(field.related_model, set()).add(value[0])
+        except (LookupError, KeyError, TypeError, AttributeError, ValueError, FieldDoesNotExist):
+            continue
+
+    aufgeloest = {}
+    for model, keys in gesucht.items():
+        field = natural_key_field(model)
+        if field is not None:
+            aufgeloest[model] = dict(model._default_manager.filter(**{
+                "{}__in".format(field): keys,
+            }).values_list(field, "pk"))
+    return aufgeloest
+
+
+def natural_keys_einsetzen(row, aufgeloest):
+    """
+    Ersetzt die natürlichen Schlüssel in den Foreign Keys einer Zeile durch
+    die Primary Keys aus natural_keys_nachschlagen.
+    Nicht gefundene Schlüssel werden zu DeserializationError.
+    """
+    model = apps.get_model(row["model"])
+    for name, value in row["fields"].items():
+        field = model._meta.get_field(name)
+        if field.is_relation and isinstance(value, (list, tuple)):
+            if natural_key_field(field.related_model) is None:
+                raise DeserializationError("{} hat keinen natürlichen Schlüssel.".format(
+                    field.related_model._meta.label_lower))
+            try:
+                row["fields"][name] = aufgeloest[field.related_model][value[0]]
+            except (KeyError, IndexError):
+                raise DeserializationError("{} {!r} existiert nicht.".format(
+                    field.related_model._meta.verbose_name, value[0] if value else None))
+    return row
+
+
+def resolve_natural_foreign_keys(rows):
+    """
+    Ersetzt natürliche Schlüssel in Foreign Keys, z.B. ["Monty Python"],
+    durch Primary Keys. Pro Model wird dafür nur eine IN Abfrage gemacht.
+    Nicht gefundene Schlüssel werden zu DeserializationError.
+    """
+    aufgeloest = natural_keys_nachschlagen(rows)
+    for row in rows:
+        natural_keys_einsetzen(row, aufgeloest)
+    return rows
+
+
+def build_object(row):
+    """
+    Erstellt eine Model Instanz aus einer Zeile eines JSON Exports.
+    Anders als der Django Deserializer wird ein fehlender Primary Key nicht
+    pro Zeile über den natürlichen Schlüssel in der Datenbank gesucht.
+    """
+    try:
+        model = apps.get_model(row["model"])
+        data = {}
+        for name, value in row["fields"].items():
+            field = model._meta.get_field(name)
+            if field.is_relation:
+                data[field.attname] = field.target_field.to_python(value)
+            else:
+                data[field.attname] = field.to_python(value)
+        obj = model(**data)
+        obj.pk = model._meta.pk.to_python(row.get("pk"))
+    except (LookupError, KeyError, TypeError, ValueError, ValidationError, FieldDoesNotExist) as error:
+        raise DeserializationError.WithData(error, row.get("model"), row.get("pk"), None)
+    return obj
+
+
+def vergleichswert(obj, field):
+    """
+    Der Wert eines Feldes so, wie er im JSON Export steht.
+    Damit gelten Zeiten mit Mikrosekunden nicht als Änderung.
+    """
+    return DjangoJSONEncoder().encode(getattr(obj, field.attname))
+
+
+def letzte_pro_schluessel(objects, key_field):
+    """
+    Entfernt doppelte Schlüssel aus den Objekten eines Batches, wie bei
+    einem Import Zeile für Zeile gilt der letzte Eintrag. Objekte ohne
+    Schlüssel bleiben alle erhalten.
+    """
+    letzte = {}
+    for index, obj in enumerate(objects):
+        key = getattr(obj, key_field)
+        if key is not None:
+            letzte[key] = index
+    return [
+        obj for index, obj in enumerate(objects)
+        if getattr(obj, key_field) is None or letzte[getattr(obj, key_field)] == index
+    ]
+
+
+def upsert_batch(rows, batch_size, ergebnis):
+    """
+    Gleicht einen Batch mit der Datenbank ab.
+    Bestehende Einträge werden pro Model mit einer IN Abfrage gesucht, bei
+    Firma und Arbeitnehmer über den natürlichen Schlüssel, sonst über den
+    Primary Key. Neue Einträge werden mit bulk_create eingefügt, geänderte
+    aktualisiert und unveränderte nicht angefasst. Kommt ein Schlüssel im
+    Batch mehrfach vor, gilt der letzte Eintrag, siehe letzte_pro_schluessel.
+    """
+    resolve_natural_foreign_keys(rows)
+    models = {}
+    for row in rows:
+        obj = build_object(row)
+        models.setdefault(obj.__class__, []).append(obj)
+
+    for model, objects in models.items():
+        key_field = natural_key_field(model)
+        objects = letzte_pro_schluessel(objects, key_field or model._meta.pk.attname)
+        if key_field:
+            keys = [getattr(obj, key_field) for obj in objects]
+            bestehende = model._default_manager.filter(**{"{}__in".format(key_field): keys})
+            bestehende = {getattr(obj, key_field): obj for obj in bestehende}
+            for obj in objects:
+                # Primary Keys aus einer anderen Datenbank gelten hier nicht.
+                obj.pk = None
+        else:
+            key_field = model._meta.pk.attname
+            keys = [obj.pk for obj in objects if obj.pk is not None]
+            bestehende = model._default_manager.in_bulk(keys)
+
+        felder = [
+            field for field in model._meta.concrete_fields
+            if not field.primary_key and field.name not in ("created", "updated")
+        ]
+        neue = []
+        for obj in objects:
+            bestehend = bestehende.get(getattr(obj, key_field))
+            if bestehend is None:
+                neue.append(obj)
+                continue
+            obj.pk = bestehend.pk
+            if any(vergleichswert(obj, field) != vergleichswert(bestehend, field) for field in felder):
+                obj.created = bestehend.created
+                obj.save(force_update=True)
+                ergebnis.geaendert += 1
+            else:
+                ergebnis.unveraendert += 1
+        if neue:
+            zeitstempel_setzen(neue)
+            model._default_manager.bulk_create(neue, batch_size=batch_size)
+            ergebnis.neu += len(neue)
+    return models.keys()
+
+
+def upsert_rows(rows, batch_size=None, transaktion=None, fortschritt=None):
+    """
+    Importiert Zeilen eines JSON Exports als Upsert.
+    Ein zweiter Import derselben Datei ändert nichts mehr.
+    Transaktionen und Parser Stufe wie bei import_objects.
+    Returniert wird ein ImportErgebnis.
+    """
+    batch_size = batch_size or get_batch_size()
+    transaktion = transaktion or get_transaktion()
+    ergebnis = ImportErgebnis()
+    importierte_models = set()
+    start = time.perf_counter()
+
+    def upsert_batches():
+        with closing(pipeline_batches(rows, batch_size, ergebnis)) as writer_batches:
+            for batch in writer_batches:
+                writer_start = time.perf_counter()
+                if transaktion == "batch":
+                    with transaction.atomic():
+                        importierte_models.update(upsert_batch(batch, batch_size, ergebnis))
+                else:
+                    importierte_models.update(upsert_batch(batch, batch_size, ergebnis))
+                ergebnis.zeit_writer += time.perf_counter() - writer_start
+                ergebnis.anzahl += len(batch)
+                if fortschritt:
+                    fortschritt(ergebnis)
+
+    try:
+        with rollup_pausiert():
+            if transaktion == "batch":
+                upsert_batches()
+            else:
+                with transaction.atomic():
+                    upsert_batches()
+    finally:
+        nach_import(importierte_models)
+
+    ergebnis.dauer = time.perf_counter() - start
+    logger.info(
+        "JSON Upsert: %s Einträge, %s neu, %s geändert, %s unverändert in %.2f Sekunden",
+        ergebnis.anzahl,
+        ergebnis.neu,
+        ergebnis.geaendert,
+        ergebnis.unveraendert,
+        ergebnis.dauer,
+    )
+    log_stufen(ergebnis)
+    return ergebnis
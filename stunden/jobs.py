@@ -0,0 +1,300 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from .importer import import_objects, deserialize_stream, validate_rows, iter_json_array, upsert_rows
+from .importer import get_transaktion
+from .backup import restore_backup, validate_backup
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.base import DeserializationError
+from django.db import DatabaseError, connections
+
+
+logger = logging.getLogger(__name__)
+
+# Standardwerte, falls in den Django Settings nichts eingestellt ist.
+IMPORT_WORKER = 2
+IMPORT_JOB_TIMEOUT = 24 * 60 * 60
+
+# Der Status der Jobs liegt im Cache, damit jeder Prozess ihn liefern kann.
+# Der Key beginnt bewusst nicht mit "stunden:", der Status ändert sich und
+# darf nicht im lokalen Speicher des ZweistufigerCache landen.
+JOB_KEY = "import_job:{}"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class FortschrittLeser(object):
+    """
+    Liest aus einem Datei Objekt und merkt sich die gelesenen Bytes.
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.gelesen = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.gelesen += len(data)
+        return data
+
+    def seek(self, *args):
+        return self.fileobj.seek(*args)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def seekable(self):
+        return True
+
+
+class ImportJob(object):
+    """
+    Ein JSON Import oder eine Prüfung (Dry-Run), die im Hintergrund läuft.
+    Der Fortschritt wird nach jedem Batch aktualisiert und mit speichern
+    in den Cache geschrieben.
+    Mit upsert werden bestehende Einträge abgeglichen statt überschrieben.
+    Der Transaktionsmodus wird beim Anlegen festgehalten, siehe
+    importer.get_transaktion.
+    """
+    def __init__(self, bereich, dry_run, dateiname, bytes_gesamt, upsert=False):
+        self.id = uuid.uuid4().hex
+        self.bereich = bereich
+        self.dry_run = dry_run
+        self.upsert = upsert
+        self.transaktion = get_transaktion()
+        self.dateiname = dateiname
+        self.status = "wartend"
+        self.meldung = ""
+        self.anzahl = 0
+        self.gesamt = None
+        self.fehler = []
+        self.bytes_gesamt = bytes_gesamt
+        self.leser = None
+        self.start = None
+        self.dauer = 0.0
+        self.neu = 0
+        self.geaendert = 0
+        self.unveraendert = 0
+        self.zeit_parser = 0.0
+        self.zeit_writer = 0.0
+        self.zeit_warten = 0.0
+
+    def fortschritt(self, ergebnis):
+        """
+        Callback für importer und backup, aufgerufen nach jedem Batch.
+        """
+        self.anzahl = ergebnis.anzahl
+        self.gesamt = ergebnis.gesamt
+        self.neu = ergebnis.neu
+        self.geaendert = ergebnis.geaendert
+        self.unveraendert = ergebnis.unveraendert
+        self.zeit_parser = ergebnis.zeit_parser
+        self.zeit_writer = ergebnis.zeit_writer
+        self.zeit_warten = ergebnis.zeit_warten
+        self.dauer = time.perf_counter() - self.start
+        self.speichern()
+
+    def speichern(self):
+        """
+        Schreibt den Status in den Cache, siehe get_job.
+        Die Zeit ist über STUNDEN_IMPORT_JOB_TIMEOUT einstellbar.
+        """
+        cache.set(
+            JOB_KEY.format(self.id),
+            self.as_dict(),
+            getattr(settings, "STUNDEN_IMPORT_JOB_TIMEOUT", IMPORT_JOB_TIMEOUT)
+        )
+
+    @property
+    def gespeichert(self):
+        """
+        Wie viele Einträge trotz eines Fehlers gespeichert bleiben. Nur im
+        Modus "batch" sind die Batches vor dem Fehler schon committed,
+        eine Prüfung und ein Backup schreiben nie teilweise.
+        """
+        if self.status != "fehler" or self.dry_run or self.bereich == "json_import_select_backup" \
+                or self.transaktion != "batch":
+            return 0
+        return self.anzahl
+
+    def fehler_meldung(self, error):
+        """
+        Die Meldung für einen fehlgeschlagenen Import.
+        """
+        if self.gespeichert:
+            return "Der Import ist fehlgeschlagen. Die ersten {} Einträge wurden bereits " \
+                "gespeichert, der Batch mit dem Fehler und alle weiteren nicht: {}".format(
+                    self.gespeichert, error
+                )
+        return "Der Import ist fehlgeschlagen, es wurden keine Daten geändert: {}".format(error)
+
+    @property
+    def fertig(self):
+        """
+        Ob der Job beendet ist, mit oder ohne Fehler.
+        """
+        return self.status in ("fertig", "fehler")
+
+    @property
+    def zeilen_pro_sekunde(self):
+        """
+        Der bisherige Durchsatz in Zeilen pro Sekunde.
+        """
+        if not self.dauer:
+            return 0
+        return int(self.anzahl / self.dauer)
+
+    @property
+    def prozent(self):
+        """
+        Der Fortschritt in Prozent, nach Zeilen falls die Gesamtanzahl
+        bekannt ist, sonst nach gelesenen Bytes.
+        """
+        if self.status == "fertig":
+            return 100
+        if self.gesamt:
+            return min(100, int(100 * self.anzahl / self.gesamt))
+        if self.leser and self.bytes_gesamt:
+            return min(100, int(100 * self.leser.gelesen / self.bytes_gesamt))
+        return 0
+
+    @property
+    def eta(self):
+        """
+        Die geschätzte Restdauer in Sekunden.
+        """
+        if self.fertig or not self.prozent:
+            return None
+        return int(self.dauer * (100 - self.prozent) / self.prozent)
+
+    def as_dict(self):
+        """
+        Der Status des Jobs für den jsonimport_job_status View.
+        """
+        return {
+            "id": self.id,
+            "bereich": self.bereich,
+            "dry_run": self.dry_run,
+            "upsert": self.upsert,
+            "dateiname": self.dateiname,
+            "status": self.status,
+            "meldung": self.meldung,
+            "anzahl": self.anzahl,
+            "gesamt": self.gesamt,
+            "prozent": self.prozent,
+            "zeilen_pro_sekunde": self.zeilen_pro_sekunde,
+            "eta": self.eta,
+            "dauer": round(self.dauer, 2),
+            "neu": self.neu,
+            "geaendert": self.geaendert,
+            "unveraendert": self.unveraendert,
+            "gespeichert": self.gespeichert,
+            "zeit_parser": round(self.zeit_parser, 2),
+            "zeit_writer": round(self.zeit_writer, 2),
+            "zeit_warten": round(self.zeit_warten, 2),
+            "fehler": self.fehler,
+        }
+
+
+def get_executor():
+    """
+    Der lokale Worker Pool für die Import Jobs.
+    Die Anzahl der Worker ist über STUNDEN_IMPORT_WORKER einstellbar.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "STUNDEN_IMPORT_WORKER", IMPORT_WORKER)
+            )
+        return _executor
+
+
+def get_job(job_id):
+    """
+    Liefert den Status eines Jobs als dict wie ImportJob.as_dict oder None.
+    Der Status kommt aus dem Cache, der Job kann also auch in einem
+    anderen Prozess laufen. Alte Jobs verfallen mit dem Cache Eintrag.
+    """
+    return cache.get(JOB_KEY.format(job_id))
+
+
+def run_job(job, pfad, synchron):
+    """
+    Führt einen Import Job mit der hochgeladenen Datei aus.
+    """
+    job.status = "laufend"
+    job.start = time.perf_counter()
+    job.speichern()
+    try:
+        with open(pfad, "rb") as datei:
+            job.leser = FortschrittLeser(datei)
+            if job.bereich == "json_import_select_backup":
+                if job.dry_run:
+                    ergebnis = validate_backup(job.leser, fortschritt=job.fortschritt)
+                else:
+                    ergebnis = restore_backup(job.leser, fortschritt=job.fortschritt)
+            else:
+                if job.dry_run:
+                    ergebnis = validate_rows(
+                        iter_json_array(job.leser),
+                        fortschritt=job.fortschritt
+                    )
+                elif job.upsert:
+                    ergebnis = upsert_rows(
+                        iter_json_array(job.leser),
+                        transaktion=job.transaktion,
+                        fortschritt=job.fortschritt
+                    )
+                else:
+                    ergebnis = import_objects(
+                        deserialize_stream(job.leser),
+                        transaktion=job.transaktion,
+                        fortschritt=job.fortschritt
+                    )
+        job.fortschritt(ergebnis)
+        job.fehler = ergebnis.fehler
+        job.status = "fertig"
+    except (DeserializationError, DatabaseError) as error:
+        logger.warning("JSON Import Job %s fehlgeschlagen: %s", job.id, error)
+        job.status = "fehler"
+        job.meldung = job.fehler_meldung(error)
+    except Exception as error:
+        logger.exception("JSON Import Job %s fehlgeschlagen", job.id)
+        job.status = "fehler"
+        job.meldung = "Unerwarteter Fehler: {}".format(error)
+        if job.gespeichert:
+            job.meldung += " (Die ersten {} Einträge wurden bereits gespeichert.)".format(
+                job.gespeichert
+            )
+    finally:
+        job.dauer = time.perf_counter() - job.start
+        os.remove(pfad)
+        job.speichern()
+        if not synchron:
+            connections.close_all()
+
+
+def start_import_job(upload, bereich, dry_run=False, upsert=False):
+    """
+    Startet einen Import Job für eine hochgeladene Datei.
+    Die Datei wird in eine eigene temporäre Datei kopiert, weil Django die
+    hochgeladene Datei nach dem Request löscht.
+    Mit STUNDEN_IMPORT_SYNCHRON = True läuft der Job direkt im Request.
+    """
+    with tempfile.NamedTemporaryFile(suffix=".upload", delete=False) as kopie:
+        for chunk in upload.chunks():
+            kopie.write(chunk)
+    job = ImportJob(bereich, dry_run, str(upload), upload.size, upsert)
+    job.speichern()
+
+    if getattr(settings, "STUNDEN_IMPORT_SYNCHRON", False):
+        run_job(job, kopie.name, synchron=True)
+    else:
+        get_executor().submit(run_job, job, kopie.name, False)
+    return job
@@ -0,0 +1,18 @@
+import time
+from stunden.rollup import monatssummen_neu_berechnen
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    """
+    Berechnet die MonatsSummen aus allen Stundenaufzeichnungen neu, z.B.
+    nach Änderungen direkt in der Datenbank.
+    """
+    help = "Berechnet die Monatssummen neu."
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        anzahl = monatssummen_neu_berechnen()
+        self.stdout.write("{} Monatssummen in {:.2f} Sekunden berechnet.".format(
+            anzahl, time.perf_counter() - start
+        ))
@@ -0,0 +1,35 @@
+import time
+from stunden.suche import suche_anlegen, suche_entfernen, suche_neu_aufbauen
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+
+class Command(BaseCommand):
+    """
+    Baut den Suchindex der Protokolle neu auf, z.B. nach Änderungen direkt
+    in der Datenbank. Mit --anlegen werden unter SQLite auch die FTS5
+    Tabelle und die Trigger neu angelegt, die verloren gehen, wenn eine
+    Migration die Tabelle der Stundenaufzeichnungen neu baut.
+    """
+    help = "Baut den Suchindex der Protokolle neu auf."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--anlegen",
+            action="store_true",
+            help="Legt Tabelle, Trigger und Index vorher neu an.",
+        )
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with transaction.atomic():
+            if options["anlegen"]:
+                suche_entfernen(connection)
+                suche_anlegen(connection)
+            art = suche_neu_aufbauen(connection)
+        if art is None:
+            self.stdout.write("Kein Suchindex vorhanden, gesucht wird ohne Index.")
+            return
+        self.stdout.write("Suchindex ({}) in {:.2f} Sekunden neu aufgebaut.".format(
+            art, time.perf_counter() - start
+        ))
@@ -0,0 +1,40 @@
+from stunden.template_cache import template_zeiten
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    """
+    Zeigt für jedes Template der App, wie lange Laden und Kompilieren ohne
+    Cache, das Laden über die Engine aus den Settings und das Rendern
+    dauern. Mit den Produktions Settings zeigt die zweite Spalte den
+    cached Loader.
+    """
+    help = "Misst Kompilier- und Renderzeiten der Templates."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--wiederholungen",
+            type=int,
+            default=10,
+            help="Anzahl der Messungen pro Template (Standard 10).",
+        )
+
+    def handle(self, *args, **options):
+        zeiten = template_zeiten(options["wiederholungen"])
+        self.stdout.write("{:<45} {:>12} {:>12} {:>12}".format(
+            "Template", "ohne Cache", "Engine", "Rendern"
+        ))
+        summe_kompilieren = summe_laden = 0
+        for name, kompilieren, laden, rendern in zeiten:
+            summe_kompilieren += kompilieren
+            summe_laden += laden
+            self.stdout.write("{:<45} {:>9.3f} ms {:>9.3f} ms {:>12}".format(
+                name,
+                kompilieren,
+                laden,
+                "{:.3f} ms".format(rendern) if rendern is not None else "-",
+            ))
+        self.stdout.write("{:<45} {:>9.3f} ms {:>9.3f} ms".format(
+            "Summe", summe_kompilieren, summe_laden
+        ))
+        self.stdout.write("Rendern mit leerem Context, \"-\" braucht Daten aus dem View.")
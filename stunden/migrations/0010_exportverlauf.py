@@ -0,0 +1,30 @@
+# Generated by Django 2.0.13 on 2026-10-19 12:28
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stunden', '0009_zeitstempel_loeschung'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportVerlauf',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bereich', models.CharField(max_length=100)),
+                ('exportiert', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Export Verlauf',
+                'verbose_name_plural': 'Export Verlauf',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='exportverlauf',
+            index=models.Index(fields=['bereich', 'exportiert'], name='stunden_exp_bereich_cbcb1c_idx'),
+        ),
+    ]
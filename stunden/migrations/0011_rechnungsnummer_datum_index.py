@@ -0,0 +1,18 @@
+# Generated by Django 2.0.13 on 2026-10-19 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stunden', '0010_exportverlauf'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='rechnungsnummer',
+            name='rechnungsnummer_datum',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
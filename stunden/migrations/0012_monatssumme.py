@@ -0,0 +1,43 @@
+# Generated by Django 2.0.13 on 2026-10-19 12:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def monatssummen_berechnen(apps, schema_editor):
+    from stunden.rollup import monatssummen_neu_berechnen
+    monatssummen_neu_berechnen(
+        apps.get_model("stunden", "StundenAufzeichnung"),
+        apps.get_model("stunden", "MonatsSumme"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stunden', '0011_rechnungsnummer_datum_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonatsSumme',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('monat', models.DateField(db_index=True)),
+                ('stunden', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('anzahl', models.IntegerField(default=0)),
+                ('unbezahlt', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('arbeitnehmer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stunden.Arbeitnehmer')),
+                ('firma', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='stunden.Firma')),
+            ],
+            options={
+                'verbose_name': 'Monatssumme',
+                'verbose_name_plural': 'Monatssummen',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='monatssumme',
+            unique_together={('firma', 'arbeitnehmer', 'monat')},
+        ),
+        migrations.RunPython(monatssummen_berechnen, migrations.RunPython.noop),
+    ]
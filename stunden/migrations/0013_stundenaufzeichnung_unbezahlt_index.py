@@ -0,0 +1,17 @@
+# Generated by Django 2.0.13 on 2026-10-19 12:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stunden', '0012_monatssumme'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stundenaufzeichnung',
+            index=models.Index(fields=['bezahlt', 'firma', 'datum'], name='stunden_stu_bezahlt_f38096_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.0.13 on 2026-10-19 12:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stunden', '0013_stundenaufzeichnung_unbezahlt_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stundenaufzeichnung',
+            index=models.Index(fields=['datum', 'startzeit'], name='stunden_stu_datum_272624_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stundenaufzeichnung',
+            index=models.Index(fields=['firma', 'datum'], name='stunden_stu_firma_i_5b5c59_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stundenaufzeichnung',
+            index=models.Index(fields=['arbeitnehmer', 'datum'], name='stunden_stu_arbeitn_7155df_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def suche_anlegen(apps, schema_editor):
+    from stunden.suche import suche_anlegen
+    suche_anlegen(
+        schema_editor.connection,
+        apps.get_model("stunden", "StundenAufzeichnung")._meta.db_table,
+    )
+
+
+def suche_entfernen(apps, schema_editor):
+    from stunden.suche import suche_entfernen
+    suche_entfernen(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stunden', '0014_stundenaufzeichnung_filter_indexe'),
+    ]
+
+    operations = [
+        migrations.RunPython(suche_anlegen, suche_entfernen),
+    ]
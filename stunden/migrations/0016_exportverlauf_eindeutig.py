@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+def nur_letzte_exporte(apps, schema_editor):
+    ExportVerlauf = apps.get_model("stunden", "ExportVerlauf")
+    letzte = {}
+    for pk, bereich in ExportVerlauf.objects.order_by("exportiert", "pk").values_list("pk", "bereich"):
+        letzte[bereich] = pk
+    ExportVerlauf.objects.exclude(pk__in=letzte.values()).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stunden', '0015_protokoll_suche'),
+    ]
+
+    operations = [
+        migrations.RunPython(nur_letzte_exporte, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='exportverlauf',
+            name='stunden_exp_bereich_cbcb1c_idx',
+        ),
+        migrations.AlterField(
+            model_name='exportverlauf',
+            name='bereich',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
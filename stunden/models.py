@@ -2,11 +2,57 @@ from .utils import calculate_stunden
 from django.db import models
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
-class Firma(models.Model):
+class ZeitstempelModel(models.Model):
+    """
+    Ein abstraktes Model mit Zeitstempeln für Erstellung und letzte Änderung.
+    Die Zeitstempel sind indiziert und werden für den Delta Export verwendet.
+    Beim Import (raw save und bulk_create) bleibt created aus der Datei
+    erhalten, updated setzt importer.zeitstempel_setzen.
+    """
+    created = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
+    updated = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
+
+    def save(self, *args, **kwargs):
+        """
+        Setzt den Zeitstempel der letzten Änderung.
+        """
+        self.updated = timezone.now()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "updated" not in update_fields:
+            kwargs["update_fields"] = list(update_fields) + ["updated"]
+        super(ZeitstempelModel, self).save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+
+
+class NaturalKeyManager(models.Manager):
+    """
+    Ein Manager für Models mit einem eindeutigen Feld als natürlichem Schlüssel.
+    Wird von der Serialisierung mit natürlichen Schlüsseln und vom Upsert
+    Import verwendet.
+    """
+    natural_key_field = None
+
+    def get_by_natural_key(self, key):
+        return self.get(**{self.natural_key_field: key})
+
+
+class FirmaManager(NaturalKeyManager):
+    natural_key_field = "firma"
+
+
+class ArbeitnehmerManager(NaturalKeyManager):
+    natural_key_field = "name"
+
+
+class Firma(ZeitstempelModel):
     """
     Das ORM Model für Firma.
+    Der natürliche Schlüssel ist der eindeutige Firmen Name.
     """
     firma = models.CharField(max_length=200, blank=False, unique=True)
     name = models.CharField(max_length=200, blank=True)
@@ -17,6 +63,11 @@ class Firma(models.Model):
     uid = models.CharField(max_length=20, blank=True, verbose_name="UID")
     stundensatz = models.PositiveIntegerField(blank=True, null=True)
 
+    objects = FirmaManager()
+
+    def natural_key(self):
+        return (self.firma,)
+
     def __str__(self):
         return self.firma
 
@@ -25,9 +76,10 @@ class Firma(models.Model):
         verbose_name_plural = "Firmen"
 
 
-class Arbeitnehmer(models.Model):
+class Arbeitnehmer(ZeitstempelModel):
     """
     Das ORM Model für Arbeitnehmer.
+    Der natürliche Schlüssel ist der eindeutige Name.
     """
     name = models.CharField(max_length=200, blank=False, unique=True)
     adresse = models.CharField(max_length=200, blank=True)
@@ -39,6 +91,11 @@ class Arbeitnehmer(models.Model):
     bank_iban = models.CharField(max_length=200, blank=True, verbose_name="IBAN")
     bank_bic = models.CharField(max_length=200, blank=True, verbose_name="BIC")
 
+    objects = ArbeitnehmerManager()
+
+    def natural_key(self):
+        return (self.name,)
+
     def __str__(self):
         return self.name
 
@@ -47,7 +104,7 @@ class Arbeitnehmer(models.Model):
         verbose_name_plural = "Arbeitnehmer"
 
 
-class StundenAufzeichnung(models.Model):
+class StundenAufzeichnung(ZeitstempelModel):
     """
     Das ORM Model für StundenAufzeichnung.
     """
@@ -59,6 +116,26 @@ class StundenAufzeichnung(models.Model):
     protokoll = models.TextField(blank=False)
     bezahlt = models.BooleanField(blank=False)
 
+    # Die Felder, aus denen sich der Beitrag zu einer MonatsSumme ergibt.
+    MONATS_FELDER = ("firma_id", "arbeitnehmer_id", "datum", "startzeit", "endzeit", "bezahlt")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """
+        Merkt sich die geladenen Werte der MONATS_FELDER, damit beim
+        Speichern die MonatsSumme ohne weitere Abfrage angepasst werden kann.
+        """
+        obj = super(StundenAufzeichnung, cls).from_db(db, field_names, values)
+        if all(name in obj.__dict__ for name in cls.MONATS_FELDER):
+            obj._monats_werte = tuple(obj.__dict__[name] for name in cls.MONATS_FELDER)
+        return obj
+
+    def monats_werte(self):
+        """
+        Die aktuellen Werte der MONATS_FELDER.
+        """
+        return tuple(getattr(self, name) for name in self.MONATS_FELDER)
+
     def stunden(self):
         """
         Rechnet den Zeitunterschied aus.
@@ -80,9 +157,17 @@ class StundenAufzeichnung(models.Model):
     class Meta:
         verbose_name = "Stunden Aufzeichnung"
         verbose_name_plural = "Stunden Aufzeichnungen"
+        indexes = [
+            # Für die offenen Beträge pro Firma, siehe rollup.unbezahlt_pro_firma.
+            models.Index(fields=["bezahlt", "firma", "datum"]),
+            # Für die Sortierung und die Filter der Listen, siehe StundenFilterForm.
+            models.Index(fields=["datum", "startzeit"]),
+            models.Index(fields=["firma", "datum"]),
+            models.Index(fields=["arbeitnehmer", "datum"]),
+        ]
 
 
-class Einstellungen(models.Model):
+class Einstellungen(ZeitstempelModel):
     """
     Das ORM Model für Einstellungen.
     """
@@ -96,12 +181,12 @@ class Einstellungen(models.Model):
         verbose_name_plural = "Einstellungen"
 
 
-class Rechnungsnummer(models.Model):
+class Rechnungsnummer(ZeitstempelModel):
     """
     Das ORM Model für Einstellungen.
     """
     rechnungsnummer = models.CharField(max_length=200, blank=True)
-    rechnungsnummer_datum = models.DateTimeField(auto_now_add=True)
+    rechnungsnummer_datum = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return str(self.rechnungsnummer)
@@ -109,3 +194,59 @@ class Rechnungsnummer(models.Model):
     class Meta:
         verbose_name = "Rechnungsnummer"
         verbose_name_plural = "Rechnungsnummern"
+
+
+class Loeschung(models.Model):
+    """
+    Das ORM Model für gelöschte Einträge (Tombstones) für den Delta Export.
+    """
+    model = models.CharField(max_length=100)
+    objekt_id = models.IntegerField()
+    geloescht = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return "{} {}".format(self.model, self.objekt_id)
+
+    class Meta:
+        verbose_name = "Löschung"
+        verbose_name_plural = "Löschungen"
+
+
+class ExportVerlauf(models.Model):
+    """
+    Das ORM Model für den Zeitpunkt des letzten JSON Exports pro Bereich,
+    ein Eintrag pro Bereich. Wird auf der JSON Export Seite angezeigt.
+    """
+    bereich = models.CharField(max_length=100, unique=True)
+    exportiert = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return "{} {}".format(self.bereich, self.exportiert)
+
+    class Meta:
+        verbose_name = "Export Verlauf"
+        verbose_name_plural = "Export Verlauf"
+
+
+class MonatsSumme(models.Model):
+    """
+    Das ORM Model für die Summen der Stundenaufzeichnungen pro Firma,
+    Arbeitnehmer und Monat. monat ist immer der Erste des Monats.
+    Wird bei jeder Änderung einer Stundenaufzeichnung angepasst, siehe
+    rollup.py, und kann mit "python manage.py monatssummen" neu berechnet
+    werden.
+    """
+    firma = models.ForeignKey("Firma", on_delete=models.CASCADE)
+    arbeitnehmer = models.ForeignKey("Arbeitnehmer", on_delete=models.CASCADE)
+    monat = models.DateField(db_index=True)
+    stunden = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    anzahl = models.IntegerField(default=0)
+    unbezahlt = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self):
+        return "{} {} {:%m.%Y}".format(self.firma_id, self.arbeitnehmer_id, self.monat)
+
+    class Meta:
+        verbose_name = "Monatssumme"
+        verbose_name_plural = "Monatssummen"
+        unique_together = ("firma", "arbeitnehmer", "monat")
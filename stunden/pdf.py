@@ -421,7 +421,8 @@ def make_pdf(data, font_folder="stunden/ubuntu-font-family-0.83/", second_table=
 
     # Reihe 9 - Summe USt.
     table_row9_position = Paragraph("", styles["table-center"])
-    table_row9_bezeichnung = Paragraph("20% Umsatzsteuer von € {}".format(
+    table_row9_bezeichnung = Paragraph("{}% Umsatzsteuer von € {}".format(
+        data["einstellungen_ust"],
         data["rechnungs_summe_netto"]),
         styles["table-right"])
     table_row9_ust = Paragraph("", styles["table-center"])
@@ -0,0 +1,239 @@
+import threading
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal
+from .models import StundenAufzeichnung, MonatsSumme
+from .cache import bump_model_version
+from .expressions import StundenDauer
+from .utils import calculate_stunden
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Min, Sum
+
+
+# Die Gruppierungen für auswerten, als Felder von MonatsSumme.
+AUSWERTUNG_GRUPPEN = {
+    "monat": ("monat",),
+    "firma": ("firma_id", "firma__firma"),
+    "arbeitnehmer": ("arbeitnehmer_id", "arbeitnehmer__name"),
+}
+
+_lokal = threading.local()
+
+
+def monat(datum):
+    """
+    Der Erste des Monats eines Datums, der Schlüssel der MonatsSumme.
+    """
+    return date(datum.year, datum.month, 1)
+
+
+def beitrag(werte):
+    """
+    Der Beitrag einer Stundenaufzeichnung zu ihrer MonatsSumme aus den
+    Werten der MONATS_FELDER, als ((firma_id, arbeitnehmer_id, monat),
+    stunden, unbezahlt).
+    """
+    firma_id, arbeitnehmer_id, datum, startzeit, endzeit, bezahlt = werte
+    stunden = Decimal(calculate_stunden(startzeit, endzeit))
+    return (firma_id, arbeitnehmer_id, monat(datum)), stunden, Decimal(0) if bezahlt else stunden
+
+
+def summieren(beitraege, summen=None):
+    """
+    Summiert Beiträge als (Schlüssel, stunden, anzahl, unbezahlt) in ein
+    dict von Schlüssel auf [stunden, anzahl, unbezahlt].
+    """
+    if summen is None:
+        summen = {}
+    for schluessel, stunden, anzahl, unbezahlt in beitraege:
+        summe = summen.setdefault(schluessel, [Decimal(0), 0, Decimal(0)])
+        summe[0] += stunden
+        summe[1] += anzahl
+        summe[2] += unbezahlt
+    return summen
+
+
+def monatssummen_aendern(summen):
+    """
+    Addiert die Änderungen aus summieren zu den MonatsSummen.
+    Fehlt eine MonatsSumme, wird sie angelegt, aber nur, wenn Einträge dazu
+    kommen. Sonst wurde sie mit ihrer Firma oder ihrem Arbeitnehmer gelöscht.
+    Leere MonatsSummen werden gelöscht.
+    """
+    for (firma_id, arbeitnehmer_id, monat_), (stunden, anzahl, unbezahlt) in summen.items():
+        if not (stunden or anzahl or unbezahlt):
+            continue
+        schluessel = {"firma_id": firma_id, "arbeitnehmer_id": arbeitnehmer_id, "monat": monat_}
+        aenderung = {
+            "stunden": F("stunden") + stunden,
+            "anzahl": F("anzahl") + anzahl,
+            "unbezahlt": F("unbezahlt") + unbezahlt,
+        }
+        if MonatsSumme.objects.filter(**schluessel).update(**aenderung):
+            if anzahl < 0:
+                MonatsSumme.objects.filter(anzahl__lte=0, **schluessel).delete()
+            continue
+        if anzahl <= 0:
+            continue
+        try:
+            with transaction.atomic():
+                MonatsSumme.objects.create(
+                    stunden=stunden, anzahl=anzahl, unbezahlt=unbezahlt, **schluessel
+                )
+        except IntegrityError:
+            # Ein anderer Prozess hat sie gerade angelegt.
+            MonatsSumme.objects.filter(**schluessel).update(**aenderung)
+
+
+def aenderung(alt, neu):
+    """
+    Die Änderung der MonatsSummen, wenn aus den Werten alt die Werte neu
+    werden. None steht für keinen Eintrag (neu angelegt oder gelöscht).
+    """
+    beitraege = []
+    if alt is not None:
+        schluessel, stunden, unbezahlt = beitrag(alt)
+        beitraege.append((schluessel, -stunden, -1, -unbezahlt))
+    if neu is not None:
+        schluessel, stunden, unbezahlt = beitrag(neu)
+        beitraege.append((schluessel, stunden, 1, unbezahlt))
+    return summieren(beitraege)
+
+
+def bezahlt_aenderung(werte_liste, bezahlt):
+    """
+    Die Änderung der MonatsSummen, wenn alle Einträge mit den Werten aus
+    werte_liste auf bezahlt gesetzt werden. Einträge, die schon so
+    markiert sind, zählen nicht.
+    """
+    beitraege = []
+    for werte in werte_liste:
+        if werte[-1] == bezahlt:
+            continue
+        schluessel, stunden, unbezahlt = beitrag(werte)
+        beitraege.append((schluessel, Decimal(0), 0, -stunden if bezahlt else stunden))
+    return summieren(beitraege)
+
+
+@contextmanager
+def rollup_pausiert():
+    """
+    Schaltet das laufende Anpassen der MonatsSummen in diesem Thread ab,
+    z.B. für Imports, die danach monatssummen_neu_berechnen aufrufen.
+    """
+    vorher = getattr(_lokal, "pausiert", False)
+    _lokal.pausiert = True
+    try:
+        yield
+    finally:
+        _lokal.pausiert = vorher
+
+
+def rollup_aktiv():
+    """
+    Ob die MonatsSummen in diesem Thread laufend angepasst werden.
+    """
+    return not getattr(_lokal, "pausiert", False)
+
+
+def monatssummen_neu_berechnen(stunden_model=StundenAufzeichnung, summen_model=MonatsSumme):
+    """
+    Berechnet alle MonatsSummen aus den Stundenaufzeichnungen neu.
+    Die Models können für Migrationen übergeben werden.
+    Die Version von MonatsSumme wird erhöht, damit gecachte Seiten wie das
+    Dashboard die neuen Summen zeigen. In Migrationen gibt es noch keine
+    gecachten Seiten, der Cache wird dort nicht angefasst.
+    Returniert die Anzahl der MonatsSummen.
+    """
+    werte_liste = stunden_model._default_manager.values_list(
+        *StundenAufzeichnung.MONATS_FELDER
+    ).order_by().iterator()
+    summen = summieren(
+        (schluessel, stunden, 1, unbezahlt)
+        for schluessel, stunden, unbezahlt in map(beitrag, werte_liste)
+    )
+    with transaction.atomic():
+        summen_model._default_manager.all().delete()
+        summen_model._default_manager.bulk_create(
+            (
+                summen_model(
+                    firma_id=firma_id,
+                    arbeitnehmer_id=arbeitnehmer_id,
+                    monat=monat_,
+                    stunden=stunden,
+                    anzahl=anzahl,
+                    unbezahlt=unbezahlt,
+                )
+                for (firma_id, arbeitnehmer_id, monat_), (stunden, anzahl, unbezahlt) in summen.items()
+            )
+        )
+        if summen_model is MonatsSumme:
+            bump_model_version(MonatsSumme)
+    return len(summen)
+
+
+def summen_ausdruecke():
+    """
+    Die Aggregate für auswerten. Der Umsatz wird mit dem aktuellen
+    Stundensatz der Firma berechnet, Firmen ohne Stundensatz zählen nicht.
+    """
+    betrag = DecimalField(max_digits=14, decimal_places=2)
+    return {
+        "stunden_summe": Sum("stunden"),
+        "unbezahlt_summe": Sum("unbezahlt"),
+        "anzahl_summe": Sum("anzahl"),
+        "umsatz": Sum(F("stunden") * F("firma__stundensatz"), output_field=betrag),
+        "umsatz_unbezahlt": Sum(F("unbezahlt") * F("firma__stundensatz"), output_field=betrag),
+    }
+
+
+def ergaenzen(summe):
+    """
+    Ersetzt leere Summen durch 0 und ergänzt die bezahlten Werte.
+    """
+    for key in ("stunden_summe", "unbezahlt_summe", "umsatz", "umsatz_unbezahlt"):
+        if summe[key] is None:
+            summe[key] = Decimal(0)
+    summe["anzahl_summe"] = summe["anzahl_summe"] or 0
+    summe["bezahlt_summe"] = summe["stunden_summe"] - summe["unbezahlt_summe"]
+    summe["umsatz_bezahlt"] = summe["umsatz"] - summe["umsatz_unbezahlt"]
+    return summe
+
+
+def auswerten(queryset):
+    """
+    Wertet ein MonatsSumme Queryset mit gruppierten SQL Aggregaten aus.
+    Returniert ein dict mit "gesamt" und je einer Liste pro Gruppe aus
+    AUSWERTUNG_GRUPPEN. Die Anzahl der Zeilen hängt nur von Firmen,
+    Arbeitnehmern und Monaten ab, nicht von der Anzahl der Einträge.
+    """
+    auswertung = {"gesamt": ergaenzen(queryset.aggregate(**summen_ausdruecke()))}
+    for name, felder in AUSWERTUNG_GRUPPEN.items():
+        auswertung[name] = [
+            ergaenzen(summe)
+            for summe in queryset.values(*felder).annotate(**summen_ausdruecke()).order_by(felder[-1])
+        ]
+    return auswertung
+
+
+def unbezahlt_pro_firma():
+    """
+    Die offenen Beträge pro Firma mit einer gruppierten Abfrage über den
+    Index auf bezahlt, firma und datum. Returniert eine Liste von dicts mit
+    firma_id, firma__firma, firma__stundensatz, anzahl, aelteste (Datum),
+    stunden und betrag, sortiert nach Firma. Der betrag ist eine Schätzung
+    mit dem aktuellen Stundensatz, None für Firmen ohne Stundensatz.
+    """
+    offen = StundenAufzeichnung.objects.filter(bezahlt=False).values(
+        "firma_id", "firma__firma", "firma__stundensatz"
+    ).annotate(
+        anzahl=Count("id"),
+        aelteste=Min("datum"),
+        stunden=Sum(StundenDauer()),
+    ).order_by("firma__firma")
+    posten = []
+    for summe in offen:
+        stundensatz = summe["firma__stundensatz"]
+        summe["betrag"] = None if stundensatz is None else summe["stunden"] * stundensatz
+        posten.append(summe)
+    return posten
@@ -0,0 +1,105 @@
+from .models import StundenAufzeichnung, Firma, Arbeitnehmer, Einstellungen, Rechnungsnummer
+from .models import Loeschung
+from .cache import bump_model_version, rechnungsnummer_merken
+from .rollup import aenderung, bezahlt_aenderung, monatssummen_aendern, rollup_aktiv
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+
+
+# Die Models, deren Löschungen als Tombstone gespeichert werden.
+DELTA_MODELS = [Firma, Arbeitnehmer, Einstellungen, Rechnungsnummer, StundenAufzeichnung]
+
+
+def loeschung_speichern(sender, instance, **kwargs):
+    """
+    Speichert für jeden gelöschten Eintrag einen Tombstone,
+    damit der Delta Export auch Löschungen liefern kann.
+    """
+    Loeschung.objects.create(model=sender._meta.label_lower, objekt_id=instance.pk)
+
+
+def version_erhoehen(sender, **kwargs):
+    """
+    Erhöht nach jeder Änderung die Version des Models, damit gecachte
+    Daten in allen Prozessen neu geladen werden.
+    """
+    bump_model_version(sender)
+
+
+for model in DELTA_MODELS:
+    post_delete.connect(loeschung_speichern, sender=model)
+    post_save.connect(version_erhoehen, sender=model)
+    post_delete.connect(version_erhoehen, sender=model)
+
+
+def neue_rechnungsnummer(sender, instance, created, **kwargs):
+    """
+    Merkt sich nach einer neuen Rechnungsnummer den nächsten Vorschlag.
+    Das läuft nach dem Commit und damit nach dem Erhöhen der Version durch
+    version_erhoehen, sonst wäre der Vorschlag gleich wieder ungültig.
+    """
+    if created:
+        rechnungsnummer = instance.rechnungsnummer
+        transaction.on_commit(lambda: rechnungsnummer_merken(rechnungsnummer))
+
+
+post_save.connect(neue_rechnungsnummer, sender=Rechnungsnummer)
+
+
+def monatssumme_vorbereiten(sender, instance, **kwargs):
+    """
+    Holt vor dem Speichern die alten Werte einer Stundenaufzeichnung, wenn
+    sie nicht aus der Datenbank geladen wurde (z.B. beim Import mit raw).
+    """
+    if not rollup_aktiv() or hasattr(instance, "_monats_werte") or instance.pk is None:
+        return
+    alt = sender._default_manager.filter(pk=instance.pk).values_list(*sender.MONATS_FELDER).first()
+    instance._monats_werte = alt
+
+
+def monatssumme_speichern(sender, instance, **kwargs):
+    """
+    Passt nach dem Speichern einer Stundenaufzeichnung die MonatsSummen
+    um die Differenz zwischen alten und neuen Werten an.
+    """
+    if not rollup_aktiv():
+        return
+    neu = instance.monats_werte()
+    alt = getattr(instance, "_monats_werte", None)
+    if alt != neu:
+        monatssummen_aendern(aenderung(alt, neu))
+    instance._monats_werte = neu
+
+
+def monatssumme_loeschen(sender, instance, **kwargs):
+    """
+    Zieht eine gelöschte Stundenaufzeichnung von ihrer MonatsSumme ab.
+    """
+    if not rollup_aktiv():
+        return
+    alt = getattr(instance, "_monats_werte", None) or instance.monats_werte()
+    monatssummen_aendern(aenderung(alt, None))
+
+
+pre_save.connect(monatssumme_vorbereiten, sender=StundenAufzeichnung)
+post_save.connect(monatssumme_speichern, sender=StundenAufzeichnung)
+post_delete.connect(monatssumme_loeschen, sender=StundenAufzeichnung)
+
+
+def bezahlt_setzen(queryset, bezahlt):
+    """
+    Markiert Stundenaufzeichnungen mit einem UPDATE als bezahlt oder
+    unbezahlt. update() löst keine Signale aus, daher werden die Version
+    und die MonatsSummen hier angepasst. Returniert wird die Anzahl der
+    geänderten Einträge.
+    """
+    with transaction.atomic():
+        if rollup_aktiv():
+            werte_liste = queryset.exclude(bezahlt=bezahlt).values_list(
+                *StundenAufzeichnung.MONATS_FELDER
+            )
+            monatssummen_aendern(bezahlt_aenderung(werte_liste, bezahlt))
+        anzahl = queryset.update(bezahlt=bezahlt, updated=timezone.now())
+    bump_model_version(StundenAufzeichnung)
+    return anzahl
@@ -26,7 +26,7 @@ $(document).ready(function() {
     });
 
     // Datepicker
-    $("#id_datum").datepicker({
+    $("#id_datum, #id_von, #id_bis").datepicker({
         dateFormat: "dd.mm.yy",
         showOtherMonths: true,
         selectOtherMonths: true
@@ -44,25 +44,51 @@ $(document).ready(function() {
         autoclose: true
     });
 
+    // Status eines Import Jobs abfragen, bis er fertig ist
+    var import_job = $("#import-job");
+    function import_job_status() {
+        $.ajax({
+            url: import_job.data("status-url"),
+            cache: false,
+            success: function(data) {
+                $("#import-job-status").text(data["status"]);
+                $("#import-job-anzahl").text(data["anzahl"]);
+                $("#import-job-durchsatz").text(data["zeilen_pro_sekunde"]);
+                $("#import-job-eta").text(data["eta"] === null ? "-" : data["eta"]);
+                $("#import-job-neu").text(data["neu"]);
+                $("#import-job-geaendert").text(data["geaendert"]);
+                $("#import-job-unveraendert").text(data["unveraendert"]);
+                $("#import-job-progress").css("width", data["prozent"] + "%").text(data["prozent"] + "%");
+                if (data["status"] == "fertig" || data["status"] == "fehler") {
+                    // Die Seite zeigt dann Meldungen und Fehler pro Zeile an.
+                    document.location.reload();
+                } else {
+                    setTimeout(import_job_status, 1000);
+                }
+            }
+        });
+    }
+    if (import_job.length && $("#import-job-status").text() != "fertig" && $("#import-job-status").text() != "fehler") {
+        setTimeout(import_job_status, 1000);
+    }
+
     // Rechnung Firma-Checkbox-Auswahl Stundensatz Eintrag
-    $("#id_firma").change(function() {
-        if(document.location.pathname == "/rechnung/") {
-            selected_firma_id = $(this).val();
+    // Die Stundensätze aller Firmen werden einmal geladen und danach lokal eingetragen.
+    if (document.location.pathname == "/rechnung/") {
+        var firma_stundensaetze = $.getJSON("/firma_stundensaetze/");
+        $("#id_firma").change(function() {
+            var selected_firma_id = $(this).val();
             if (selected_firma_id) {
-                request_url = "/get_firma_stundensatz/" + selected_firma_id + "/";
-                $.ajax({
-                    url: request_url,
-                    success: function(data) {
-                        var firma_stundensatz = data["firma_stundensatz"]
-                        if (firma_stundensatz) {
-                            $("#id_rechnungs_stundenlohn").val(firma_stundensatz).effect("highlight");
-                        } else {
-                            $("#id_rechnungs_stundenlohn").val("").effect("highlight", {color: "red"});
-                        }
+                firma_stundensaetze.done(function(stundensaetze) {
+                    var firma_stundensatz = stundensaetze[selected_firma_id];
+                    if (firma_stundensatz) {
+                        $("#id_rechnungs_stundenlohn").val(firma_stundensatz).effect("highlight");
+                    } else {
+                        $("#id_rechnungs_stundenlohn").val("").effect("highlight", {color: "red"});
                     }
-                })
+                });
             }
-        }
-    });
+        });
+    }
 
 });
@@ -0,0 +1,221 @@
+import re
+from collections import namedtuple
+from .models import StundenAufzeichnung
+from django.db import connection as default_connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+
+# Die FTS5 Tabelle unter SQLite und der GIN Index unter PostgreSQL.
+FTS_TABELLE = "stunden_protokoll_fts"
+GIN_INDEX = "stunden_protokoll_gin"
+
+# Die Textsuche Konfiguration von PostgreSQL.
+PG_KONFIGURATION = "german"
+
+# Mehr Treffer werden nicht angezeigt, die Suche muss dann genauer werden.
+MAX_TREFFER = 200
+
+# Markierungen der Treffer im Ausschnitt, ersetzt durch ausschnitt_html.
+START = "\x02"
+ENDE = "\x03"
+
+WORT = re.compile(r"\w+", re.UNICODE)
+
+Treffer = namedtuple("Treffer", ["id", "rang", "ausschnitt"])
+
+SQLITE_ANLEGEN = [
+    """
+    CREATE VIRTUAL TABLE {fts} USING fts5(
+        protokoll, content='{tabelle}', content_rowid='id', tokenize='unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER {fts}_insert AFTER INSERT ON {tabelle} BEGIN
+        INSERT INTO {fts}(rowid, protokoll) VALUES (new.id, new.protokoll);
+    END
+    """,
+    """
+    CREATE TRIGGER {fts}_delete AFTER DELETE ON {tabelle} BEGIN
+        INSERT INTO {fts}({fts}, rowid, protokoll) VALUES ('delete', old.id, old.protokoll);
+    END
+    """,
+    """
+    CREATE TRIGGER {fts}_update AFTER UPDATE OF protokoll ON {tabelle} BEGIN
+        INSERT INTO {fts}({fts}, rowid, protokoll) VALUES ('delete', old.id, old.protokoll);
+        INSERT INTO {fts}(rowid, protokoll) VALUES (new.id, new.protokoll);
+    END
+    """,
+    "INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+]
+
+SQLITE_ENTFERNEN = [
+    "DROP TRIGGER IF EXISTS {fts}_insert",
+    "DROP TRIGGER IF EXISTS {fts}_delete",
+    "DROP TRIGGER IF EXISTS {fts}_update",
+    "DROP TABLE IF EXISTS {fts}",
+]
+
+SQLITE_SUCHEN = """
+    SELECT {fts}.rowid, bm25({fts}), snippet({fts}, 0, %s, %s, '…', 24)
+    FROM {fts}
+    WHERE {fts} MATCH %s
+    ORDER BY bm25({fts}), {fts}.rowid DESC
+    LIMIT %s
+"""
+
+PG_ANLEGEN = """
+    CREATE INDEX IF NOT EXISTS {index} ON {tabelle}
+    USING GIN (to_tsvector('{konfiguration}', protokoll))
+"""
+
+PG_SUCHEN = """
+    SELECT id, ts_rank(to_tsvector('{konfiguration}', protokoll), anfrage),
+        ts_headline('{konfiguration}', protokoll, anfrage, %s)
+    FROM {tabelle}, to_tsquery('{konfiguration}', %s) anfrage
+    WHERE to_tsvector('{konfiguration}', protokoll) @@ anfrage
+    ORDER BY 2 DESC, id DESC
+    LIMIT %s
+"""
+
+
+def sql_werte(tabelle=None):
+    """
+    Die Namen für die SQL Vorlagen.
+    """
+    return {
+        "fts": FTS_TABELLE,
+        "index": GIN_INDEX,
+        "tabelle": tabelle or StundenAufzeichnung._meta.db_table,
+        "konfiguration": PG_KONFIGURATION,
+    }
+
+
+def fts5_verfuegbar(connection):
+    """
+    Ob SQLite mit FTS5 übersetzt wurde.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return "ENABLE_FTS5" in {row[0] for row in cursor.fetchall()}
+
+
+def suche_art(connection=None):
+    """
+    Wie gesucht wird: "fts5" (SQLite), "postgresql" oder None ohne Index.
+    Unter SQLite wird geprüft, ob die FTS5 Tabelle angelegt ist.
+    """
+    connection = connection or default_connection
+    if connection.vendor == "postgresql":
+        return "postgresql"
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABELLE]
+            )
+            if cursor.fetchone():
+                return "fts5"
+    return None
+
+
+def suche_anlegen(connection, tabelle=None):
+    """
+    Legt die FTS5 Tabelle mit Triggern (SQLite) oder den GIN Index
+    (PostgreSQL) an und füllt sie. Für die Migration, auf anderen
+    Datenbanken und ohne FTS5 passiert nichts.
+    """
+    werte = sql_werte(tabelle)
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite" and fts5_verfuegbar(connection):
+            for sql in SQLITE_ANLEGEN:
+                cursor.execute(sql.format(**werte))
+        elif connection.vendor == "postgresql":
+            cursor.execute(PG_ANLEGEN.format(**werte))
+
+
+def suche_entfernen(connection):
+    """
+    Entfernt, was suche_anlegen angelegt hat.
+    """
+    werte = sql_werte()
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            for sql in SQLITE_ENTFERNEN:
+                cursor.execute(sql.format(**werte))
+        elif connection.vendor == "postgresql":
+            cursor.execute("DROP INDEX IF EXISTS {index}".format(**werte))
+
+
+def suche_neu_aufbauen(connection=None):
+    """
+    Baut den Suchindex aus allen Protokollen neu auf, z.B. nach Änderungen
+    direkt in der Datenbank. Returniert die Art der Suche wie suche_art.
+    """
+    connection = connection or default_connection
+    art = suche_art(connection)
+    with connection.cursor() as cursor:
+        if art == "fts5":
+            cursor.execute("INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(**sql_werte()))
+        elif art == "postgresql":
+            cursor.execute("REINDEX INDEX {index}".format(**sql_werte()))
+    return art
+
+
+def woerter(text):
+    """
+    Die Wörter eines Suchtexts. Alles andere wird ignoriert, damit keine
+    Syntax der Suchanfrage in den Text kommt.
+    """
+    return WORT.findall(text)
+
+
+def markieren(text, suchwoerter):
+    """
+    Markiert die Suchwörter als Wortanfang im Text, für die Suche ohne Index.
+    """
+    if not suchwoerter:
+        return text
+    muster = re.compile(
+        r"\b({})".format("|".join(re.escape(wort) for wort in suchwoerter)),
+        re.IGNORECASE | re.UNICODE
+    )
+    return muster.sub(lambda match: START + match.group(0) + ENDE, text)
+
+
+def ausschnitt_html(ausschnitt):
+    """
+    Der Ausschnitt als HTML mit <mark> für die Treffer, der Rest ist escaped.
+    """
+    html = escape(ausschnitt).replace(START, "<mark>").replace(ENDE, "</mark>")
+    return mark_safe(html)
+
+
+def suchen(text, limit=MAX_TREFFER, connection=None):
+    """
+    Sucht in den Protokollen nach allen Wörtern des Texts, jeweils als
+    Wortanfang. Returniert eine Liste von Treffer, die besten zuerst.
+    Unter SQLite mit FTS5 sortiert bm25, unter PostgreSQL ts_rank, ohne
+    Index wird mit icontains gesucht und nach Datum sortiert.
+    """
+    connection = connection or default_connection
+    suchwoerter = woerter(text)
+    if not suchwoerter:
+        return []
+    art = suche_art(connection)
+    with connection.cursor() as cursor:
+        if art == "fts5":
+            anfrage = " ".join('"{}"*'.format(wort) for wort in suchwoerter)
+            cursor.execute(SQLITE_SUCHEN.format(**sql_werte()), [START, ENDE, anfrage, limit])
+            return [Treffer(*row) for row in cursor.fetchall()]
+        if art == "postgresql":
+            anfrage = " & ".join("{}:*".format(wort) for wort in suchwoerter)
+            optionen = "StartSel={}, StopSel={}, MaxWords=35, MinWords=15".format(START, ENDE)
+            cursor.execute(PG_SUCHEN.format(**sql_werte()), [optionen, anfrage, limit])
+            return [Treffer(*row) for row in cursor.fetchall()]
+    queryset = StundenAufzeichnung.objects.order_by("-datum", "-startzeit")
+    for wort in suchwoerter:
+        queryset = queryset.filter(protokoll__icontains=wort)
+    return [
+        Treffer(pk, None, markieren(protokoll, suchwoerter))
+        for pk, protokoll in queryset.values_list("pk", "protokoll")[:limit]
+    ]
@@ -0,0 +1,110 @@
+import logging
+import os
+import time
+import warnings
+from django.template import Context, Engine, engines
+
+
+logger = logging.getLogger(__name__)
+
+# Die Templates der App, relativ zu diesem Verzeichnis.
+TEMPLATE_VERZEICHNIS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+# Die Loader ohne Cache, für den Vergleich in template_zeiten.
+LOADER_OHNE_CACHE = [
+    "django.template.loaders.filesystem.Loader",
+    "django.template.loaders.app_directories.Loader",
+]
+
+
+def get_engine():
+    """
+    Die Django Template Engine aus den Settings.
+    """
+    return engines["django"].engine
+
+
+def stunden_templates():
+    """
+    Die Namen aller Templates der App, z.B. "base.html" und
+    "stunden/index.html", sortiert.
+    """
+    namen = []
+    for verzeichnis, unterverzeichnisse, dateien in os.walk(TEMPLATE_VERZEICHNIS):
+        for datei in dateien:
+            if datei.endswith(".html"):
+                pfad = os.path.join(verzeichnis, datei)
+                namen.append(os.path.relpath(pfad, TEMPLATE_VERZEICHNIS).replace(os.sep, "/"))
+    return sorted(namen)
+
+
+def templates_vorkompilieren():
+    """
+    Lädt alle Templates der App einmal, damit der cached Loader sie beim
+    ersten Request schon kompiliert hat. Ohne cached Loader bringt das nichts.
+    Returniert die Anzahl der Templates.
+    """
+    start = time.perf_counter()
+    engine = get_engine()
+    namen = stunden_templates()
+    for name in namen:
+        engine.get_template(name)
+    logger.info(
+        "%d Templates in %.1f ms vorkompiliert",
+        len(namen),
+        (time.perf_counter() - start) * 1000
+    )
+    return len(namen)
+
+
+def engine_ohne_cache(engine):
+    """
+    Eine Kopie der Engine, die jedes Template neu liest und kompiliert.
+    """
+    return Engine(
+        dirs=engine.dirs,
+        loaders=LOADER_OHNE_CACHE,
+        libraries=engine.libraries,
+        debug=engine.debug,
+        string_if_invalid=engine.string_if_invalid,
+        file_charset=engine.file_charset,
+    )
+
+
+def messen(funktion, wiederholungen):
+    """
+    Die durchschnittliche Dauer eines Aufrufs in Millisekunden.
+    """
+    start = time.perf_counter()
+    for i in range(wiederholungen):
+        funktion()
+    return (time.perf_counter() - start) * 1000 / wiederholungen
+
+
+def template_zeiten(wiederholungen=10):
+    """
+    Misst für jedes Template der App die Zeit für Laden und Kompilieren
+    ohne Cache, das Laden über die Engine aus den Settings und das Rendern
+    mit leerem Context. Returniert eine Liste von
+    (Name, ohne Cache, Engine, Rendern) in Millisekunden. Rendern ist None,
+    wenn das Template ohne Context nicht gerendert werden kann.
+    """
+    engine = get_engine()
+    ohne_cache = engine_ohne_cache(engine)
+    templates_vorkompilieren()
+    zeiten = []
+    for name in stunden_templates():
+        kompilieren = messen(lambda: ohne_cache.get_template(name), wiederholungen)
+        laden = messen(lambda: engine.get_template(name), wiederholungen)
+        template = engine.get_template(name)
+        with warnings.catch_warnings():
+            # csrf_token ohne Request im Context.
+            warnings.simplefilter("ignore")
+            try:
+                template.render(Context())
+            except Exception:
+                rendern = None
+            else:
+                rendern = messen(lambda: template.render(Context()), wiederholungen)
+        zeiten.append((name, kompilieren, laden, rendern))
+    return zeiten
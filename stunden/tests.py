@@ -1,11 +1,54 @@
+import io
 import json
-from .models import StundenAufzeichnung, Firma, Arbeitnehmer
-from django.test import TestCase
+import zipfile
+from unittest import mock
+from xml.etree import ElementTree
+from time import sleep
+from .models import StundenAufzeichnung, Firma, Arbeitnehmer, Einstellungen, Rechnungsnummer
+from .models import MonatsSumme, ExportVerlauf
+from .rollup import monatssummen_neu_berechnen, auswerten, unbezahlt_pro_firma
+from .suche import suchen, suche_art, markieren, ausschnitt_html, START, ENDE
+from .importer import iter_json_array, pipeline_batches, ImportErgebnis, upsert_rows, validate_rows
+from .jobs import ImportJob, JOB_KEY
+from .cache import get_einstellungen, bump_version, get_naechste_rechnungsnummer, rechnungsnummer_merken
+from .cache import versioned_cache
+from .cache_backends import ZweistufigerCache
+from .signals import DELTA_MODELS, bezahlt_setzen
+from .identity_map import IdentityMap, IdentityMapMiddleware, get_identity_map
+from .template_cache import stunden_templates, templates_vorkompilieren, get_engine
+from .forms import StundenAufzeichnungForm, RechnungsForm, RechnungsSummeForm, DashboardForm
+from .forms import CachedModelChoiceField
+from .utils import naechste_rechnungsnummer, parse_zeitpunkt
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.core.serializers.base import DeserializationError
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core import serializers
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.urls import reverse
-from datetime import date, time, datetime
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from datetime import date, time, datetime, timedelta
+from decimal import Decimal
 
 
+# Die Tests verwenden einen eigenen Cache, damit der Cache des Projekts
+# mit seinen Versionen nicht gelöscht wird.
+TEST_CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "stunden-tests",
+    },
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
 class TestIndex(TestCase):
     """
     Testet den index View.
@@ -79,6 +122,7 @@ class TestIndex(TestCase):
         self.assertEqual(stunden, 15)
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestLogIn(TestCase):
     """
     Testet den log_in View.
@@ -134,6 +178,7 @@ class TestLogIn(TestCase):
         self.assertRedirects(response, next)
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestLogOut(TestCase):
     """
     Testet den log_out View.
@@ -169,6 +214,7 @@ class TestLogOut(TestCase):
         self.assertRedirects(response, next)
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestStundenAufzeichnung(TestCase):
     """
     Testet den stundenaufzeichnung View.
@@ -221,6 +267,7 @@ class TestStundenAufzeichnung(TestCase):
         self.assertEqual(arbeitnehmer, set(["Michael Palin"]))
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestStundenAufzeichnungNeu(TestCase):
     """
     Testet den stundenaufzeichnung_neu View.
@@ -391,6 +438,7 @@ class TestStundenAufzeichnungNeu(TestCase):
         )
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestStundenAufzeichnungBearbeiten(TestCase):
     """
     Testet den stundenaufzeichnung_bearbeiten View.
@@ -438,6 +486,7 @@ class TestStundenAufzeichnungBearbeiten(TestCase):
         self.assertTrue("22.09.2012" in str(response.context["form"]["datum"]))
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestFirma(TestCase):
     """
     Testet den firma View.
@@ -485,6 +534,7 @@ class TestFirma(TestCase):
         self.assertEqual(firma, firma_expected)
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestFirmaNeu(TestCase):
     """
     Testet den firma_neu View.
@@ -612,6 +662,7 @@ class TestFirmaNeu(TestCase):
         self.assertFormError(response, "form", "uid", None)
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestFirmaBearbeiten(TestCase):
     """
     Testet den firma_bearbeiten View.
@@ -653,6 +704,7 @@ class TestFirmaBearbeiten(TestCase):
         self.assertTrue("Monty Python" in str(response.context["form"]["firma"]))
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestArbeitnehmer(TestCase):
     """
     Testet den arbeitnehmer View.
@@ -701,6 +753,7 @@ class TestArbeitnehmer(TestCase):
         self.assertEqual(arbeitnehmer, arbeitnehmer_expected)
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestArbeitnehmerNeu(TestCase):
     """
     Testet den arbeitnehmer_neu View.
@@ -843,6 +896,7 @@ class TestArbeitnehmerNeu(TestCase):
         self.assertFormError(response, "form", "bank_bic", None)
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestArbeitnehmerBearbeiten(TestCase):
     """
     Testet den arbeitnehmer_bearbeiten View.
@@ -890,6 +944,7 @@ class TestArbeitnehmerBearbeiten(TestCase):
         self.assertTrue("AT000000000000000000" in str(response.context["form"]["bank_iban"]))
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestRechnung(TestCase):
     """
     Testet den rechnung View.
@@ -959,6 +1014,7 @@ class TestRechnung(TestCase):
         )
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestRechnungSumme(TestCase):
     """
     Testet den rechnung_summe View.
@@ -1006,6 +1062,7 @@ class TestRechnungSumme(TestCase):
         )
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestJSONExport(TestCase):
     """
     Testet den jsonexport View.
@@ -1030,6 +1087,60 @@ class TestJSONExport(TestCase):
         response = self.client.get(reverse("jsonexport"))
         self.assertEqual(response.status_code, 200)
 
+    def test_seit(self):
+        """
+        Testet den Export nur mit Änderungen seit einem Zeitpunkt und, dass
+        ein ungültiger Zeitpunkt einen Fehler statt einem vollen Export gibt.
+        """
+        self.client.login(username="admin", password="admin")
+        StundenAufzeichnung.objects.exclude(pk=2).update(
+            updated=timezone.make_aware(datetime(2017, 1, 1))
+        )
+        response = self.client.post(reverse("jsonexport"), {
+            "json_export_select": "json_export_select_stundenaufzeichnung",
+            "json_export_seit": date.today().strftime("%d.%m.%Y"),
+        })
+        self.assertEqual([eintrag["pk"] for eintrag in json.loads(response.content.decode("utf-8"))], [2])
+
+        response = self.client.post(reverse("jsonexport"), {
+            "json_export_select": "json_export_select_stundenaufzeichnung",
+            "json_export_seit": "31.31.2017",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header("Content-Disposition"))
+        self.assertContains(response, "Ungültiger Zeitpunkt: 31.31.2017")
+        self.assertContains(response, 'value="31.31.2017"')
+
+    def test_uebersicht(self):
+        """
+        Testet die Übersicht mit Anzahl, geschätzter Größe und letztem Export,
+        ohne dass alle Einträge geladen werden.
+        """
+        self.client.login(username="admin", password="admin")
+        # Session, User, der Export Verlauf, COUNT pro Bereich und eine
+        # Stichprobe pro Bereich mit Einträgen (keine Rechnungsnummern in den
+        # Testdaten).
+        with self.assertNumQueries(10):
+            response = self.client.get(reverse("jsonexport"))
+        uebersicht = {zeile["bereich"]: zeile for zeile in response.context["uebersicht"]}
+        stunden = uebersicht["json_export_select_stundenaufzeichnung"]
+        self.assertEqual(stunden["anzahl"], 5)
+        self.assertGreater(stunden["groesse"], 0)
+        self.assertIsNone(stunden["letzter_export"])
+        self.assertContains(response, "noch nie")
+
+        self.client.post(reverse("jsonexport"), {"json_export_select": "json_export_select_firma"})
+        response = self.client.get(reverse("jsonexport"))
+        uebersicht = {zeile["bereich"]: zeile for zeile in response.context["uebersicht"]}
+        letzter_export = uebersicht["json_export_select_firma"]["letzter_export"]
+        self.assertIsNotNone(letzter_export)
+        self.assertIsNone(uebersicht["json_export_select_arbeitnehmer"]["letzter_export"])
+
+        # Ein weiterer Export ersetzt den Zeitpunkt, statt einen Eintrag anzulegen.
+        self.client.post(reverse("jsonexport"), {"json_export_select": "json_export_select_firma"})
+        self.assertEqual(ExportVerlauf.objects.filter(bereich="json_export_select_firma").count(), 1)
+        self.assertGreaterEqual(ExportVerlauf.objects.get().exportiert, letzter_export)
+
     def test_post_data(self):
         """
         Testet mit POST data und schaut, ob das PDF erstellt wurde.
@@ -1050,9 +1161,12 @@ class TestJSONExport(TestCase):
         )
 
 
+@override_settings(CACHES=TEST_CACHES)
+@override_settings(STUNDEN_IMPORT_SYNCHRON=True, STUNDEN_IMPORT_PIPELINE=True)
 class TestJSONImport(TestCase):
     """
     Testet den jsonimport View.
+    Die Import Jobs laufen in den Tests direkt im Request.
     """
 
     fixtures = ["webpystunden3_testdata.json"]
@@ -1074,7 +1188,535 @@ class TestJSONImport(TestCase):
         response = self.client.get(reverse("jsonimport"))
         self.assertEqual(response.status_code, 200)
 
+    def test_post_data(self):
+        """
+        Testet den Import einer Firma JSON Datei.
+        Bestehende Einträge werden überschrieben, neue werden angelegt.
+        """
+        self.client.login(username="admin", password="admin")
+        daten = [
+            {"pk": 1, "model": "stunden.firma", "fields": {"firma": "Monty Python Neu"}},
+            {"pk": 3, "model": "stunden.firma", "fields": {"firma": "Flying Circus"}},
+        ]
+        json_file = SimpleUploadedFile(
+            "webpystunden3-export--firma--2017-01-01--00-00.json",
+            json.dumps(daten).encode("utf-8")
+        )
+        response = self.client.post(
+            reverse("jsonimport"),
+            {"json_import_select": "json_import_select_firma", "json_file": json_file}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response["Location"].startswith(
+            reverse("jsonimport_success", kwargs={"count_import": 2})
+        ))
+        self.assertEqual(Firma.objects.get(pk=1).firma, "Monty Python Neu")
+        self.assertEqual(Firma.objects.get(pk=3).firma, "Flying Circus")
+        self.assertEqual(Firma.objects.count(), 3)
+
+    @override_settings(STUNDEN_IMPORT_BATCH_SIZE=1)
+    def test_post_data_rollback(self):
+        """
+        Testet, dass bei einem Fehler keine Daten importiert werden,
+        auch wenn schon Batches davor geschrieben wurden.
+        """
+        self.client.login(username="admin", password="admin")
+        daten = [
+            {"pk": 3, "model": "stunden.firma", "fields": {"firma": "Flying Circus"}},
+            {"pk": 4, "model": "stunden.firma", "fields": {"firma": "Spam", "stundensatz": "x"}},
+        ]
+        json_file = SimpleUploadedFile(
+            "webpystunden3-export--firma--2017-01-01--00-00.json",
+            json.dumps(daten).encode("utf-8")
+        )
+        response = self.client.post(
+            reverse("jsonimport"),
+            {"json_import_select": "json_import_select_firma", "json_file": json_file}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["form"].errors["json_file"])
+        self.assertEqual(Firma.objects.count(), 2)
+
+
+@override_settings(CACHES=TEST_CACHES)
+@override_settings(STUNDEN_IMPORT_SYNCHRON=True, STUNDEN_IMPORT_PIPELINE=True)
+class TestBackup(TestCase):
+    """
+    Testet das komplette Backup als ZIP Archiv und das Einspielen.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+        Einstellungen.objects.create(ust=10)
+
+    def export_backup(self):
+        """
+        Erstellt ein Backup über den jsonexport View.
+        """
+        response = self.client.post(
+            reverse("jsonexport"),
+            {"json_export_select": "json_export_select_backup"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        return b"".join(response.streaming_content)
+
+    def import_backup(self, inhalt):
+        """
+        Spielt ein Backup über den jsonimport View ein.
+        """
+        json_file = SimpleUploadedFile("webpystunden3-backup--2017-01-01--00-00.zip", inhalt)
+        return self.client.post(
+            reverse("jsonimport"),
+            {"json_import_select": "json_import_select_backup", "json_file": json_file}
+        )
+
+    def test_export_manifest(self):
+        """
+        Testet, ob das Archiv alle Models mit Anzahl und Prüfsumme enthält.
+        """
+        self.client.login(username="admin", password="admin")
+        archiv = zipfile.ZipFile(io.BytesIO(self.export_backup()))
+        manifest = json.loads(archiv.read("manifest.json").decode("utf-8"))
+        models = [datei["model"] for datei in manifest["dateien"]]
+        self.assertEqual(models, [
+            "stunden.firma",
+            "stunden.arbeitnehmer",
+            "stunden.einstellungen",
+            "stunden.rechnungsnummer",
+            "stunden.stundenaufzeichnung",
+        ])
+        anzahl = {datei["model"]: datei["anzahl"] for datei in manifest["dateien"]}
+        self.assertEqual(anzahl["stunden.stundenaufzeichnung"], 5)
+        self.assertEqual(anzahl["stunden.einstellungen"], 1)
+
+    def test_restore(self):
+        """
+        Testet, ob ein Backup alle Daten in einem Durchgang wieder herstellt.
+        """
+        self.client.login(username="admin", password="admin")
+        inhalt = self.export_backup()
+        StundenAufzeichnung.objects.all().delete()
+        Einstellungen.objects.update(ust=20)
+        Firma.objects.filter(pk=1).update(firma="Umbenannt")
+
+        response = self.import_backup(inhalt)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(StundenAufzeichnung.objects.count(), 5)
+        self.assertEqual(Einstellungen.objects.get().ust, 10)
+        self.assertEqual(Firma.objects.get(pk=1).firma, "Monty Python")
+
+    def test_restore_falsche_pruefsumme(self):
+        """
+        Testet, ob ein verändertes Archiv abgelehnt wird und nichts ändert.
+        """
+        self.client.login(username="admin", password="admin")
+        archiv = zipfile.ZipFile(io.BytesIO(self.export_backup()))
+        verändert = io.BytesIO()
+        with zipfile.ZipFile(verändert, "w") as neues_archiv:
+            for name in archiv.namelist():
+                data = archiv.read(name)
+                if name == "stunden.firma.json":
+                    data = data.replace(b"Monty Python Music", b"Monty Python Jazz")
+                neues_archiv.writestr(name, data)
+        StundenAufzeichnung.objects.all().delete()
+
+        response = self.import_backup(verändert.getvalue())
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["form"].errors["json_file"])
+        self.assertEqual(StundenAufzeichnung.objects.count(), 0)
+        self.assertEqual(Firma.objects.get(pk=2).firma, "Monty Python Music")
+
+
+@override_settings(CACHES=TEST_CACHES)
+@override_settings(STUNDEN_IMPORT_SYNCHRON=True)
+class TestJSONImportJob(TestCase):
+    """
+    Testet die Import Jobs mit Prüfung ohne Schreiben (Dry-Run) und Status.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+
+    def test_dry_run(self):
+        """
+        Testet, ob die Prüfung Fehler pro Zeile liefert und nichts schreibt.
+        """
+        self.client.login(username="admin", password="admin")
+        daten = [
+            {"pk": 6, "model": "stunden.stundenaufzeichnung", "fields": {
+                "datum": "2017-01-02", "firma": 1, "arbeitnehmer": 1, "startzeit": "08:00",
+                "endzeit": "09:00", "protokoll": "Gut", "bezahlt": False}},
+            {"pk": 7, "model": "stunden.stundenaufzeichnung", "fields": {
+                "datum": "2017-01-02", "firma": 42, "arbeitnehmer": 1, "startzeit": "08:00",
+                "endzeit": "09:00", "protokoll": "Firma fehlt", "bezahlt": False}},
+            {"pk": 8, "model": "stunden.stundenaufzeichnung", "fields": {
+                "datum": "2017-01-02", "firma": 1, "arbeitnehmer": 1, "startzeit": "10:00",
+                "endzeit": "09:00", "protokoll": "Endzeit vor Startzeit", "bezahlt": False}},
+            {"pk": 9, "model": "stunden.stundenaufzeichnung", "fields": {
+                "datum": "kein Datum", "firma": 1, "arbeitnehmer": 1, "startzeit": "08:00",
+                "endzeit": "09:00", "protokoll": "Ungültig", "bezahlt": False}},
+        ]
+        json_file = SimpleUploadedFile(
+            "webpystunden3-export--stundenaufzeichnung--2017-01-01--00-00.json",
+            json.dumps(daten).encode("utf-8")
+        )
+        response = self.client.post(reverse("jsonimport"), {
+            "json_import_select": "json_import_select_stundenaufzeichnung",
+            "json_file": json_file,
+            "dry_run": "on",
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(StundenAufzeichnung.objects.count(), 5)
+
+        status_url = response["Location"] + "status/"
+        status = json.loads(self.client.get(status_url).content.decode("utf-8"))
+        self.assertEqual(status["status"], "fertig")
+        self.assertEqual(status["anzahl"], 4)
+        self.assertEqual([fehler["zeile"] for fehler in status["fehler"]], [2, 3, 4])
+
+        response = self.client.get(response["Location"])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Endzeit muss nach der Startzeit liegen")
+
+    @override_settings(STUNDEN_IMPORT_TRANSAKTION="batch", STUNDEN_IMPORT_BATCH_SIZE=1)
+    def test_fehler_im_modus_batch(self):
+        """
+        Testet, ob ein Fehler im Modus "batch" die bereits gespeicherten
+        Einträge meldet.
+        """
+        self.client.login(username="admin", password="admin")
+        daten = [
+            {"pk": 6, "model": "stunden.stundenaufzeichnung", "fields": {
+                "datum": "2017-01-02", "firma": 1, "arbeitnehmer": 1, "startzeit": "08:00",
+                "endzeit": "09:00", "protokoll": "Gut", "bezahlt": False}},
+            {"pk": 7, "model": "stunden.stundenaufzeichnung", "fields": {
+                "datum": "2017-01-03", "firma": 1, "arbeitnehmer": 1, "startzeit": "08:00",
+                "endzeit": "09:00", "protokoll": "Auch gut", "bezahlt": False}},
+            {"pk": 8, "model": "stunden.stundenaufzeichnung", "fields": {
+                "datum": "kein Datum", "firma": 1, "arbeitnehmer": 1, "startzeit": "08:00",
+                "endzeit": "09:00", "protokoll": "Ungültig", "bezahlt": False}},
+        ]
+        json_file = SimpleUploadedFile(
+            "webpystunden3-export--stundenaufzeichnung--2017-01-01--00-00.json",
+            json.dumps(daten).encode("utf-8")
+        )
+        response = self.client.post(reverse("jsonimport"), {
+            "json_import_select": "json_import_select_stundenaufzeichnung",
+            "json_file": json_file,
+        })
+        self.assertEqual(StundenAufzeichnung.objects.count(), 7)
+        self.assertContains(response, "Die ersten 2 Einträge wurden bereits gespeichert")
+        self.assertNotContains(response, "es wurden keine Daten geändert")
+
+    def test_fehler_im_modus_gesamt(self):
+        """
+        Testet, ob ein Fehler im Modus "gesamt" nichts speichert.
+        """
+        self.client.login(username="admin", password="admin")
+        daten = [
+            {"pk": 6, "model": "stunden.stundenaufzeichnung", "fields": {
+                "datum": "2017-01-02", "firma": 1, "arbeitnehmer": 1, "startzeit": "08:00",
+                "endzeit": "09:00", "protokoll": "Gut", "bezahlt": False}},
+            {"pk": 8, "model": "stunden.stundenaufzeichnung", "fields": {
+                "datum": "kein Datum", "firma": 1, "arbeitnehmer": 1, "startzeit": "08:00",
+                "endzeit": "09:00", "protokoll": "Ungültig", "bezahlt": False}},
+        ]
+        json_file = SimpleUploadedFile(
+            "webpystunden3-export--stundenaufzeichnung--2017-01-01--00-00.json",
+            json.dumps(daten).encode("utf-8")
+        )
+        response = self.client.post(reverse("jsonimport"), {
+            "json_import_select": "json_import_select_stundenaufzeichnung",
+            "json_file": json_file,
+        })
+        self.assertEqual(StundenAufzeichnung.objects.count(), 5)
+        self.assertContains(response, "es wurden keine Daten geändert")
+
+    def test_dry_run_natural_keys(self):
+        """
+        Testet, ob die Prüfung natürliche Schlüssel pro Batch mit einer
+        Abfrage pro Model auflöst, unabhängig von der Anzahl der Zeilen.
+        """
+        def zeilen(anzahl):
+            daten = [{"model": "stunden.firma", "fields": {"firma": "Monty Python", "name": "John Cleese"}}]
+            for pk in range(100, 100 + anzahl):
+                daten.append({"pk": pk, "model": "stunden.stundenaufzeichnung", "fields": {
+                    "datum": "2017-01-02", "firma": ["Monty Python"], "arbeitnehmer": ["Michael Palin"],
+                    "startzeit": "08:00", "endzeit": "09:00", "protokoll": "Gut", "bezahlt": False}})
+            daten.append({"pk": 99, "model": "stunden.stundenaufzeichnung", "fields": {
+                "datum": "2017-01-02", "firma": ["Gibt es nicht"], "arbeitnehmer": ["Michael Palin"],
+                "startzeit": "08:00", "endzeit": "09:00", "protokoll": "Firma fehlt", "bezahlt": False}})
+            return daten
+
+        with CaptureQueriesContext(connection) as wenige:
+            ergebnis = validate_rows(zeilen(2), batch_size=100)
+        with CaptureQueriesContext(connection) as viele:
+            ergebnis = validate_rows(zeilen(50), batch_size=100)
+        self.assertEqual(len(wenige), len(viele))
+        self.assertEqual(ergebnis.anzahl, 52)
+        self.assertEqual([fehler["zeile"] for fehler in ergebnis.fehler], [52])
+        self.assertIn("Gibt es nicht", ergebnis.fehler[0]["fehler"])
+
+    def test_status_aus_dem_cache(self):
+        """
+        Testet, ob der Status eines Jobs aus dem Cache kommt, wie bei einem
+        Job, der in einem anderen Prozess läuft.
+        """
+        self.client.login(username="admin", password="admin")
+        job = ImportJob("json_import_select_stundenaufzeichnung", False, "export.json", 1000)
+        job.status = "laufend"
+        job.anzahl = 42
+        job.speichern()
+        self.assertEqual(cache.get(JOB_KEY.format(job.id))["anzahl"], 42)
+
+        status = json.loads(
+            self.client.get(reverse("jsonimport_job_status", args=[job.id])).content.decode("utf-8")
+        )
+        self.assertEqual(status["status"], "laufend")
+        self.assertEqual(status["anzahl"], 42)
+
+        response = self.client.get(reverse("jsonimport_job", args=[job.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "export.json")
+
+    def test_unbekannter_job(self):
+        """
+        Testet den Status eines unbekannten Jobs.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("jsonimport_job_status", args=["abc"]))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=TEST_CACHES)
+@override_settings(STUNDEN_IMPORT_SYNCHRON=True)
+class TestUpsertImport(TestCase):
+    """
+    Testet den Export mit natürlichen Schlüsseln und den Upsert Import.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+
+    def export(self, bereich):
+        response = self.client.post(reverse("jsonexport"), {
+            "json_export_select": "json_export_select_{}".format(bereich),
+            "json_export_natural": "on",
+        })
+        return response.content
+
+    def upsert(self, bereich, content):
+        json_file = SimpleUploadedFile(
+            "webpystunden3-export--{}--2017-01-01--00-00.json".format(bereich),
+            content
+        )
+        response = self.client.post(reverse("jsonimport"), {
+            "json_import_select": "json_import_select_{}".format(bereich),
+            "json_file": json_file,
+            "upsert": "on",
+        })
+        self.assertEqual(response.status_code, 302)
+        status = self.client.get(response["Location"] + "status/")
+        return json.loads(status.content.decode("utf-8"))
+
+    def test_andere_primary_keys(self):
+        """
+        Testet, ob Firmen über den Namen gefunden werden, auch wenn die
+        Primary Keys in der Datenbank andere sind.
+        """
+        self.client.login(username="admin", password="admin")
+        firmen = self.export("firma")
+        stunden = self.export("stundenaufzeichnung")
+        self.assertNotIn(b'"pk"', firmen)
+        self.assertIn(b'"firma": ["Monty Python"]', stunden)
+
+        Firma.objects.all().delete()
+        Firma.objects.create(firma="Flying Circus")
+        status = self.upsert("firma", firmen)
+        self.assertEqual(status["status"], "fertig")
+        self.assertEqual((status["neu"], status["geaendert"], status["unveraendert"]), (2, 0, 0))
+        self.assertEqual(Firma.objects.count(), 3)
+        self.assertNotEqual(Firma.objects.get(firma="Monty Python").pk, 1)
+
+        status = self.upsert("stundenaufzeichnung", stunden)
+        self.assertEqual(status["neu"], 5)
+        self.assertEqual(
+            StundenAufzeichnung.objects.get(pk=4).firma,
+            Firma.objects.get(firma="Monty Python Music")
+        )
+
+        # Ein zweiter Import ändert nichts mehr.
+        status = self.upsert("firma", firmen)
+        self.assertEqual((status["neu"], status["geaendert"], status["unveraendert"]), (0, 0, 2))
+        status = self.upsert("stundenaufzeichnung", stunden)
+        self.assertEqual((status["neu"], status["geaendert"], status["unveraendert"]), (0, 0, 5))
+        self.assertEqual(Firma.objects.count(), 3)
+        self.assertEqual(StundenAufzeichnung.objects.count(), 5)
+
+    def test_geaendert(self):
+        """
+        Testet, ob nur geänderte Einträge aktualisiert werden.
+        """
+        self.client.login(username="admin", password="admin")
+        firmen = self.export("firma")
+        Firma.objects.filter(firma="Monty Python").update(ort="Wien")
+        updated = Firma.objects.get(firma="Monty Python Music").updated
+
+        status = self.upsert("firma", firmen)
+        self.assertEqual((status["neu"], status["geaendert"], status["unveraendert"]), (0, 1, 1))
+        self.assertNotEqual(Firma.objects.get(firma="Monty Python").ort, "Wien")
+        self.assertEqual(Firma.objects.get(firma="Monty Python Music").updated, updated)
+
+    def test_doppelte_schluessel(self):
+        """
+        Testet, ob bei doppelten Schlüsseln in einem Batch der letzte
+        Eintrag gilt, statt an der Datenbank zu scheitern.
+        """
+        self.client.login(username="admin", password="admin")
+        firmen = [
+            {"model": "stunden.firma", "fields": {"firma": "Flying Circus", "ort": "London"}},
+            {"model": "stunden.firma", "fields": {"firma": "Flying Circus", "ort": "Wien"}},
+            {"model": "stunden.firma", "fields": {"firma": "Monty Python", "ort": "Wien"}},
+            {"model": "stunden.firma", "fields": {"firma": "Monty Python", "ort": "Graz"}},
+        ]
+        status = self.upsert("firma", json.dumps(firmen).encode("utf-8"))
+        self.assertEqual(status["status"], "fertig")
+        self.assertEqual((status["neu"], status["geaendert"]), (1, 1))
+        self.assertEqual(Firma.objects.get(firma="Flying Circus").ort, "Wien")
+        self.assertEqual(Firma.objects.get(firma="Monty Python").ort, "Graz")
+
+        stunden = [
+            {"pk": 6, "model": "stunden.stundenaufzeichnung", "fields": {
+                "datum": "2017-01-02", "firma": ["Monty Python"], "arbeitnehmer": ["Michael Palin"],
+                "startzeit": "08:00", "endzeit": "09:00", "protokoll": "Erster", "bezahlt": False}},
+            {"pk": 6, "model": "stunden.stundenaufzeichnung", "fields": {
+                "datum": "2017-01-02", "firma": ["Monty Python"], "arbeitnehmer": ["Michael Palin"],
+                "startzeit": "08:00", "endzeit": "09:00", "protokoll": "Zweiter", "bezahlt": False}},
+        ]
+        status = self.upsert("stundenaufzeichnung", json.dumps(stunden).encode("utf-8"))
+        self.assertEqual(status["status"], "fertig")
+        self.assertEqual(StundenAufzeichnung.objects.get(pk=6).protokoll, "Zweiter")
+
+    def test_unbekannte_firma(self):
+        """
+        Testet einen natürlichen Schlüssel, der nicht existiert.
+        """
+        self.client.login(username="admin", password="admin")
+        stunden = self.export("stundenaufzeichnung")
+        stunden = stunden.replace(b'["Monty Python Music"]', b'["Gibt es nicht"]')
+        json_file = SimpleUploadedFile(
+            "webpystunden3-export--stundenaufzeichnung--2017-01-01--00-00.json",
+            stunden
+        )
+        response = self.client.post(reverse("jsonimport"), {
+            "json_import_select": "json_import_select_stundenaufzeichnung",
+            "json_file": json_file,
+            "upsert": "on",
+        })
+        self.assertContains(response, "Gibt es nicht")
+        self.assertEqual(StundenAufzeichnung.objects.count(), 5)
+
+
+class TestJSONStreamParser(SimpleTestCase):
+    """
+    Testet den inkrementellen JSON Parser für den Import.
+    """
+
+    def test_elemente_einzeln(self):
+        """
+        Testet, ob die Elemente auch bei sehr kleinen Stücken richtig
+        gelesen werden, auch wenn ein Umlaut auf zwei Stücke aufgeteilt ist.
+        """
+        daten = [{"pk": i, "name": "Müller {}".format(i)} for i in range(20)]
+        json_file = io.BytesIO(json.dumps(daten, indent=4).encode("utf-8"))
+        self.assertEqual(list(iter_json_array(json_file, chunk_size=3)), daten)
+
+    def test_leeres_array(self):
+        """
+        Testet ein leeres JSON Array.
+        """
+        self.assertEqual(list(iter_json_array(io.BytesIO(b" [ ] "))), [])
+
+    def test_fehlerhafte_datei(self):
+        """
+        Testet, ob fehlerhafte oder unvollständige Dateien einen Fehler liefern.
+        """
+        for inhalt in [b'{"pk": 1}', b'[{"pk": 1}', b'[{"pk": 1} {"pk": 2}]', b'[{"pk": 1}] x']:
+            with self.assertRaises(DeserializationError):
+                list(iter_json_array(io.BytesIO(inhalt), chunk_size=4))
+
+
+class TestImportPipeline(SimpleTestCase):
+    """
+    Testet die Parser Stufe des Imports in einem eigenen Thread.
+    """
+
+    def test_reihenfolge(self):
+        """
+        Testet, ob alle Batches in der richtigen Reihenfolge ankommen,
+        mit und ohne eigenen Thread.
+        """
+        for queue_size in [0, 1, 4]:
+            ergebnis = ImportErgebnis()
+            batches = list(pipeline_batches(iter(range(10)), 3, ergebnis, queue_size=queue_size))
+            self.assertEqual(batches, [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]])
+
+    def test_begrenzte_warteschlange(self):
+        """
+        Testet, ob der Parser dem Writer höchstens queue_size Batches voraus ist.
+        """
+        gelesen = []
+
+        def zeilen():
+            for i in range(100):
+                gelesen.append(i)
+                yield i
+
+        writer_batches = pipeline_batches(zeilen(), 1, ImportErgebnis(), queue_size=2)
+        next(writer_batches)
+        sleep(0.2)
+        # Ein Batch beim Writer, zwei in der Warteschlange, einer beim Parser.
+        self.assertLessEqual(len(gelesen), 4)
+        writer_batches.close()
+
+    def test_parser_fehler(self):
+        """
+        Testet, ob ein Fehler des Parsers beim Writer ankommt.
+        """
+        def zeilen():
+            yield 1
+            raise DeserializationError("kaputt")
+
+        with self.assertRaises(DeserializationError):
+            list(pipeline_batches(zeilen(), 1, ImportErgebnis(), queue_size=2))
+
 
+@override_settings(CACHES=TEST_CACHES)
 class TestJSONImportSuccess(TestCase):
     """
     Testet den jsonimport_success View.
@@ -1101,6 +1743,7 @@ class TestJSONImportSuccess(TestCase):
         self.assertEqual(response.status_code, 200)
 
 
+@override_settings(CACHES=TEST_CACHES)
 class TestEinstellungen(TestCase):
     """
     Testet den Einstellungen View.
@@ -1126,9 +1769,10 @@ class TestEinstellungen(TestCase):
         self.assertEqual(response.status_code, 200)
 
 
-class TestGetFirmaStundensatz(TestCase):
+@override_settings(CACHES=TEST_CACHES)
+class TestEinstellungenCache(TestCase):
     """
-    Testet den get_firma_stundensatz View.
+    Testet die Einstellungen im Speicher des Prozesses und die Versionen.
     """
 
     fixtures = ["webpystunden3_testdata.json"]
@@ -1141,19 +1785,140 @@ class TestGetFirmaStundensatz(TestCase):
         admin.is_staff = True
         admin.is_superuser = True
         admin.save()
+        cache.clear()
 
-    def test_response_status_code(self):
+    def tearDown(self):
         """
-        Testet den Status Code.
+        Das tearDown läuft nach den Tests, die Datenbank wird zurückgerollt.
+        """
+        cache.clear()
+
+    def test_standard(self):
+        """
+        Testet den Standardwert ohne gespeicherte Einstellungen.
+        """
+        self.assertEqual(get_einstellungen().ust, 20)
+
+    def test_ohne_abfrage(self):
+        """
+        Testet, ob die Einstellungen nur einmal geladen werden.
+        """
+        Einstellungen.objects.create(ust=10)
+        self.assertEqual(get_einstellungen().ust, 10)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_einstellungen().ust, 10)
+
+    def test_invalidierung(self):
+        """
+        Testet, ob Speichern über den View die Einstellungen neu lädt und
+        eine neue Version von einem anderen Prozess erkannt wird.
         """
         self.client.login(username="admin", password="admin")
-        response = self.client.get(reverse("get_firma_stundensatz", args=["1"]))
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_einstellungen().ust, 20)
+        self.client.post(reverse("einstellungen"), {
+            "einstellungen_bearbeiten": "Einstellungen bearbeiten",
+            "input_ust": "10",
+        })
+        self.assertEqual(get_einstellungen().ust, 10)
+
+        # Ohne Signal bleibt der Wert im Speicher, bis die Version erhöht wird.
+        Einstellungen.objects.update(ust=13)
+        self.assertEqual(get_einstellungen().ust, 10)
+        bump_version("stunden.einstellungen")
+        self.assertEqual(get_einstellungen().ust, 13)
+
+
+@override_settings(CACHES={
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "zweistufig-test",
+    },
+})
+class TestZweistufigerCache(SimpleTestCase):
+    """
+    Testet den Cache mit lokalem LRU vor dem geteilten Cache. Zwei Instanzen
+    mit verschiedener LOCATION stehen für zwei Prozesse.
+    """
 
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        self.prozess_a = ZweistufigerCache("prozess-a", {"OPTIONS": {"LOKAL_MAX_EINTRAEGE": 3}})
+        self.prozess_b = ZweistufigerCache("prozess-b", {"OPTIONS": {"VERSION_TIMEOUT": 0.05}})
+        self.prozess_a.clear()
+        self.prozess_b.clear()
 
-class TestRechnungsnummer(TestCase):
+    def test_lokaler_treffer(self):
+        """
+        Testet, ob ein zweiter Zugriff aus dem lokalen Speicher kommt.
+        """
+        self.prozess_a.set("stunden:test", "wert")
+        self.prozess_b.get("stunden:test")
+        statistik = self.prozess_b.statistik()
+        self.assertEqual(self.prozess_b.get("stunden:test"), "wert")
+        self.assertEqual(self.prozess_b.statistik()["treffer_lokal"], statistik["treffer_lokal"] + 1)
+        self.assertEqual(self.prozess_b.statistik()["treffer_shared"], statistik["treffer_shared"])
+
+    def test_fehlschlag(self):
+        """
+        Testet den Zähler für fehlende Einträge.
+        """
+        fehlschlaege = self.prozess_a.statistik()["fehlschlaege"]
+        self.assertIsNone(self.prozess_a.get("stunden:fehlt"))
+        self.assertEqual(self.prozess_a.get("stunden:fehlt", "standard"), "standard")
+        self.assertEqual(self.prozess_a.statistik()["fehlschlaege"], fehlschlaege + 2)
+
+    def test_lru(self):
+        """
+        Testet, ob der lokale Speicher begrenzt ist und den ältesten Eintrag
+        verdrängt.
+        """
+        for nummer in range(4):
+            self.prozess_a.set("stunden:lru:{}".format(nummer), nummer)
+        self.assertEqual(self.prozess_a.statistik()["lokal_eintraege"], 3)
+        treffer_shared = self.prozess_a.statistik()["treffer_shared"]
+        self.assertEqual(self.prozess_a.get("stunden:lru:0"), 0)
+        self.assertEqual(self.prozess_a.statistik()["treffer_shared"], treffer_shared + 1)
+
+    def test_version_invalidierung(self):
+        """
+        Testet, ob eine erhöhte Version in einem anderen Prozess nach dem
+        VERSION_TIMEOUT sichtbar ist.
+        """
+        self.prozess_a.set("stunden:version:stunden.firma", 1, None)
+        self.assertEqual(self.prozess_b.get("stunden:version:stunden.firma"), 1)
+        self.assertEqual(self.prozess_a.incr("stunden:version:stunden.firma"), 2)
+        self.assertEqual(self.prozess_a.get("stunden:version:stunden.firma"), 2)
+        sleep(0.1)
+        self.assertEqual(self.prozess_b.get("stunden:version:stunden.firma"), 2)
+
+    def test_nur_geteilt(self):
+        """
+        Testet, ob Keys ohne passenden Prefix nicht lokal gehalten werden.
+        """
+        self.prozess_b.set("sitzung", "alt")
+        self.prozess_a.set("sitzung", "neu")
+        self.assertEqual(self.prozess_b.get("sitzung"), "neu")
+        self.assertEqual(self.prozess_b.statistik()["lokal_eintraege"], 0)
+
+    def test_loeschen(self):
+        """
+        Testet, ob Löschen beide Stufen betrifft.
+        """
+        self.prozess_a.set("stunden:test", "wert")
+        self.prozess_a.delete("stunden:test")
+        self.assertIsNone(self.prozess_a.get("stunden:test"))
+        self.assertFalse(self.prozess_a.has_key("stunden:test"))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestGetFirmaStundensatz(TestCase):
     """
-    Testet den Rechnungsnummer View.
+    Testet den get_firma_stundensatz View.
     """
 
     fixtures = ["webpystunden3_testdata.json"]
@@ -1172,5 +1937,1424 @@ class TestRechnungsnummer(TestCase):
         Testet den Status Code.
         """
         self.client.login(username="admin", password="admin")
-        response = self.client.get(reverse("rechnungsnummer"))
+        response = self.client.get(reverse("get_firma_stundensatz", args=["1"]))
         self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestCachedModelChoiceField(TestCase):
+    """
+    Testet die gecachte Auswahl von Firma und Arbeitnehmer in Formularen.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        cache.clear()
+
+    def tearDown(self):
+        """
+        Das tearDown läuft nach den Tests, die Datenbank wird zurückgerollt.
+        """
+        cache.clear()
+
+    def test_auswahl_ohne_abfrage(self):
+        """
+        Testet, ob die Auswahl nach dem ersten Mal ohne Abfrage angezeigt wird.
+        """
+        str(StundenAufzeichnungForm()["firma"])
+        with self.assertNumQueries(0):
+            html = str(StundenAufzeichnungForm()["firma"])
+        self.assertIn("Monty Python Music", html)
+
+    def test_anlegen_ohne_cache(self):
+        """
+        Testet, ob ein neues Feld weder Cache noch Datenbank braucht, wie beim
+        Import der Formulare.
+        """
+        with self.assertNumQueries(0):
+            with mock.patch("stunden.forms.get_choices") as get_choices:
+                CachedModelChoiceField(queryset=Firma.objects.all())
+        get_choices.assert_not_called()
+
+    def test_invalidierung(self):
+        """
+        Testet, ob eine neue Firma sofort in der Auswahl ist.
+        """
+        str(StundenAufzeichnungForm()["firma"])
+        Firma.objects.create(firma="Flying Circus")
+        self.assertIn("Flying Circus", str(StundenAufzeichnungForm()["firma"]))
+
+    def test_pruefen(self):
+        """
+        Testet, ob eine unbekannte ID ohne Abfrage abgelehnt wird und eine
+        gültige ID die Firma liefert.
+        """
+        field = StundenAufzeichnungForm().fields["firma"]
+        self.assertEqual(field.clean("2"), Firma.objects.get(pk=2))
+        with self.assertNumQueries(0):
+            with self.assertRaises(ValidationError):
+                field.clean("42")
+            with self.assertRaises(ValidationError):
+                field.clean("x")
+
+
+    def test_validieren_ohne_abfrage(self):
+        """
+        Testet, ob das Prüfen der Formulare mit warmem Cache ohne Abfrage
+        auskommt, auch ohne ForeignKey.validate der Models.
+        """
+        daten = {
+            StundenAufzeichnungForm: {
+                "datum": "02.01.2017", "firma": "2", "startzeit": "08:00", "endzeit": "09:00",
+                "arbeitnehmer": "1", "protokoll": "Gut",
+            },
+            RechnungsForm: {
+                "firma": "2", "rechnungs_nummer": "R-1", "rechnungs_titel": "Wartung",
+                "rechnungs_stundenlohn": "50", "meine_daten": "1",
+            },
+            RechnungsSummeForm: {
+                "firma": "2", "rechnungs_nummer": "R-1", "rechnungs_titel": "Erstellung",
+                "rechnungs_summe": "100", "meine_daten": "1",
+            },
+        }
+        for form_class, data in daten.items():
+            self.assertTrue(form_class(data).is_valid())
+            form = form_class(data)
+            with self.assertNumQueries(0):
+                self.assertTrue(form.is_valid())
+            self.assertEqual(form.cleaned_data["firma"], Firma.objects.get(pk=2))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestViewCache(TransactionTestCase):
+    """
+    Testet den Cache der Listen Seiten mit den Versionen der Models.
+    Ein TransactionTestCase, weil innerhalb einer Transaktion nicht
+    gecacht wird.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+        cache.clear()
+
+    def tearDown(self):
+        """
+        Das tearDown läuft nach den Tests.
+        """
+        cache.clear()
+
+    def test_wiederholter_aufruf(self):
+        """
+        Testet, ob ein wiederholter Aufruf aus dem Cache kommt und eine
+        Änderung über ein Signal die Seite neu erstellt.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("firma"))
+        self.assertContains(response, "Monty Python Music")
+
+        # Session und User, aber keine Abfrage für die Firmen.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("firma"))
+        self.assertContains(response, "Monty Python Music")
+
+        firma = Firma.objects.get(pk=2)
+        firma.firma = "Monty Python Records"
+        firma.save()
+        response = self.client.get(reverse("firma"))
+        self.assertContains(response, "Monty Python Records")
+        self.assertNotContains(response, "Monty Python Music")
+
+    def test_bezahlt_markieren(self):
+        """
+        Testet, ob das Markieren als bezahlt mit update() den Cache der
+        Index Seite invalidiert.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("index"))
+        nicht_bezahlt = response.content.decode("utf-8").count("<tr class=\"danger\">")
+        self.client.post(reverse("rechnung"), {"bezahlt_markieren": "1", "checks[]": ["2", "3"]})
+        self.assertTrue(StundenAufzeichnung.objects.get(pk=2).bezahlt)
+        response = self.client.get(reverse("index"))
+        self.assertEqual(response.content.decode("utf-8").count("<tr class=\"danger\">"), nicht_bezahlt - 2)
+
+    def test_dashboard_nach_monatssummen(self):
+        """
+        Testet, ob das Neuberechnen der MonatsSummen nach einer Änderung
+        direkt in der Datenbank Cache und ETag des Dashboards invalidiert.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("dashboard"), {"jahr": 2012})
+        self.assertEqual(response.context["auswertung"]["gesamt"]["anzahl_summe"], 5)
+        etag = response["ETag"]
+        response = self.client.get(reverse("dashboard"), {"jahr": 2012}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # update() löst keine Signale aus, wie eine Änderung direkt in der Datenbank.
+        StundenAufzeichnung.objects.update(datum=date(2013, 1, 1))
+        call_command("monatssummen", stdout=io.StringIO())
+
+        response = self.client.get(reverse("dashboard"), {"jahr": 2012}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["auswertung"]["gesamt"]["anzahl_summe"], 0)
+
+    def test_header_und_csrf(self):
+        """
+        Testet, ob ein Treffer die Header des Views liefert und Antworten
+        mit CSRF Token nicht gecacht werden.
+        """
+        aufrufe = []
+
+        @versioned_cache(Firma)
+        def view(request):
+            aufrufe.append(request.get_full_path())
+            if "csrf" in request.GET:
+                get_token(request)
+            response = HttpResponse("Inhalt", content_type="text/plain; charset=utf-8")
+            response["X-Stunden"] = "1"
+            return response
+
+        factory = RequestFactory()
+        for i in range(2):
+            request = factory.get("/test/")
+            request.user = User.objects.get(username="admin")
+            response = view(request)
+            self.assertEqual(response["Content-Type"], "text/plain; charset=utf-8")
+            self.assertEqual(response["X-Stunden"], "1")
+            self.assertEqual(response.content, b"Inhalt")
+        self.assertEqual(aufrufe, ["/test/"])
+
+        for i in range(2):
+            request = factory.get("/test/", {"csrf": 1})
+            request.user = User.objects.get(username="admin")
+            view(request)
+        self.assertEqual(aufrufe, ["/test/", "/test/?csrf=1", "/test/?csrf=1"])
+
+    def test_pagination(self):
+        """
+        Testet, ob jede Seite der Pagination einzeln gecacht wird.
+        """
+        self.client.login(username="admin", password="admin")
+        for i in range(12):
+            Firma.objects.create(firma="Firma {:02d}".format(i))
+        erste = self.client.get(reverse("firma")).content
+        zweite = self.client.get(reverse("firma"), {"page": 2}).content
+        self.assertNotEqual(erste, zweite)
+        self.assertEqual(self.client.get(reverse("firma"), {"page": 2}).content, zweite)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestZeilenCache(TestCase):
+    """
+    Testet die gecachten Zeilen der Stundenaufzeichnung.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+        cache.clear()
+
+    def tearDown(self):
+        """
+        Das tearDown läuft nach den Tests, die Datenbank wird zurückgerollt.
+        """
+        cache.clear()
+
+    def fragment_key(self, row):
+        return make_template_fragment_key(
+            "stunden_zeile_liste",
+            [row.id, row.updated, row.firma.updated, row.arbeitnehmer.updated]
+        )
+
+    def test_zeile_gecacht(self):
+        """
+        Testet, ob die Zeilen nach dem ersten Aufruf im Cache liegen.
+        """
+        self.client.login(username="admin", password="admin")
+        self.client.get(reverse("stundenaufzeichnung"))
+        row = StundenAufzeichnung.objects.select_related().get(pk=5)
+        self.assertIn(row.protokoll, cache.get(self.fragment_key(row)))
+
+    def test_invalidierung(self):
+        """
+        Testet, ob geänderte Einträge und Firmen neu gerendert werden.
+        """
+        self.client.login(username="admin", password="admin")
+        self.client.get(reverse("stundenaufzeichnung"))
+        row = StundenAufzeichnung.objects.get(pk=5)
+        row.protokoll = "Geändertes Protokoll"
+        row.save()
+        firma = row.firma
+        firma.firma = "Geänderte Firma"
+        firma.save()
+        response = self.client.get(reverse("stundenaufzeichnung"))
+        self.assertContains(response, "Geändertes Protokoll")
+        self.assertContains(response, "Geänderte Firma")
+
+    def test_bezahlt(self):
+        """
+        Testet, ob bezahlt markierte Einträge auf der Startseite neu
+        gerendert werden.
+        """
+        self.client.login(username="admin", password="admin")
+        self.client.get(reverse("index"))
+        bezahlt_setzen(StundenAufzeichnung.objects.all(), False)
+        response = self.client.get(reverse("index"))
+        self.assertNotContains(response, '<tr class="success">')
+
+
+class TestTemplateCache(SimpleTestCase):
+    """
+    Testet das Vorkompilieren der Templates und template_zeiten.
+    """
+
+    def test_stunden_templates(self):
+        """
+        Testet, ob alle Templates der App gefunden werden.
+        """
+        namen = stunden_templates()
+        self.assertIn("base.html", namen)
+        self.assertIn("stunden/index.html", namen)
+        self.assertEqual(namen, sorted(namen))
+
+    def test_vorkompilieren(self):
+        """
+        Testet, ob der cached Loader nach dem Vorkompilieren alle Templates
+        enthält.
+        """
+        templates = [{
+            "BACKEND": "django.template.backends.django.DjangoTemplates",
+            "OPTIONS": {
+                "loaders": [
+                    ("django.template.loaders.cached.Loader", [
+                        "django.template.loaders.app_directories.Loader",
+                    ]),
+                ],
+            },
+        }]
+        with override_settings(TEMPLATES=templates):
+            anzahl = templates_vorkompilieren()
+            self.assertEqual(anzahl, len(stunden_templates()))
+            loader = get_engine().template_loaders[0]
+            self.assertIn("stunden/index.html", loader.get_template_cache)
+
+    def test_template_zeiten(self):
+        """
+        Testet die Ausgabe des template_zeiten Commands.
+        """
+        ausgabe = io.StringIO()
+        call_command("template_zeiten", wiederholungen=1, stdout=ausgabe)
+        self.assertIn("stunden/index.html", ausgabe.getvalue())
+        self.assertIn("Summe", ausgabe.getvalue())
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestIdentityMap(TestCase):
+    """
+    Testet die IdentityMap für Firma und Arbeitnehmer.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+        cache.clear()
+
+    def tearDown(self):
+        """
+        Das tearDown läuft nach den Tests, die Datenbank wird zurückgerollt.
+        """
+        cache.clear()
+
+    def test_ein_objekt(self):
+        """
+        Testet, ob derselbe Eintrag immer dasselbe Objekt ist.
+        """
+        identity_map = IdentityMap()
+        firma = identity_map.get(Firma, 1)
+        self.assertIs(identity_map.get(Firma, 1), firma)
+        self.assertEqual(firma, Firma.objects.get(pk=1))
+        self.assertFalse(firma._state.adding)
+        with self.assertRaises(Firma.DoesNotExist):
+            identity_map.get(Firma, 999)
+
+    def test_verbinden(self):
+        """
+        Testet, ob verbinden ohne Abfrage dieselben Objekte setzt.
+        """
+        IdentityMap().get(Firma, 1)
+        IdentityMap().get(Arbeitnehmer, 1)
+        rows = list(StundenAufzeichnung.objects.filter(firma_id=1))
+        identity_map = IdentityMap()
+        with self.assertNumQueries(0):
+            rows = identity_map.verbinden(rows)
+            self.assertEqual(len({id(row.firma) for row in rows}), 1)
+            self.assertEqual(rows[0].arbeitnehmer.name, "Michael Palin")
+
+    def test_invalidierung(self):
+        """
+        Testet, ob eine geänderte Firma neu geladen wird.
+        """
+        IdentityMap().get(Firma, 1)
+        firma = Firma.objects.get(pk=1)
+        firma.firma = "Neuer Name"
+        firma.save()
+        self.assertEqual(IdentityMap().get(Firma, 1).firma, "Neuer Name")
+
+    def test_middleware(self):
+        """
+        Testet, ob die Middleware pro Request eine eigene IdentityMap anlegt.
+        """
+        maps = []
+        middleware = IdentityMapMiddleware(lambda request: maps.append(get_identity_map()))
+        middleware(None)
+        middleware(None)
+        self.assertIsNot(maps[0], maps[1])
+        self.assertIsNot(get_identity_map(), maps[1])
+
+    def test_rechnung_ohne_firma_abfrage(self):
+        """
+        Testet, ob eine Rechnung Firma und Arbeitnehmer nicht aus der
+        Datenbank holt, wenn sie im Cache liegen.
+        """
+        self.client.login(username="admin", password="admin")
+        data = {
+            "checks[]": [5, 3, 2],
+            "firma": 1,
+            "rechnungs_nummer": "IT-0815",
+            "rechnungs_titel": "Programmierung November",
+            "rechnungs_stundenlohn": 50,
+            "meine_daten": 1
+        }
+        self.client.get(reverse("rechnung"))
+        with CaptureQueriesContext(connection) as abfragen:
+            response = self.client.post(reverse("rechnung"), data)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        tabellen = " ".join(abfrage["sql"] for abfrage in abfragen.captured_queries)
+        self.assertNotIn('FROM "stunden_firma"', tabellen)
+        self.assertNotIn('FROM "stunden_arbeitnehmer"', tabellen)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestConditionalGet(TestCase):
+    """
+    Testet die ETags aus den Versionen der Models bei lesenden Views.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+        cache.clear()
+
+    def tearDown(self):
+        """
+        Das tearDown läuft nach den Tests, die Datenbank wird zurückgerollt.
+        """
+        cache.clear()
+
+    def test_304(self):
+        """
+        Testet, ob eine unveränderte Seite mit 304 ohne Abfragen für die
+        Daten beantwortet wird.
+        """
+        self.client.login(username="admin", password="admin")
+        for name in ["index", "stundenaufzeichnung", "firma", "arbeitnehmer", "rechnungsnummer",
+                     "api_aenderungen"]:
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("no-cache", response["Cache-Control"])
+            # Session und User.
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse(name), HTTP_IF_NONE_MATCH=response["ETag"])
+            self.assertEqual(response.status_code, 304, name)
+
+    def test_ohne_etag_mit_csrf_token(self):
+        """
+        Testet, dass Seiten mit CSRF Token keinen ETag haben, sonst käme
+        nach einem neuen Login ein 304 mit dem alten Token.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("einstellungen"))
+        self.assertContains(response, "csrfmiddlewaretoken")
+        self.assertFalse(response.has_header("ETag"))
+
+    def test_aenderung_und_parameter(self):
+        """
+        Testet, ob sich der ETag bei einer Änderung und mit anderen
+        Parametern ändert.
+        """
+        self.client.login(username="admin", password="admin")
+        etag = self.client.get(reverse("index"))["ETag"]
+        self.assertNotEqual(self.client.get(reverse("index"), {"page": 2})["ETag"], etag)
+
+        StundenAufzeichnung.objects.get(pk=2).delete()
+        response = self.client.get(reverse("index"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestFirmaStundensaetze(TestCase):
+    """
+    Testet den firma_stundensaetze View mit ETag und Last-Modified.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+        cache.clear()
+
+    def tearDown(self):
+        """
+        Das tearDown läuft nach den Tests, die Datenbank wird zurückgerollt.
+        """
+        cache.clear()
+
+    def test_stundensaetze(self):
+        """
+        Testet die Stundensätze aller Firmen und die bedingten Requests.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("firma_stundensaetze"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            json.loads(response.content.decode("utf-8")),
+            {str(firma.pk): firma.stundensatz for firma in Firma.objects.all()}
+        )
+        self.assertTrue(response.has_header("Last-Modified"))
+        etag = response["ETag"]
+
+        # Session und User, aber keine Abfrage für die Firmen.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("firma_stundensaetze"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        firma = Firma.objects.get(pk=1)
+        firma.stundensatz = 95
+        firma.save()
+        response = self.client.get(reverse("firma_stundensaetze"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(json.loads(response.content.decode("utf-8"))["1"], 95)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestStundenExport(TestCase):
+    """
+    Testet den CSV Export der Stundenaufzeichnungen.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+
+    def csv_zeilen(self, response):
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content).decode("utf-8")
+        self.assertTrue(content.startswith("\ufeff"))
+        return [zeile.split(";") for zeile in content[1:].splitlines()]
+
+    def test_get(self):
+        """
+        Testet, ob die Seite mit den Filtern angezeigt wird.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("stundenexport"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Stunden als CSV exportieren")
+
+    def test_alle(self):
+        """
+        Testet den Export ohne Filter mit Firma, Arbeitnehmer und Stunden.
+        """
+        self.client.login(username="admin", password="admin")
+        zeilen = self.csv_zeilen(self.client.get(reverse("stundenexport"), {"export": "csv"}))
+        self.assertEqual(zeilen[0][:6], ["Datum", "Firma", "Arbeitnehmer", "Startzeit", "Endzeit", "Stunden"])
+        self.assertEqual(len(zeilen), 6)
+        self.assertEqual(
+            zeilen[1][:6],
+            ["22.09.2012", "Monty Python", "Michael Palin", "10:00", "12:00", "2,00"]
+        )
+        self.assertEqual(zeilen[1][7], "ja")
+
+    def test_filter(self):
+        """
+        Testet die Filter für Datum, Firma und bezahlt.
+        """
+        self.client.login(username="admin", password="admin")
+        zeilen = self.csv_zeilen(self.client.get(reverse("stundenexport"), {
+            "export": "csv",
+            "von": "23.09.2012",
+            "bis": "30.09.2012",
+            "bezahlt": "nein",
+        }))
+        self.assertEqual(len(zeilen), 2)
+        self.assertEqual(zeilen[1][1], "Monty Python Music")
+        self.assertEqual(zeilen[1][5], "4,00")
+
+        zeilen = self.csv_zeilen(self.client.get(reverse("stundenexport"), {
+            "export": "csv",
+            "firma": 1,
+            "bezahlt": "ja",
+        }))
+        self.assertEqual(len(zeilen), 2)
+
+    def test_xlsx(self):
+        """
+        Testet den Excel Export mit typisierten Zellen für Datum, Zeit und Stunden.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("stundenexport"), {"export": "xlsx", "firma": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Disposition"].endswith(".xlsx"))
+        content = b"".join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(content)) as xlsx:
+            self.assertIn("[Content_Types].xml", xlsx.namelist())
+            sheet = ElementTree.fromstring(xlsx.read("xl/worksheets/sheet1.xml"))
+        ns = {"x": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
+        rows = sheet.findall("x:sheetData/x:row", ns)
+        self.assertEqual(len(rows), 3)
+        zellen = {c.get("r"): c for c in rows[1].findall("x:c", ns)}
+        # 23.09.2012 als Excel Datum, 09:00 als Anteil eines Tages, 3 Stunden.
+        self.assertEqual(zellen["A2"].find("x:v", ns).text, "41175")
+        self.assertEqual(float(zellen["D2"].find("x:v", ns).text), 0.375)
+        self.assertEqual(zellen["F2"].find("x:v", ns).text, "3.00")
+        self.assertEqual(zellen["B2"].find("x:is/x:t", ns).text, "Monty Python Music")
+        self.assertEqual(zellen["H2"].get("t"), "b")
+
+    def test_ungueltiger_filter(self):
+        """
+        Testet, ob bei "Von" nach "Bis" das Formular mit Fehler angezeigt wird.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("stundenexport"), {
+            "export": "csv",
+            "von": "30.09.2012",
+            "bis": "23.09.2012",
+        })
+        self.assertContains(response, "muss vor")
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestApiAenderungen(TestCase):
+    """
+    Testet den api_aenderungen View für den Delta Export.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+        # Die Fixtures sind älter als die Überlappung des Cursors.
+        alt = timezone.make_aware(datetime(2017, 1, 1))
+        for model in DELTA_MODELS:
+            model.objects.update(updated=alt)
+
+    def test_alle_daten_ohne_seit(self):
+        """
+        Testet, ob ohne "seit" alle Einträge geliefert werden.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("api_aenderungen"))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content.decode("utf-8"))
+        models = [objekt["model"] for objekt in data["objekte"]]
+        self.assertEqual(models.count("stunden.stundenaufzeichnung"), 5)
+        self.assertEqual(models.count("stunden.firma"), 2)
+
+    def test_nur_aenderungen_seit_cursor(self):
+        """
+        Testet, ob mit dem Cursor nur geänderte und gelöschte Einträge kommen.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("api_aenderungen"))
+        cursor = json.loads(response.content.decode("utf-8"))["cursor"]
+
+        firma = Firma.objects.get(pk=2)
+        firma.stundensatz = 90
+        firma.save()
+        StundenAufzeichnung.objects.get(pk=1).delete()
+
+        response = self.client.get(reverse("api_aenderungen"), {"seit": cursor})
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(
+            [(objekt["model"], objekt["pk"]) for objekt in data["objekte"]],
+            [("stunden.firma", 2)]
+        )
+        self.assertEqual(
+            [(loeschung["model"], loeschung["pk"]) for loeschung in data["geloescht"]],
+            [("stunden.stundenaufzeichnung", 1)]
+        )
+
+    @override_settings(STUNDEN_IMPORT_SYNCHRON=True)
+    def test_import_aendert_zeitstempel(self):
+        """
+        Testet, ob importierte Einträge im Delta erscheinen, auch wenn die
+        Datei ältere Zeitstempel enthält, beim Import und beim Upsert.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("api_aenderungen"))
+        cursor = json.loads(response.content.decode("utf-8"))["cursor"]
+
+        zeitstempel = {"created": "2019-01-01T00:00:00Z", "updated": "2019-01-01T00:00:00Z"}
+        firmen = [
+            {"pk": 1, "model": "stunden.firma", "fields": dict(zeitstempel, firma="Monty Python")},
+            {"pk": 3, "model": "stunden.firma", "fields": dict(zeitstempel, firma="Flying Circus")},
+        ]
+        arbeitnehmer = [
+            {"model": "stunden.arbeitnehmer", "fields": dict(zeitstempel, name="Michael Palin")},
+            {"model": "stunden.arbeitnehmer", "fields": dict(zeitstempel, name="Terry Jones")},
+        ]
+        for bereich, daten, upsert in [("firma", firmen, ""), ("arbeitnehmer", arbeitnehmer, "on")]:
+            json_file = SimpleUploadedFile(
+                "webpystunden3-export--{}--2017-01-01--00-00.json".format(bereich),
+                json.dumps(daten).encode("utf-8")
+            )
+            response = self.client.post(reverse("jsonimport"), {
+                "json_import_select": "json_import_select_{}".format(bereich),
+                "json_file": json_file,
+                "upsert": upsert,
+            })
+            self.assertEqual(response.status_code, 302)
+
+        response = self.client.get(reverse("api_aenderungen"), {"seit": cursor})
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(
+            sorted((objekt["model"], objekt["fields"].get("firma") or objekt["fields"].get("name"))
+                   for objekt in data["objekte"]),
+            [
+                ("stunden.arbeitnehmer", "Michael Palin"),
+                ("stunden.arbeitnehmer", "Terry Jones"),
+                ("stunden.firma", "Flying Circus"),
+                ("stunden.firma", "Monty Python"),
+            ]
+        )
+        self.assertEqual(Firma.objects.get(pk=3).created.year, 2019)
+
+    def test_bezahlt_markieren_aendert_zeitstempel(self):
+        """
+        Testet, ob das Markieren als bezahlt auf der Rechnungsseite den
+        Zeitstempel der Änderung setzt.
+        """
+        self.client.login(username="admin", password="admin")
+        vorher = timezone.now()
+        self.client.post(
+            reverse("rechnung"),
+            {"checks[]": ["5"], "bezahlt_markieren": "bezahlt_markieren"}
+        )
+        stundenaufzeichnung = StundenAufzeichnung.objects.get(pk=5)
+        self.assertTrue(stundenaufzeichnung.bezahlt)
+        self.assertGreaterEqual(stundenaufzeichnung.updated, vorher)
+
+    @override_settings(STUNDEN_DELTA_UEBERLAPPUNG=60)
+    def test_cursor_ueberlappung(self):
+        """
+        Testet, ob der Cursor um die Überlappung zurückliegt, damit ein
+        Eintrag, der vor dem Abruf gespeichert, aber erst danach committed
+        wurde, beim nächsten Abruf kommt.
+        """
+        self.client.login(username="admin", password="admin")
+        vorher = timezone.now()
+        response = self.client.get(reverse("api_aenderungen"))
+        cursor = parse_zeitpunkt(json.loads(response.content.decode("utf-8"))["cursor"])
+        self.assertLess(cursor, vorher - timedelta(seconds=59))
+
+        firma = Firma.objects.get(pk=2)
+        firma.stundensatz = 90
+        firma.save()
+        Firma.objects.filter(pk=2).update(updated=cursor + timedelta(seconds=1))
+        response = self.client.get(reverse("api_aenderungen"), {"seit": cursor})
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual([objekt["pk"] for objekt in data["objekte"]], [2])
+
+    def test_ungueltiger_zeitpunkt(self):
+        """
+        Testet einen ungültigen Zeitpunkt.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("api_aenderungen"), {"seit": "gestern"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestRechnungsnummer(TestCase):
+    """
+    Testet den Rechnungsnummer View.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+
+    def test_response_status_code(self):
+        """
+        Testet den Status Code.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("rechnungsnummer"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_xlsx(self):
+        """
+        Testet den Excel Export der Rechnungsnummern.
+        """
+        self.client.login(username="admin", password="admin")
+        Rechnungsnummer.objects.create(rechnungsnummer="2017-001")
+        response = self.client.get(reverse("rechnungsnummer"), {"export": "xlsx"})
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content)
+        with zipfile.ZipFile(io.BytesIO(content)) as xlsx:
+            sheet = xlsx.read("xl/worksheets/sheet1.xml").decode("utf-8")
+        self.assertIn("Rechnungsnummer", sheet)
+        self.assertIn("2017-001", sheet)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestNaechsteRechnungsnummer(TestCase):
+    """
+    Testet den gecachten Vorschlag für die nächste Rechnungsnummer.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        cache.clear()
+
+    def tearDown(self):
+        """
+        Das tearDown läuft nach den Tests, die Datenbank wird zurückgerollt.
+        """
+        cache.clear()
+
+    def test_naechste_rechnungsnummer(self):
+        """
+        Testet den Vorschlag aus der letzten Rechnungsnummer.
+        """
+        self.assertEqual(naechste_rechnungsnummer("IT-41"), "IT-42")
+        self.assertEqual(naechste_rechnungsnummer("2017-009"), "IT-10")
+        self.assertEqual(naechste_rechnungsnummer("ohne Zahl"), "")
+        self.assertEqual(naechste_rechnungsnummer(None), "")
+
+    def test_ohne_abfrage(self):
+        """
+        Testet, ob das Formular nach dem ersten Mal ohne Abfrage auskommt.
+        """
+        Rechnungsnummer.objects.create(rechnungsnummer="IT-41")
+        self.assertEqual(RechnungsForm().initial["rechnungs_nummer"], "IT-42")
+        with self.assertNumQueries(0):
+            self.assertEqual(RechnungsForm().initial["rechnungs_nummer"], "IT-42")
+            self.assertEqual(RechnungsSummeForm().initial["rechnungs_nummer"], "IT-42")
+
+    def test_neue_rechnungsnummer(self):
+        """
+        Testet, ob eine neue Rechnungsnummer den Vorschlag ändert.
+        """
+        Rechnungsnummer.objects.create(rechnungsnummer="IT-41")
+        self.assertEqual(RechnungsForm().initial["rechnungs_nummer"], "IT-42")
+        Rechnungsnummer.objects.create(rechnungsnummer="IT-42")
+        self.assertEqual(RechnungsForm().initial["rechnungs_nummer"], "IT-43")
+
+    def test_merken(self):
+        """
+        Testet, ob rechnungsnummer_merken den Vorschlag ohne Abfrage setzt.
+        """
+        rechnungsnummer_merken("IT-7")
+        with self.assertNumQueries(0):
+            self.assertEqual(get_naechste_rechnungsnummer(), "IT-8")
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestMonatsSumme(TestCase):
+    """
+    Testet das laufende Anpassen der MonatsSummen.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+
+    def summen(self):
+        return sorted(MonatsSumme.objects.values_list(
+            "firma_id", "arbeitnehmer_id", "monat", "stunden", "anzahl", "unbezahlt"
+        ))
+
+    def assertSummenStimmen(self):
+        """
+        Prüft, ob die laufend angepassten MonatsSummen dem Neuberechnen
+        entsprechen.
+        """
+        laufend = self.summen()
+        monatssummen_neu_berechnen()
+        self.assertEqual(laufend, self.summen())
+
+    def test_fixtures(self):
+        """
+        Testet, ob die MonatsSummen beim Laden der Fixtures angelegt wurden.
+        """
+        self.assertTrue(MonatsSumme.objects.exists())
+        self.assertEqual(
+            sum(MonatsSumme.objects.values_list("anzahl", flat=True)),
+            StundenAufzeichnung.objects.count()
+        )
+        self.assertSummenStimmen()
+
+    def test_neu_bearbeiten_loeschen(self):
+        """
+        Testet Anlegen, Verschieben in einen anderen Monat und Löschen.
+        """
+        eintrag = StundenAufzeichnung.objects.create(
+            datum=date(2030, 1, 15),
+            firma_id=1,
+            startzeit=time(8, 0),
+            endzeit=time(10, 30),
+            arbeitnehmer_id=1,
+            protokoll="Neu",
+            bezahlt=False,
+        )
+        summe = MonatsSumme.objects.get(monat=date(2030, 1, 1))
+        self.assertEqual((summe.stunden, summe.anzahl, summe.unbezahlt), (Decimal("2.50"), 1, Decimal("2.50")))
+        self.assertSummenStimmen()
+
+        eintrag = StundenAufzeichnung.objects.get(pk=eintrag.pk)
+        eintrag.datum = date(2030, 2, 1)
+        eintrag.bezahlt = True
+        eintrag.save()
+        self.assertFalse(MonatsSumme.objects.filter(monat=date(2030, 1, 1)).exists())
+        self.assertEqual(MonatsSumme.objects.get(monat=date(2030, 2, 1)).unbezahlt, 0)
+        self.assertSummenStimmen()
+
+        eintrag.delete()
+        self.assertFalse(MonatsSumme.objects.filter(monat=date(2030, 2, 1)).exists())
+        self.assertSummenStimmen()
+
+    def test_bezahlt_setzen(self):
+        """
+        Testet das Markieren als bezahlt und unbezahlt.
+        """
+        bezahlt_setzen(StundenAufzeichnung.objects.all(), True)
+        self.assertEqual(sum(MonatsSumme.objects.values_list("unbezahlt", flat=True)), 0)
+        self.assertSummenStimmen()
+        bezahlt_setzen(StundenAufzeichnung.objects.filter(pk__in=[1, 2]), False)
+        self.assertSummenStimmen()
+
+    def test_admin_aktion(self):
+        """
+        Testet die mark_unbezahlt Aktion im Admin.
+        """
+        self.client.login(username="admin", password="admin")
+        self.client.post(reverse("admin:stunden_stundenaufzeichnung_changelist"), {
+            "action": "mark_unbezahlt",
+            "_selected_action": [1, 2, 3, 4, 5],
+        })
+        self.assertFalse(StundenAufzeichnung.objects.filter(bezahlt=True).exists())
+        self.assertEqual(
+            sum(MonatsSumme.objects.values_list("unbezahlt", flat=True)),
+            sum(MonatsSumme.objects.values_list("stunden", flat=True)),
+        )
+        self.assertSummenStimmen()
+
+    def test_firma_loeschen(self):
+        """
+        Testet, ob das Löschen einer Firma ihre MonatsSummen entfernt.
+        """
+        Firma.objects.get(pk=1).delete()
+        self.assertFalse(MonatsSumme.objects.filter(firma_id=1).exists())
+        self.assertSummenStimmen()
+
+    def test_import(self):
+        """
+        Testet, ob ein Import die MonatsSummen neu berechnet.
+        """
+        rows = json.loads(serializers.serialize("json", StundenAufzeichnung.objects.filter(pk=1)))
+        rows[0]["pk"] = 100
+        rows[0]["fields"]["datum"] = "2031-05-05"
+        upsert_rows(rows)
+        self.assertTrue(MonatsSumme.objects.filter(monat=date(2031, 5, 1)).exists())
+        self.assertSummenStimmen()
+
+    def test_command(self):
+        """
+        Testet das Neuberechnen mit dem monatssummen Command.
+        """
+        MonatsSumme.objects.all().delete()
+        ausgabe = io.StringIO()
+        call_command("monatssummen", stdout=ausgabe)
+        self.assertIn("Monatssummen", ausgabe.getvalue())
+        self.assertEqual(
+            sum(MonatsSumme.objects.values_list("anzahl", flat=True)),
+            StundenAufzeichnung.objects.count()
+        )
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestDashboard(TestCase):
+    """
+    Testet den dashboard View mit den Summen aus den MonatsSummen.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+        Firma.objects.filter(pk=1).update(stundensatz=50)
+        cache.clear()
+
+    def tearDown(self):
+        """
+        Das tearDown läuft nach den Tests, die Datenbank wird zurückgerollt.
+        """
+        cache.clear()
+
+    def test_response_status_code(self):
+        """
+        Testet den Status Code ohne Auswahl (aktuelles Jahr).
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("dashboard"), {"firma": 2})
+        self.assertRedirects(
+            response,
+            "{}?firma=2&jahr={}".format(reverse("dashboard"), date.today().year)
+        )
+        response = self.client.get(reverse("dashboard"), {"jahr": date.today().year})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["auswertung"]["gesamt"]["anzahl_summe"], 0)
+
+    def test_summen(self):
+        """
+        Testet die Summen laut Fixtures, alle Einträge sind im September 2012.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("dashboard"), {"jahr": 2012, "quartal": 3})
+        auswertung = response.context["auswertung"]
+        gesamt = auswertung["gesamt"]
+        self.assertEqual(gesamt["anzahl_summe"], 5)
+        self.assertEqual(gesamt["stunden_summe"], Decimal("15.00"))
+        self.assertEqual(gesamt["unbezahlt_summe"], Decimal("10.00"))
+        self.assertEqual(gesamt["bezahlt_summe"], Decimal("5.00"))
+        self.assertEqual(gesamt["umsatz"], Decimal("400.00"))
+        self.assertEqual(gesamt["umsatz_unbezahlt"], Decimal("300.00"))
+        self.assertEqual([summe["monat"] for summe in auswertung["monat"]], [date(2012, 9, 1)])
+        firmen = {summe["firma__firma"]: summe["stunden_summe"] for summe in auswertung["firma"]}
+        self.assertEqual(firmen, {"Monty Python": Decimal("8.00"), "Monty Python Music": Decimal("7.00")})
+        self.assertEqual(auswertung["arbeitnehmer"][0]["arbeitnehmer__name"], "Michael Palin")
+        self.assertContains(response, "Monty Python Music")
+
+    def test_filter(self):
+        """
+        Testet die Auswahl von Quartal und Firma.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("dashboard"), {"jahr": 2012, "quartal": 4})
+        self.assertEqual(response.context["auswertung"]["gesamt"]["anzahl_summe"], 0)
+        response = self.client.get(reverse("dashboard"), {"jahr": 2012, "firma": 2})
+        gesamt = response.context["auswertung"]["gesamt"]
+        self.assertEqual((gesamt["anzahl_summe"], gesamt["umsatz"]), (2, Decimal(0)))
+
+    def test_abfragen(self):
+        """
+        Testet, ob die Auswertung unabhängig von der Anzahl der Einträge mit
+        vier Abfragen auskommt.
+        """
+        formular = DashboardForm({"jahr": 2012})
+        self.assertTrue(formular.is_valid())
+        with self.assertNumQueries(4):
+            auswerten(formular.filter(MonatsSumme.objects.all()))
+
+    def test_ungueltig(self):
+        """
+        Testet ein ungültiges Jahr.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("dashboard"), {"jahr": "x"})
+        self.assertIsNone(response.context["auswertung"])
+        self.assertTrue(response.context["form"].errors)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestUnbezahltProFirma(TestCase):
+    """
+    Testet die offenen Beträge pro Firma auf der Rechnung Seite.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+        Firma.objects.filter(pk=1).update(stundensatz=50)
+        cache.clear()
+
+    def tearDown(self):
+        """
+        Das tearDown läuft nach den Tests, die Datenbank wird zurückgerollt.
+        """
+        cache.clear()
+
+    def test_summen(self):
+        """
+        Testet die Summen laut Fixtures mit einer einzigen Abfrage.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            posten = unbezahlt_pro_firma()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(
+            [(p["firma__firma"], p["anzahl"], p["stunden"], p["aelteste"], p["betrag"]) for p in posten],
+            [
+                ("Monty Python", 2, Decimal("6.00"), date(2012, 9, 22), Decimal("300.00")),
+                ("Monty Python Music", 1, Decimal("4.00"), date(2012, 9, 23), None),
+            ]
+        )
+
+    def test_stunden_wie_calculate_stunden(self):
+        """
+        Testet, dass die Stunden aus SQL zu calculate_stunden passen.
+        """
+        StundenAufzeichnung.objects.filter(bezahlt=False, firma_id=2).update(
+            startzeit=time(8, 0, 10), endzeit=time(9, 20, 0)
+        )
+        eintrag = StundenAufzeichnung.objects.get(bezahlt=False, firma_id=2)
+        posten = unbezahlt_pro_firma()
+        self.assertEqual(posten[1]["stunden"], Decimal(eintrag.stunden()))
+
+    def test_rechnung_seite(self):
+        """
+        Testet die Tabelle und den Filter auf eine Firma.
+        """
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("rechnung"))
+        self.assertEqual(len(response.context["offene_posten"]), 2)
+        self.assertEqual(len(response.context["stunden_not_payed"]), 3)
+        self.assertContains(response, "?firma=2#maintable")
+        response = self.client.get(reverse("rechnung"), {"firma": 2})
+        self.assertEqual(response.context["firma_filter"].pk, 2)
+        self.assertEqual(
+            {row.firma_id for row in response.context["stunden_not_payed"]}, {2}
+        )
+        self.assertEqual(response.context["form"]["firma"].value(), 2)
+        self.assertContains(response, 'action="{}?firma=2"'.format(reverse("rechnung")))
+
+    def test_nicht_bei_bezahlt_markieren(self):
+        """
+        Testet, dass die offenen Beträge nur für die Seite abgefragt werden
+        und nicht, wenn Einträge bezahlt markiert werden.
+        """
+        self.client.login(username="admin", password="admin")
+        with mock.patch("stunden.views.unbezahlt_pro_firma", return_value=[]) as offen:
+            response = self.client.post(reverse("rechnung"), {
+                "bezahlt_markieren": "on",
+                "checks[]": [1],
+            })
+            self.assertEqual(response.status_code, 302)
+            self.assertFalse(offen.called)
+            self.client.get(reverse("rechnung"))
+            self.assertEqual(offen.call_count, 1)
+
+    def test_ungueltige_firma(self):
+        """
+        Testet, dass eine ungültige Firma ignoriert wird.
+        """
+        self.client.login(username="admin", password="admin")
+        for firma in ("abc", "999"):
+            response = self.client.get(reverse("rechnung"), {"firma": firma})
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(response.context["firma_filter"])
+            self.assertEqual(len(response.context["stunden_not_payed"]), 3)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestListenFilter(TestCase):
+    """
+    Testet die Filter und die Pagination der Index Seite und der
+    Stundenaufzeichnung Liste.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+        cache.clear()
+        self.client.login(username="admin", password="admin")
+
+    def tearDown(self):
+        """
+        Das tearDown läuft nach den Tests, die Datenbank wird zurückgerollt.
+        """
+        cache.clear()
+
+    def ids(self, response):
+        """
+        Die ids der Einträge auf der angezeigten Seite.
+        """
+        return [row.id for row in response.context["stundenaufzeichnung"]]
+
+    def test_filter(self):
+        """
+        Testet die Filter auf beiden Seiten.
+        """
+        for name in ("index", "stundenaufzeichnung"):
+            response = self.client.get(reverse(name))
+            self.assertEqual(len(self.ids(response)), 5)
+            response = self.client.get(reverse(name), {"firma": 2})
+            self.assertEqual(
+                set(self.ids(response)),
+                set(StundenAufzeichnung.objects.filter(firma=2).values_list("id", flat=True))
+            )
+            response = self.client.get(reverse(name), {"bezahlt": "nein", "arbeitnehmer": 1})
+            self.assertEqual(
+                set(self.ids(response)),
+                set(StundenAufzeichnung.objects.filter(
+                    bezahlt=False, arbeitnehmer=1
+                ).values_list("id", flat=True))
+            )
+            response = self.client.get(reverse(name), {"von": "01.10.2012"})
+            self.assertEqual(self.ids(response), [])
+            self.assertContains(response, "Für diese Filter sind keine")
+
+    def test_ungueltiger_filter(self):
+        """
+        Testet, dass bei einem ungültigen Filter alle Einträge kommen.
+        """
+        response = self.client.get(reverse("index"), {"von": "30.09.2012", "bis": "01.09.2012"})
+        self.assertEqual(len(self.ids(response)), 5)
+        self.assertTrue(response.context["filter_form"].errors)
+
+    def test_pagination_mit_filter(self):
+        """
+        Testet, dass die Links der Pagination die Filter behalten.
+        """
+        eintrag = StundenAufzeichnung.objects.get(pk=1)
+        for i in range(12):
+            eintrag.pk = None
+            eintrag.save()
+        firma_id = eintrag.firma_id
+        response = self.client.get(reverse("index"), {"firma": firma_id, "bezahlt": "", "page": 1})
+        self.assertEqual(response.context["filter_query"], "firma={}".format(firma_id))
+        self.assertContains(response, "?firma={}&page=2#maintable".format(firma_id))
+        response = self.client.get(reverse("stundenaufzeichnung"), {"firma": firma_id, "page": 2})
+        self.assertEqual(response.context["stundenaufzeichnung"].number, 2)
+        self.assertContains(response, "?firma={}&page=1#maintable".format(firma_id))
+        self.assertTrue(all(row.firma_id == firma_id for row in response.context["stundenaufzeichnung"]))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestProtokollSuche(TestCase):
+    """
+    Testet die Suche in den Protokollen mit dem Suchindex.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def setUp(self):
+        """
+        Das setUp läuft vor den Tests.
+        """
+        admin = User.objects.create_user("admin", "admin@admin.com", "admin")
+        admin.is_staff = True
+        admin.is_superuser = True
+        admin.save()
+        cache.clear()
+
+    def tearDown(self):
+        """
+        Das tearDown läuft nach den Tests, die Datenbank wird zurückgerollt.
+        """
+        cache.clear()
+
+    def ids(self, text):
+        """
+        Die ids der Treffer einer Suche.
+        """
+        return [treffer.id for treffer in suchen(text)]
+
+    def test_suche_art(self):
+        """
+        Testet, dass unter SQLite und PostgreSQL der Index verwendet wird.
+        """
+        if connection.vendor == "sqlite":
+            self.assertEqual(suche_art(), "fts5")
+        elif connection.vendor == "postgresql":
+            self.assertEqual(suche_art(), "postgresql")
+
+    def test_suchen(self):
+        """
+        Testet Wörter, Wortanfänge und ungültige Syntax.
+        """
+        self.assertEqual(self.ids("Protokoll 3"), [3])
+        self.assertEqual(sorted(self.ids("proto")), [1, 2, 3, 4, 5])
+        self.assertEqual(self.ids("Backup"), [])
+        self.assertEqual(self.ids('"AND( -'), [])
+        self.assertEqual(self.ids(""), [])
+
+    def test_index_aktuell(self):
+        """
+        Testet, dass Anlegen, Ändern und Löschen den Index anpassen.
+        """
+        eintrag = StundenAufzeichnung.objects.get(pk=1)
+        eintrag.protokoll = "Backup Server neu gestartet"
+        eintrag.save()
+        self.assertEqual(self.ids("backup server"), [1])
+        self.assertEqual(self.ids("Protokoll 1"), [])
+        StundenAufzeichnung.objects.filter(pk=2).update(protokoll="Backup eingerichtet")
+        self.assertEqual(sorted(self.ids("backup")), [1, 2])
+        eintrag.pk = None
+        eintrag.save()
+        self.assertEqual(sorted(self.ids("server")), [1, eintrag.pk])
+        StundenAufzeichnung.objects.filter(pk=1).delete()
+        self.assertEqual(self.ids("server"), [eintrag.pk])
+
+    def test_rang(self):
+        """
+        Testet, dass kurze Protokolle mit mehr Treffern zuerst kommen.
+        """
+        StundenAufzeichnung.objects.filter(pk=4).update(
+            protokoll="Am Backup gearbeitet, danach Drucker, Mails, Telefon und Netzwerk geprüft"
+        )
+        StundenAufzeichnung.objects.filter(pk=5).update(protokoll="Backup, Backup Server")
+        self.assertEqual(self.ids("backup"), [5, 4])
+
+    def test_ausschnitt(self):
+        """
+        Testet, dass Treffer markiert und der Rest escaped wird.
+        """
+        StundenAufzeichnung.objects.filter(pk=1).update(protokoll="<b>Backup</b> Server")
+        treffer = suchen("backup")[0]
+        self.assertEqual(
+            ausschnitt_html(treffer.ausschnitt),
+            "&lt;b&gt;<mark>Backup</mark>&lt;/b&gt; Server"
+        )
+        self.assertEqual(
+            markieren("Backup am Server", ["serv"]),
+            "Backup am {}Serv{}er".format(START, ENDE)
+        )
+
+    def test_view(self):
+        """
+        Testet den suche View.
+        """
+        response = self.client.get(reverse("suche"), {"q": "Protokoll"})
+        self.assertEqual(response.status_code, 302)
+        self.client.login(username="admin", password="admin")
+        response = self.client.get(reverse("suche"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context["treffer"])
+        response = self.client.get(reverse("suche"), {"q": "Protokoll 2"})
+        self.assertEqual([row.id for row, ausschnitt in response.context["treffer"]], [2])
+        self.assertContains(response, "<mark>Protokoll</mark> <mark>2</mark>")
+        response = self.client.get(reverse("suche"), {"q": "Backup"})
+        self.assertContains(response, "Keine Protokolle gefunden")
+
+    def test_command(self):
+        """
+        Testet das Command protokoll_suche.
+        """
+        ausgabe = io.StringIO()
+        call_command("protokoll_suche", stdout=ausgabe)
+        self.assertIn("neu aufgebaut", ausgabe.getvalue())
+        self.assertEqual(self.ids("Protokoll 3"), [3])
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestProtokollSucheAnlegen(TransactionTestCase):
+    """
+    Testet protokoll_suche --anlegen. Ein TransactionTestCase, weil FTS5
+    Tabellen, die in einem zurückgerollten Savepoint neu angelegt wurden,
+    die Verbindung unbrauchbar machen.
+    """
+
+    fixtures = ["webpystunden3_testdata.json"]
+
+    def test_anlegen(self):
+        """
+        Testet, dass der Index danach vollständig ist und aktuell bleibt.
+        """
+        ausgabe = io.StringIO()
+        call_command("protokoll_suche", anlegen=True, stdout=ausgabe)
+        self.assertIn("neu aufgebaut", ausgabe.getvalue())
+        self.assertEqual([treffer.id for treffer in suchen("Protokoll 3")], [3])
+        StundenAufzeichnung.objects.filter(pk=3).update(protokoll="Backup")
+        self.assertEqual([treffer.id for treffer in suchen("Backup")], [3])
@@ -23,13 +23,26 @@ urlpatterns = [
     # JSON Export
     re_path(r'^jsonexport/$', stunden_views.jsonexport, name="jsonexport"),
 
-    # JSON Import und Success Seite
+    # Export der Stundenaufzeichnungen für die Buchhaltung
+    re_path(r'^stundenexport/$', stunden_views.stundenexport, name="stundenexport"),
+    re_path(r'^dashboard/$', stunden_views.dashboard, name="dashboard"),
+
+    # Suche in den Protokollen
+    re_path(r'^suche/$', stunden_views.suche, name="suche"),
+
+    # JSON Import, Success Seite und Import Jobs
     re_path(r'^jsonimport/$', stunden_views.jsonimport, name="jsonimport"),
     re_path(
         r'^jsonimport/success/(?P<count_import>\d+)/$',
         stunden_views.jsonimport_success,
         name="jsonimport_success"
     ),
+    re_path(r'^jsonimport/job/(?P<job_id>[0-9a-f]+)/$', stunden_views.jsonimport_job, name="jsonimport_job"),
+    re_path(
+        r'^jsonimport/job/(?P<job_id>[0-9a-f]+)/status/$',
+        stunden_views.jsonimport_job_status,
+        name="jsonimport_job_status"
+    ),
 
     # Stundenaufzeichnung, neu und bearbeiten
     re_path(r'^stundenaufzeichnung/$', stunden_views.stundenaufzeichnung, name="stundenaufzeichnung"),
@@ -68,6 +81,12 @@ urlpatterns = [
         name="get_firma_stundensatz"
     ),
 
+    # Die Stundensätze aller Firmen auf einmal für die Rechnung
+    re_path(r'^firma_stundensaetze/$', stunden_views.firma_stundensaetze, name="firma_stundensaetze"),
+
+    # Delta Export der Änderungen und Löschungen
+    re_path(r'^api/aenderungen/$', stunden_views.api_aenderungen, name="api_aenderungen"),
+
     # Einstellungen
     re_path(r'^rechnungsnummer/$', stunden_views.rechnungsnummer, name="rechnungsnummer"),
 
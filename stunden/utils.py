@@ -1,5 +1,7 @@
-from datetime import timedelta
+from datetime import datetime, time, timedelta
 from decimal import Decimal
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
 
 def calculate_stunden(startzeit, endzeit):
@@ -24,6 +26,42 @@ def calculate_stunden(startzeit, endzeit):
     return "{:.2f}".format(stunden)
 
 
+def parse_zeitpunkt(value):
+    """
+    Wandelt einen Zeitpunkt aus einem Request in ein datetime mit Zeitzone um.
+    Erlaubt sind ISO Zeitpunkte wie "2017-03-01T08:00:00+01:00", Daten wie
+    "2017-03-01" oder "01.03.2017". Ein leerer Wert returniert None.
+    Bei einem ungültigen Wert wird ein ValueError ausgelöst.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    zeitpunkt = parse_datetime(value)
+    if zeitpunkt is None:
+        try:
+            datum = parse_date(value) or datetime.strptime(value, "%d.%m.%Y").date()
+        except ValueError:
+            raise ValueError("Ungültiger Zeitpunkt: {}".format(value))
+        zeitpunkt = datetime.combine(datum, time())
+    if timezone.is_naive(zeitpunkt):
+        zeitpunkt = timezone.make_aware(zeitpunkt)
+    return zeitpunkt
+
+
+def naechste_rechnungsnummer(letzte):
+    """
+    Schlägt die Rechnungsnummer nach der letzten vor, aus "IT-41" wird "IT-42".
+    Ohne letzte Rechnungsnummer oder ohne Zahl am Ende returniert ein leerer
+    String.
+    """
+    if not letzte:
+        return ""
+    try:
+        return "IT-{}".format(int(letzte.split("-")[-1]) + 1)
+    except ValueError:
+        return ""
+
+
 def moneyformat(value, places=2, curr="", sep=".", dp=",", pos="", neg="-", trailneg=""):
     """Convert Decimal to a money formatted string.
 
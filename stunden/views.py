@@ -1,54 +1,117 @@
 import json
 from .models import StundenAufzeichnung, Firma, Arbeitnehmer, Einstellungen, Rechnungsnummer
-from .utils import calculate_stunden, moneyformat
+from .models import Loeschung, MonatsSumme
+from .rollup import auswerten, unbezahlt_pro_firma
+from .suche import suchen, ausschnitt_html, MAX_TREFFER
+from .signals import DELTA_MODELS, bezahlt_setzen
+from .cache import get_einstellungen, get_stundensaetze, versioned_cache, versioned_etag
+from .identity_map import get_identity_map
+from .utils import calculate_stunden, moneyformat, parse_zeitpunkt
 from .pdf import make_pdf
+from .backup import stream_backup
+from .export import stream_csv, stream_stunden_xlsx, stream_rechnungsnummern_xlsx
+from .export import export_uebersicht, export_merken
+from .jobs import start_import_job, get_job
 from .forms import StundenAufzeichnungForm, RechnungsForm, UploadFileForm
-from .forms import FirmaForm, ArbeitnehmerForm, RechnungsSummeForm
+from .forms import FirmaForm, ArbeitnehmerForm, RechnungsSummeForm, StundenFilterForm
+from .forms import DashboardForm, SucheForm
 from django.shortcuts import render, get_object_or_404
 from django.template import RequestContext
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login, logout
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, StreamingHttpResponse
+from django.http import HttpResponseBadRequest, Http404
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.forms import ValidationError
 from django.forms.utils import ErrorList
 from django.urls import reverse
 from decimal import Decimal
 from urllib.parse import quote
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+from django.conf import settings
 from django.core import serializers
 from django.core.exceptions import ObjectDoesNotExist
+from django.core.serializers import python as python_serializer
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Standardwert, falls in den Django Settings nichts eingestellt ist.
+# Um so viele Sekunden liegt der Cursor des Delta Exports zurück.
+DELTA_UEBERLAPPUNG = 10 * 60
+
+
+def gefilterte_stunden(request):
+    """
+    Das StundenFilterForm aus dem Query String und die danach gefilterten
+    Stundenaufzeichnungen, sortiert nach Datum und Startzeit.
+    Ist das Formular ungültig, wird nicht gefiltert.
+    """
+    form = StundenFilterForm(request.GET)
+    stunden_list = StundenAufzeichnung.objects.all().order_by("-datum", "-startzeit")
+    if form.is_valid():
+        stunden_list = form.filter(stunden_list)
+    return form, stunden_list
+
+
+def seite_holen(request, object_list, pro_seite=10):
+    """
+    Die Seite laut "page" im Query String. Bei einer ungültigen Seite kommt
+    die erste, bei einer zu großen die letzte.
+    """
+    paginator = Paginator(object_list, pro_seite)
+    page = request.GET.get("page")
+    try:
+        return paginator.page(page)
+    except PageNotAnInteger:
+        return paginator.page(1)
+    except EmptyPage:
+        return paginator.page(paginator.num_pages)
+
+
+def filter_query(request):
+    """
+    Der Query String ohne "page" und ohne leere Felder, für die Links der
+    Pagination.
+    """
+    query = request.GET.copy()
+    query.pop("page", None)
+    for key in [key for key, values in query.lists() if not any(values)]:
+        del query[key]
+    return query.urlencode()
 
 
 @login_required
+@versioned_etag(StundenAufzeichnung, Firma, Arbeitnehmer)
+@versioned_cache(StundenAufzeichnung, Firma, Arbeitnehmer)
 def index(request):
     """
     Der View für die Index Seite.
-    Angezeigt wird unteranderem eine Tabelle mit Pagination.
+    Angezeigt wird unteranderem eine Tabelle mit Pagination, die per GET
+    nach Datum, Firma, Arbeitnehmer und Bezahlt gefiltert werden kann.
     Login ist notwendig.
     """
-    stunden_list = StundenAufzeichnung.objects.all().select_related().order_by(
-        "-datum",
-        "-startzeit"
-    )
-    for row in stunden_list:
+    filter_form, stunden_list = gefilterte_stunden(request)
+    stundenaufzeichnung = seite_holen(request, stunden_list)
+    stundenaufzeichnung.object_list = get_identity_map().verbinden(stundenaufzeichnung.object_list)
+    for row in stundenaufzeichnung:
         row.stunden = calculate_stunden(
             row.startzeit,
             row.endzeit
         )
-    paginator = Paginator(stunden_list, 10)
-    page = request.GET.get("page")
-    try:
-        stundenaufzeichnung = paginator.page(page)
-    except PageNotAnInteger:
-        stundenaufzeichnung = paginator.page(1)
-    except EmptyPage:
-        stundenaufzeichnung = paginator.page(paginator.num_pages)
 
     return render(
         request,
         "stunden/index.html",
-        {"stundenaufzeichnung": stundenaufzeichnung},
+        {
+            "stundenaufzeichnung": stundenaufzeichnung,
+            "filter_form": filter_form,
+            "filter_query": filter_query(request),
+        },
         RequestContext(request)
     )
 
@@ -99,28 +162,26 @@ def log_out(request):
 
 
 @login_required
+@versioned_etag(StundenAufzeichnung, Firma, Arbeitnehmer)
+@versioned_cache(StundenAufzeichnung, Firma, Arbeitnehmer)
 def stundenaufzeichnung(request):
     """
     Der View, um eine Stundenaufzeichnung auszuwählen zum Bearbeiten oder zum Löschen.
+    Die Liste kann wie auf der Index Seite per GET gefiltert werden.
     Login ist notwendig.
     """
-    stunden_list = StundenAufzeichnung.objects.all().select_related().order_by(
-        "-datum",
-        "-startzeit"
-    )
-    paginator = Paginator(stunden_list, 10)
-    page = request.GET.get("page")
-    try:
-        stundenaufzeichnung = paginator.page(page)
-    except PageNotAnInteger:
-        stundenaufzeichnung = paginator.page(1)
-    except EmptyPage:
-        stundenaufzeichnung = paginator.page(paginator.num_pages)
+    filter_form, stunden_list = gefilterte_stunden(request)
+    stundenaufzeichnung = seite_holen(request, stunden_list)
+    stundenaufzeichnung.object_list = get_identity_map().verbinden(stundenaufzeichnung.object_list)
 
     return render(
         request,
         "stunden/stundenaufzeichnung.html",
-        {"stundenaufzeichnung": stundenaufzeichnung},
+        {
+            "stundenaufzeichnung": stundenaufzeichnung,
+            "filter_form": filter_form,
+            "filter_query": filter_query(request),
+        },
         RequestContext(request)
     )
 
@@ -196,6 +257,8 @@ def stundenaufzeichnung_bearbeiten(request, stundenaufzeichnung_id):
 
 
 @login_required
+@versioned_etag(Firma)
+@versioned_cache(Firma)
 def firma(request):
     """
     Der View, um eine Firma auszuwählen zum Bearbeiten oder zum Löschen.
@@ -286,6 +349,8 @@ def firma_bearbeiten(request, firma_id):
 
 
 @login_required
+@versioned_etag(Arbeitnehmer)
+@versioned_cache(Arbeitnehmer)
 def arbeitnehmer(request):
     """
     Der View, um eine Arbeitnehmer auszuwählen zum Bearbeiten oder zum Löschen.
@@ -381,15 +446,29 @@ def rechnung(request):
     """
     Der View für die Rechnung.
     Bei einem GET Request wird ein Formular angezeigt und eine Tabelle mit
-    Einträgen, die unbezahlt markiert sind.
+    Einträgen, die unbezahlt markiert sind, darüber die offenen Beträge pro
+    Firma. Mit ?firma=<id> werden nur die Einträge dieser Firma angezeigt.
+    Die offenen Beträge werden nur abgefragt, wenn die Seite angezeigt wird.
     Bei einem POST Request wird das Formular überprüft und wenn alles richtig
     scheint wird eine PDF Rechnung mit Hilfe von pdf.make_pdf() erstellt.
     Login ist notwendig.
     """
-    # Holt alle unbezahlten Einträge aus der db.
-    stunden_not_payed = StundenAufzeichnung.objects.select_related().filter(
+    # Holt alle unbezahlten Einträge aus der db, Firma und Arbeitnehmer
+    # kommen aus der IdentityMap.
+    identity_map = get_identity_map()
+    stunden_not_payed = StundenAufzeichnung.objects.filter(
         bezahlt=False).order_by("-datum", "-startzeit")
 
+    # Nur die Einträge einer Firma, eine ungültige Firma wird ignoriert.
+    firma_filter = None
+    try:
+        firma_filter = identity_map.get(Firma, int(request.GET["firma"]))
+    except (KeyError, ValueError, Firma.DoesNotExist):
+        pass
+    else:
+        stunden_not_payed = stunden_not_payed.filter(firma=firma_filter)
+    stunden_not_payed = identity_map.verbinden(stunden_not_payed)
+
     # Rechnet die Stunden aus.
     for row in stunden_not_payed:
         row.stunden = calculate_stunden(row.startzeit, row.endzeit)
@@ -406,7 +485,7 @@ def rechnung(request):
         # Einträge als bezahlt markieren, update in der db.
         if "bezahlt_markieren" in request.POST and stunden_ids:
             queryset = StundenAufzeichnung.objects.filter(pk__in=stunden_ids)
-            queryset.update(bezahlt=True)
+            bezahlt_setzen(queryset, True)
             return HttpResponseRedirect(reverse("index"))
 
         # Formular nicht valid, keine Einträge gewählt, nicht bezahlt_markieren
@@ -416,6 +495,8 @@ def rechnung(request):
                 "stunden/rechnung.html",
                 {
                     "stunden_not_payed": stunden_not_payed,
+                    "offene_posten": unbezahlt_pro_firma(),
+                    "firma_filter": firma_filter,
                     "form": form,
                     "custom_error": custom_error
                 },
@@ -430,6 +511,8 @@ def rechnung(request):
                 "stunden/rechnung.html",
                 {
                     "stunden_not_payed": stunden_not_payed,
+                    "offene_posten": unbezahlt_pro_firma(),
+                    "firma_filter": firma_filter,
                     "form": form,
                     "custom_error": custom_error
                 },
@@ -445,6 +528,8 @@ def rechnung(request):
                     "stunden/rechnung.html",
                     {
                         "stunden_not_payed": stunden_not_payed,
+                        "offene_posten": unbezahlt_pro_firma(),
+                        "firma_filter": firma_filter,
                         "form": form,
                         "custom_error": custom_error
                     },
@@ -482,9 +567,11 @@ def rechnung(request):
             # Die Stundenreihen werden erstellt.
             stunden_rows = []
             stunden_gesamt_stunden = 0
+            eintraege = StundenAufzeichnung.objects.in_bulk(stunden_ids)
+            identity_map.verbinden(eintraege.values())
             for id in stunden_ids:
-                entry = StundenAufzeichnung.objects.get(pk=id)
-                if entry.firma.firma == receiver_address_company:
+                entry = eintraege.get(id)
+                if entry is not None and entry.firma.firma == receiver_address_company:
                     stunden = Decimal(calculate_stunden(entry.startzeit, entry.endzeit))
                     stunden_gesamt_stunden += stunden
                     row = [
@@ -505,6 +592,8 @@ def rechnung(request):
                     "stunden/rechnung.html",
                     {
                         "stunden_not_payed": stunden_not_payed,
+                        "offene_posten": unbezahlt_pro_firma(),
+                        "firma_filter": firma_filter,
                          "form": form,
                          "stunden_ids": stunden_ids,
                          "custom_error": custom_error
@@ -520,6 +609,8 @@ def rechnung(request):
                     "stunden/rechnung.html",
                     {
                         "stunden_not_payed": stunden_not_payed,
+                        "offene_posten": unbezahlt_pro_firma(),
+                        "firma_filter": firma_filter,
                          "form": form,
                          "stunden_ids": stunden_ids,
                          "custom_error": custom_error
@@ -538,6 +629,8 @@ def rechnung(request):
                     "stunden/rechnung.html",
                     {
                         "stunden_not_payed": stunden_not_payed,
+                        "offene_posten": unbezahlt_pro_firma(),
+                        "firma_filter": firma_filter,
                          "form": form,
                          "stunden_ids": stunden_ids,
                          "custom_error": custom_error
@@ -546,11 +639,7 @@ def rechnung(request):
                 )
 
             # Die Rechnungssummen werden ausgerechnet.
-            try:
-                einstellungen = Einstellungen.objects.get(pk=1)
-                einstellungen_ust = einstellungen.ust
-            except ObjectDoesNotExist:
-                einstellungen_ust = 20
+            einstellungen_ust = get_einstellungen().ust
 
             rechnungs_summe_pos1 = stunden_gesamt_stunden * rechnungs_stundenlohn
             if not position_2_summe and not position_3_summe:
@@ -638,13 +727,21 @@ def rechnung(request):
 
     # Falls kein POST Request.
     else:
-        form = RechnungsForm()
+        if firma_filter is not None:
+            form = RechnungsForm(initial={
+                "firma": firma_filter.pk,
+                "rechnungs_stundenlohn": firma_filter.stundensatz,
+            })
+        else:
+            form = RechnungsForm()
 
     return render(
         request,
         "stunden/rechnung.html",
         {
             "stunden_not_payed": stunden_not_payed,
+            "offene_posten": unbezahlt_pro_firma(),
+            "firma_filter": firma_filter,
             "form": form,
             "stunden_ids": stunden_ids,
         },
@@ -734,11 +831,7 @@ def rechnung_summe(request):
                 )
 
             # Die Rechnungssummen werden ausgerechnet.
-            try:
-                einstellungen = Einstellungen.objects.get(pk=1)
-                einstellungen_ust = einstellungen.ust
-            except ObjectDoesNotExist:
-                einstellungen_ust = 20
+            einstellungen_ust = get_einstellungen().ust
 
             rechnungs_summe_pos1 = rechnungs_summe
             if not position_2_summe and not position_3_summe:
@@ -836,6 +929,110 @@ def rechnung_summe(request):
     )
 
 
+@login_required
+@versioned_etag(StundenAufzeichnung, Firma, Arbeitnehmer)
+def stundenexport(request):
+    """
+    Der View für den Export der Stundenaufzeichnungen als CSV oder XLSX Datei.
+    Die Filter werden per GET übergeben, die Datei wird gestreamt.
+    Login ist notwendig.
+    """
+    if "export" in request.GET:
+        form = StundenFilterForm(request.GET)
+        if form.is_valid():
+            queryset = form.filter(StundenAufzeichnung.objects.all())
+            filename = "webpystunden3-stunden--{}".format(datetime.now().strftime("%Y-%m-%d--%H-%M"))
+            if request.GET["export"] == "xlsx":
+                response = StreamingHttpResponse(stream_stunden_xlsx(queryset), content_type=XLSX_CONTENT_TYPE)
+                response["Content-Disposition"] = "attachment; filename={}.xlsx".format(filename)
+            else:
+                response = StreamingHttpResponse(
+                    stream_csv(queryset),
+                    content_type="text/csv; charset=utf-8"
+                )
+                response["Content-Disposition"] = "attachment; filename={}.csv".format(filename)
+            return response
+    else:
+        form = StundenFilterForm()
+
+    return render(
+        request,
+        "stunden/stundenexport.html",
+        {"form": form},
+        RequestContext(request)
+    )
+
+
+@login_required
+def dashboard(request):
+    """
+    Der View für das Dashboard mit Stunden und Umsatz pro Monat, Firma und
+    Arbeitnehmer, bezahlt und unbezahlt. Die Zahlen kommen aus den
+    MonatsSummen, siehe rollup.auswerten. Ohne Auswahl wird auf das
+    aktuelle Jahr umgeleitet, damit Cache und ETag, die nur die URL kennen,
+    nach Neujahr nicht das alte Jahr liefern.
+    Login ist notwendig.
+    """
+    if "jahr" not in request.GET:
+        query = request.GET.copy()
+        query["jahr"] = date.today().year
+        return HttpResponseRedirect("{}?{}".format(reverse("dashboard"), query.urlencode()))
+    return dashboard_auswertung(request)
+
+
+@versioned_etag(StundenAufzeichnung, Firma, Arbeitnehmer, MonatsSumme)
+@versioned_cache(StundenAufzeichnung, Firma, Arbeitnehmer, MonatsSumme)
+def dashboard_auswertung(request):
+    """
+    Das Dashboard für das Jahr aus dem Query String, siehe dashboard.
+    """
+    form = DashboardForm(request.GET)
+    auswertung = None
+    if form.is_valid():
+        auswertung = auswerten(form.filter(MonatsSumme.objects.all()))
+
+    return render(
+        request,
+        "stunden/dashboard.html",
+        {"form": form, "auswertung": auswertung},
+        RequestContext(request)
+    )
+
+
+@login_required
+@versioned_etag(StundenAufzeichnung, Firma, Arbeitnehmer)
+@versioned_cache(StundenAufzeichnung, Firma, Arbeitnehmer)
+def suche(request):
+    """
+    Der View für die Suche in den Protokollen mit Pagination.
+    Die Treffer kommen sortiert nach Relevanz mit markiertem Ausschnitt
+    aus dem Suchindex, siehe suche.suchen.
+    Login ist notwendig.
+    """
+    form = SucheForm(request.GET) if "q" in request.GET else SucheForm()
+    treffer = None
+    if form.is_valid():
+        treffer = seite_holen(request, suchen(form.cleaned_data["q"]))
+        eintraege = StundenAufzeichnung.objects.in_bulk([t.id for t in treffer])
+        get_identity_map().verbinden(eintraege.values())
+        treffer.object_list = [
+            (eintraege[t.id], ausschnitt_html(t.ausschnitt))
+            for t in treffer if t.id in eintraege
+        ]
+
+    return render(
+        request,
+        "stunden/suche.html",
+        {
+            "form": form,
+            "treffer": treffer,
+            "max_treffer": MAX_TREFFER,
+            "filter_query": filter_query(request),
+        },
+        RequestContext(request)
+    )
+
+
 @login_required
 def jsonexport(request):
     """
@@ -846,10 +1043,40 @@ def jsonexport(request):
     if request.method == "POST":
         # Radio-Button Wert
         json_export_select = request.POST.get("json_export_select")
+        # Optional nur Einträge, die seit diesem Zeitpunkt geändert wurden.
+        # Ein ungültiger Wert ist ein Fehler, sonst käme ein voller Export.
+        try:
+            seit = parse_zeitpunkt(request.POST.get("json_export_seit"))
+        except ValueError as error:
+            uebersicht = export_uebersicht()
+            return render(
+                request,
+                "stunden/jsonexport.html",
+                {
+                    "uebersicht": uebersicht,
+                    "eintraege_vorhanden": any(zeile["anzahl"] for zeile in uebersicht),
+                    "seit_eingabe": request.POST.get("json_export_seit"),
+                    "seit_fehler": str(error),
+                },
+                RequestContext(request)
+            )
+        # Optional mit natürlichen Schlüsseln für den Upsert Import.
+        serialize_optionen = {}
+        if request.POST.get("json_export_natural"):
+            serialize_optionen = {
+                "use_natural_foreign_keys": True,
+                "use_natural_primary_keys": True,
+            }
         # File Objekt wird erstellt.
         response = HttpResponse(content_type="application/json")
         jetzt = datetime.now()
 
+        def export_queryset(model):
+            queryset = model.objects.all()
+            if seit:
+                queryset = queryset.filter(updated__gte=seit)
+            return queryset
+
         filename = ""
 
         if json_export_select == "json_export_select_stundenaufzeichnung":
@@ -858,37 +1085,65 @@ def jsonexport(request):
             )
             data = serializers.serialize(
                 "json",
-                StundenAufzeichnung.objects.all(),
-                stream=response
+                export_queryset(StundenAufzeichnung),
+                stream=response,
+                **serialize_optionen
             )
 
         if json_export_select == "json_export_select_firma":
             filename = "webpystunden3-export--firma--{}".format(jetzt.strftime("%Y-%m-%d--%H-%M"))
-            data = serializers.serialize("json", Firma.objects.all(), stream=response)
+            data = serializers.serialize(
+                "json",
+                export_queryset(Firma),
+                stream=response,
+                **serialize_optionen
+            )
 
         if json_export_select == "json_export_select_arbeitnehmer":
             filename = "webpystunden3-export--arbeitnehmer--{}".format(
                 jetzt.strftime("%Y-%m-%d--%H-%M")
             )
-            data = serializers.serialize("json", Arbeitnehmer.objects.all(), stream=response)
+            data = serializers.serialize(
+                "json",
+                export_queryset(Arbeitnehmer),
+                stream=response,
+                **serialize_optionen
+            )
 
         if json_export_select == "json_export_select_rechnungsnummer":
             filename = "webpystunden3-export--rechnungsnummer--{}".format(
                 jetzt.strftime("%Y-%m-%d--%H-%M")
             )
-            data = serializers.serialize("json", Rechnungsnummer.objects.all(), stream=response)
+            data = serializers.serialize(
+                "json",
+                export_queryset(Rechnungsnummer),
+                stream=response,
+                **serialize_optionen
+            )
 
+        if json_export_select == "json_export_select_backup":
+            filename = "webpystunden3-backup--{}".format(jetzt.strftime("%Y-%m-%d--%H-%M"))
+            response = StreamingHttpResponse(stream_backup(), content_type="application/zip")
+            response["Content-Disposition"] = "attachment; filename={}.zip".format(filename)
+            export_merken(json_export_select)
+            return response
+
+        if filename:
+            export_merken(json_export_select)
         response["Content-Disposition"] = "attachment; filename={}.json".format(filename)
         return response
 
     # Falls nicht POST Request.
     else:
-        # Hole alle Daten.
-        stundenaufzeichnungen = StundenAufzeichnung.objects.all().select_related()
+        # Nur Anzahlen und Schätzungen, ohne alle Einträge zu laden.
+        uebersicht = export_uebersicht()
         return render(
             request,
             "stunden/jsonexport.html",
-            {"stundenaufzeichnungen": stundenaufzeichnungen},
+            {
+                "uebersicht": uebersicht,
+                "eintraege_vorhanden": any(zeile["anzahl"] for zeile in uebersicht),
+            },
             RequestContext(request)
         )
 
@@ -897,64 +1152,41 @@ def jsonexport(request):
 def jsonimport(request):
     """
     Der View für den JSON Import.
+    Der Import läuft als Job im Hintergrund, siehe jobs.py und importer.py.
     Login ist notwendig.
     """
+    # Die Bereiche und die dazu passenden Dateinamen.
+    acceptable_filenames = {
+        "json_import_select_stundenaufzeichnung": "webpystunden3-export--stundenaufzeichnung",
+        "json_import_select_firma": "webpystunden3-export--firma",
+        "json_import_select_arbeitnehmer": "webpystunden3-export--arbeitnehmer",
+        "json_import_select_rechnungsnummer": "webpystunden3-export--rechnungsnummer",
+        "json_import_select_backup": "webpystunden3-backup",
+    }
+
     # Fehler wenn der Dateiname nicht zum ausgewählten Bereich passt
     def validate_acceptable_filename(json_file, acceptable_filename):
         if not str(json_file).startswith(acceptable_filename):
             errors = form._errors.setdefault("json_file", ErrorList())
             errors.append("Bitte wähle die richtige Datei für den richtigen Bereich aus!")
-            raise ValidationError()
+            raise ValidationError("Falscher Dateiname")
 
     # Wenn der Request POST ist.
     if request.method == "POST":
         # Radio-Button Wert
         json_import_select = request.POST.get("json_import_select")
-        # File Objekt wird erstellt.
-        response = HttpResponse(content_type="application/json")
-        jetzt = datetime.now()
 
         # Hol die Datei.
         form = UploadFileForm(request.POST, request.FILES)
-        if form.is_valid():
+        if form.is_valid() and json_import_select in acceptable_filenames:
             try:
                 # Die Datei.
                 json_file = request.FILES["json_file"]
-                count_import = 0
-
-                # Stundenaufzeichnung
-                if json_import_select == "json_import_select_stundenaufzeichnung":
-                    acceptable_filename = "webpystunden3-export--stundenaufzeichnung"
-                    validate_acceptable_filename(json_file, acceptable_filename)
-                    for deserialized_object in serializers.json.Deserializer(json_file):
-                        count_import += 1
-                        deserialized_object.save()
-
-                # Firma
-                if json_import_select == "json_import_select_firma":
-                    acceptable_filename = "webpystunden3-export--firma"
-                    validate_acceptable_filename(json_file, acceptable_filename)
-                    for deserialized_object in serializers.json.Deserializer(json_file):
-                        count_import += 1
-                        deserialized_object.save()
-
-                # Arbeitnehmer
-                if json_import_select == "json_import_select_arbeitnehmer":
-                    acceptable_filename = "webpystunden3-export--arbeitnehmer"
-                    validate_acceptable_filename(json_file, acceptable_filename)
-                    for deserialized_object in serializers.json.Deserializer(json_file):
-                        count_import += 1
-                        deserialized_object.save()
-
-                # Rechnungsnummer
-                if json_import_select == "json_import_select_rechnungsnummer":
-                    acceptable_filename = "webpystunden3-export--rechnungsnummer"
-                    validate_acceptable_filename(json_file, acceptable_filename)
-                    for deserialized_object in serializers.json.Deserializer(json_file):
-                        count_import += 1
-                        deserialized_object.save()
-
-            except:
+                validate_acceptable_filename(
+                    json_file,
+                    acceptable_filenames[json_import_select]
+                )
+            except ValidationError:
                 return render(
                     request,
                     "stunden/jsonimport.html",
@@ -962,12 +1194,35 @@ def jsonimport(request):
                     RequestContext(request)
                 )
 
-            # Leitet auf eine success Seite um und schickt die Anzahlen mit.
-            return HttpResponseRedirect(
-                reverse("jsonimport_success",
-                kwargs={"count_import": count_import})
+            # Der Import oder die Prüfung läuft als Job im Hintergrund.
+            job = start_import_job(
+                json_file,
+                json_import_select,
+                form.cleaned_data["dry_run"],
+                form.cleaned_data["upsert"]
             )
 
+            # Bei STUNDEN_IMPORT_SYNCHRON ist der Job schon fertig.
+            if job.status == "fehler":
+                errors = form._errors.setdefault("json_file", ErrorList())
+                errors.append(job.meldung)
+                return render(
+                    request,
+                    "stunden/jsonimport.html",
+                    {"form": form},
+                    RequestContext(request)
+                )
+            if job.status == "fertig" and not job.dry_run and not job.upsert:
+                # Leitet auf eine success Seite um und schickt die Anzahlen mit.
+                return HttpResponseRedirect("{}?zeilen_pro_sekunde={}".format(
+                    reverse("jsonimport_success", kwargs={"count_import": job.anzahl}),
+                    job.zeilen_pro_sekunde
+                ))
+
+            # Leitet auf die Status Seite des Jobs um, beim Upsert mit den
+            # Anzahlen der neuen, geänderten und unveränderten Einträge.
+            return HttpResponseRedirect(reverse("jsonimport_job", kwargs={"job_id": job.id}))
+
     # Falls der Request nicht POST ist.
     else:
         form = UploadFileForm()
@@ -980,6 +1235,39 @@ def jsonimport(request):
     )
 
 
+@login_required
+def jsonimport_job(request, job_id):
+    """
+    Der View für die Status Seite eines Import Jobs.
+    Die Seite fragt den Status über jsonimport_job_status ab.
+    Login ist notwendig.
+    """
+    job = get_job(job_id)
+    if job is None:
+        raise Http404("Import Job nicht gefunden")
+
+    return render(
+        request,
+        "stunden/jsonimport_job.html",
+        {"job": job},
+        RequestContext(request)
+    )
+
+
+@login_required
+def jsonimport_job_status(request, job_id):
+    """
+    Der View für den Status eines Import Jobs als JSON.
+    Liefert verarbeitete Zeilen, Durchsatz, Restdauer und Fehler pro Zeile.
+    Login ist notwendig.
+    """
+    job = get_job(job_id)
+    if job is None:
+        raise Http404("Import Job nicht gefunden")
+
+    return HttpResponse(json.dumps(job), content_type="application/json")
+
+
 @login_required
 def jsonimport_success(request, count_import):
     """
@@ -991,7 +1279,10 @@ def jsonimport_success(request, count_import):
     return render(
         request,
         "stunden/jsonimport_success.html",
-        {"count_import": count_import},
+        {
+            "count_import": count_import,
+            "zeilen_pro_sekunde": request.GET.get("zeilen_pro_sekunde", ""),
+        },
         RequestContext(request)
     )
 
@@ -1000,6 +1291,7 @@ def jsonimport_success(request, count_import):
 def einstellungen(request):
     """
     Der View für die Einstellungen.
+    Ohne ETag, weil die Seite ein CSRF Token enthält, siehe versioned_etag.
     Login ist notwendig.
     """
     # Request ist POST
@@ -1018,24 +1310,16 @@ def einstellungen(request):
 
     # Request ist nicht POST
     else:
-        try:
-            einstellungen = Einstellungen.objects.get(pk=1)
-            return render(
-                request,
-                "stunden/einstellungen.html",
-                {"einstellungen": einstellungen},
-                RequestContext(request)
-            )
-        except ObjectDoesNotExist:
-            return render(
-                request,
-                "stunden/einstellungen.html",
-                {},
-                RequestContext(request)
-            )
+        return render(
+            request,
+            "stunden/einstellungen.html",
+            {"einstellungen": get_einstellungen()},
+            RequestContext(request)
+        )
 
 
 @login_required
+@versioned_etag(Firma)
 def get_firma_stundensatz(request, selected_firma_id):
     """
     Der View für den Rechnung Firma-Checkbox-Auswahl Stundensatz Eintrag.
@@ -1047,7 +1331,87 @@ def get_firma_stundensatz(request, selected_firma_id):
     return HttpResponse(json.dumps(data), content_type="application/json")
 
 
+def firma_stundensaetze_etag(request):
+    """
+    Der ETag für firma_stundensaetze, die Version von Firma.
+    """
+    return "stundensaetze-{}".format(get_stundensaetze()["version"])
+
+
+def firma_stundensaetze_last_modified(request):
+    """
+    Last-Modified für firma_stundensaetze, die letzte Änderung einer Firma.
+    """
+    return get_stundensaetze()["last_modified"]
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=firma_stundensaetze_etag, last_modified_func=firma_stundensaetze_last_modified)
+def firma_stundensaetze(request):
+    """
+    Der View mit den Stundensätzen aller Firmen für die Rechnung, z.B.
+    {"1": 80, "2": null}. main.js lädt ihn einmal pro Seite, der Browser
+    fragt danach nur mit If-None-Match nach und bekommt meist ein 304.
+    Login ist notwendig.
+    """
+    return HttpResponse(get_stundensaetze()["json"], content_type="application/json")
+
+
 @login_required
+@versioned_etag(*DELTA_MODELS)
+def api_aenderungen(request):
+    """
+    Der View für den Delta Export als JSON.
+    Liefert alle Einträge, die seit dem Zeitpunkt "seit" geändert wurden,
+    und alle Löschungen seit diesem Zeitpunkt. Ohne "seit" wird alles geliefert.
+    Der zurückgegebene "cursor" ist beim nächsten Aufruf als "seit" zu verwenden.
+    updated wird beim Speichern gesetzt, nicht beim Commit. Damit Einträge
+    aus noch laufenden Transaktionen (z.B. einem Import) nicht fehlen, liegt
+    der Cursor STUNDEN_DELTA_UEBERLAPPUNG Sekunden zurück. Einträge aus
+    dieser Zeit kommen daher mehrfach, Clients müssen sie idempotent
+    übernehmen. Längere Transaktionen brauchen eine größere Überlappung.
+    Login ist notwendig.
+    """
+    try:
+        seit = parse_zeitpunkt(request.GET.get("seit"))
+    except ValueError as error:
+        return HttpResponseBadRequest(
+            json.dumps({"error": str(error)}),
+            content_type="application/json"
+        )
+
+    # Der Cursor wird vor den Abfragen bestimmt, damit keine Änderung fehlt.
+    cursor = timezone.now() - timedelta(
+        seconds=getattr(settings, "STUNDEN_DELTA_UEBERLAPPUNG", DELTA_UEBERLAPPUNG)
+    )
+    objekte = []
+    for model in DELTA_MODELS:
+        queryset = model.objects.order_by("pk")
+        if seit:
+            queryset = queryset.filter(updated__gte=seit)
+        objekte.extend(python_serializer.Serializer().serialize(queryset.iterator()))
+
+    loeschungen = Loeschung.objects.order_by("geloescht")
+    if seit:
+        loeschungen = loeschungen.filter(geloescht__gte=seit)
+    geloescht = [
+        {"model": loeschung.model, "pk": loeschung.objekt_id, "geloescht": loeschung.geloescht}
+        for loeschung in loeschungen.iterator()
+    ]
+
+    data = {
+        "seit": seit,
+        "cursor": cursor,
+        "objekte": objekte,
+        "geloescht": geloescht,
+    }
+    return HttpResponse(json.dumps(data, cls=DjangoJSONEncoder), content_type="application/json")
+
+
+@login_required
+@versioned_etag(Rechnungsnummer)
+@versioned_cache(Rechnungsnummer)
 def rechnungsnummer(request):
     """
     Der View für die Rechnungsnummer Seite.
@@ -1055,6 +1419,18 @@ def rechnungsnummer(request):
     """
     rechnungsnummern = Rechnungsnummer.objects.all().order_by("-rechnungsnummer")
 
+    # Die Liste als XLSX Datei.
+    if request.GET.get("export") == "xlsx":
+        filename = "webpystunden3-rechnungsnummern--{}".format(
+            datetime.now().strftime("%Y-%m-%d--%H-%M")
+        )
+        response = StreamingHttpResponse(
+            stream_rechnungsnummern_xlsx(rechnungsnummern),
+            content_type=XLSX_CONTENT_TYPE
+        )
+        response["Content-Disposition"] = "attachment; filename={}.xlsx".format(filename)
+        return response
+
     return render(
         request,
         "stunden/rechnungsnummer.html",
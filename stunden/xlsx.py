@@ -0,0 +1,185 @@
+import re
+import zipfile
+from datetime import date, datetime, time
+from decimal import Decimal
+from xml.sax.saxutils import escape
+from .backup import ZipStreamBuffer
+from django.utils import timezone
+
+
+# Nach so vielen Zeilen werden die geschriebenen Bytes weitergegeben.
+XLSX_ZEILEN_PRO_STUECK = 1000
+
+# Der Tag 0 von Excel (1900 Datumssystem inklusive des 29.02.1900).
+EXCEL_EPOCHE = datetime(1899, 12, 30)
+
+# Die Styles aus styles.xml, siehe XLSX_STYLES.
+STYLE_KOPF = 1
+STYLE_DATUM = 2
+STYLE_ZEIT = 3
+STYLE_ZAHL = 4
+STYLE_DATUM_ZEIT = 5
+
+XLSX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>
+</Types>"""
+
+XLSX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>"""
+
+XLSX_WORKBOOK = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="{}" sheetId="1" r:id="rId1"/></sheets>
+</workbook>"""
+
+XLSX_WORKBOOK_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+XLSX_STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="3">
+<numFmt numFmtId="164" formatCode="dd.mm.yyyy"/>
+<numFmt numFmtId="165" formatCode="hh:mm"/>
+<numFmt numFmtId="166" formatCode="dd.mm.yyyy hh:mm"/>
+</numFmts>
+<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>
+<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>
+<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="6">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="2" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+<xf numFmtId="166" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>
+</cellXfs>
+</styleSheet>"""
+
+XLSX_SHEET_ANFANG = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>
+<sheetData>
+"""
+
+XLSX_SHEET_ENDE = """</sheetData>
+</worksheet>"""
+
+# Steuerzeichen, die in XML nicht erlaubt sind.
+XML_UNGUELTIG = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def spalten_name(index):
+    """
+    Der Name einer Spalte in Excel, 0 ist "A", 26 ist "AA".
+    """
+    name = ""
+    index += 1
+    while index:
+        index, rest = divmod(index - 1, 26)
+        name = chr(65 + rest) + name
+    return name
+
+
+def xml_text(value):
+    """
+    Text für XML, ohne Zeichen, die in XML nicht erlaubt sind.
+    """
+    return escape(XML_UNGUELTIG.sub("", str(value)))
+
+
+def zelle(referenz, value, style=0):
+    """
+    Das XML einer Zelle mit passendem Typ.
+    Datum und Zeit werden als Zahlen mit Format geschrieben, damit Excel
+    damit rechnen kann. None ergibt eine leere Zelle.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return '<c r="{}" t="b"><v>{}</v></c>'.format(referenz, int(value))
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.make_naive(value)
+        serial = (value - EXCEL_EPOCHE).total_seconds() / 86400
+        return '<c r="{}" s="{}"><v>{!r}</v></c>'.format(referenz, STYLE_DATUM_ZEIT, serial)
+    if isinstance(value, date):
+        serial = (value - EXCEL_EPOCHE.date()).days
+        return '<c r="{}" s="{}"><v>{}</v></c>'.format(referenz, STYLE_DATUM, serial)
+    if isinstance(value, time):
+        serial = (value.hour * 3600 + value.minute * 60 + value.second) / 86400
+        return '<c r="{}" s="{}"><v>{!r}</v></c>'.format(referenz, STYLE_ZEIT, serial)
+    if isinstance(value, int):
+        return '<c r="{}"><v>{}</v></c>'.format(referenz, value)
+    if isinstance(value, (float, Decimal)):
+        return '<c r="{}" s="{}"><v>{}</v></c>'.format(referenz, STYLE_ZAHL, value)
+    return '<c r="{}" t="inlineStr"{}><is><t xml:space="preserve">{}</t></is></c>'.format(
+        referenz,
+        ' s="{}"'.format(style) if style else "",
+        xml_text(value),
+    )
+
+
+def zeile(nummer, values, style=0, namen=None):
+    """
+    Das XML einer Zeile. namen sind die vorab berechneten Spaltennamen.
+    """
+    if namen is None:
+        namen = [spalten_name(index) for index in range(len(values))]
+    zellen = "".join(
+        zelle("{}{}".format(name, nummer), value, style)
+        for name, value in zip(namen, values)
+    )
+    return '<row r="{}">{}</row>\n'.format(nummer, zellen)
+
+
+def stream_xlsx(tabellen_name, spalten, rows, spalten_breiten=None):
+    """
+    Erstellt eine XLSX Datei mit einer Tabelle und liefert sie stückweise.
+    Die Zeilen werden direkt als XML in das ZIP Archiv geschrieben, Texte
+    als Inline Strings, damit keine Liste aller Texte im Speicher bleibt.
+    Datum, Zeit und Zahlen werden als typisierte Zellen geschrieben.
+    Wie beim Backup braucht archiv.open(name, "w") Python 3.6.
+    """
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archiv:
+        archiv.writestr("[Content_Types].xml", XLSX_CONTENT_TYPES)
+        archiv.writestr("_rels/.rels", XLSX_RELS)
+        archiv.writestr("xl/workbook.xml", XLSX_WORKBOOK.format(xml_text(tabellen_name[:31])))
+        archiv.writestr("xl/_rels/workbook.xml.rels", XLSX_WORKBOOK_RELS)
+        archiv.writestr("xl/styles.xml", XLSX_STYLES)
+        yield buffer.pop()
+
+        # Ohne ZIP64 Felder, die nicht jede Excel Version lesen kann. Damit ist
+        # die Tabelle auf 2 GB unkomprimiertes XML begrenzt.
+        with archiv.open("xl/worksheets/sheet1.xml", "w") as sheet:
+            anfang = XLSX_SHEET_ANFANG
+            if spalten_breiten:
+                anfang = anfang.replace("<sheetData>", "<cols>{}</cols>\n<sheetData>".format("".join(
+                    '<col min="{0}" max="{0}" width="{1}" customWidth="1"/>'.format(index + 1, breite)
+                    for index, breite in enumerate(spalten_breiten)
+                )))
+            sheet.write(anfang.encode("utf-8"))
+            sheet.write(zeile(1, spalten, STYLE_KOPF).encode("utf-8"))
+            namen = [spalten_name(index) for index in range(len(spalten))]
+            stueck = []
+            for nummer, values in enumerate(rows, 2):
+                stueck.append(zeile(nummer, values, namen=namen))
+                if len(stueck) >= XLSX_ZEILEN_PRO_STUECK:
+                    sheet.write("".join(stueck).encode("utf-8"))
+                    stueck = []
+                    yield buffer.pop()
+            sheet.write("".join(stueck).encode("utf-8"))
+            sheet.write(XLSX_SHEET_ENDE.encode("utf-8"))
+        yield buffer.pop()
+    yield buffer.pop()
@@ -48,6 +48,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'stunden.identity_map.IdentityMapMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -79,6 +80,54 @@ TEMPLATES = [
 
 CRISPY_TEMPLATE_PACK = "bootstrap3"
 
+# Der Cache enthält die Versionen der Models, z.B. für die Einstellungen.
+# Laufen mehrere Prozesse, muss der Cache geteilt sein, sonst sehen andere
+# Prozesse Änderungen erst nach einem Neustart. Der ZweistufigerCache hält
+# häufig gelesene Einträge im Speicher des Prozesses und fragt nur bei Bedarf
+# den geteilten Cache "shared" (hier im Dateisystem, ein DatabaseCache oder
+# Memcached gehen genauso). Änderungen anderer Prozesse sind nach höchstens
+# VERSION_TIMEOUT Sekunden sichtbar.
+CACHES = {
+    "default": {
+        "BACKEND": "stunden.cache_backends.ZweistufigerCache",
+        "OPTIONS": {
+            "SHARED": "shared",
+            "LOKAL_MAX_EINTRAEGE": 1000,
+            "VERSION_TIMEOUT": 1.0,
+        },
+    },
+    "shared": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.path.join(PROJECT_PATH, "cache"),
+    },
+}
+# Wie lange die Listen Seiten höchstens im Cache bleiben (Sekunden). Änderungen
+# invalidieren den Cache sofort über die Versionen der Models.
+STUNDEN_VIEW_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Um so viele Sekunden liegt der Cursor von /api/aenderungen/ zurück, damit
+# Änderungen aus Transaktionen, die beim Abruf noch liefen, nicht fehlen.
+# Sollte länger sein als der längste Import.
+STUNDEN_DELTA_UEBERLAPPUNG = 10 * 60
+
+# JSON Import: Anzahl der Objekte pro Batch und Transaktionsmodus.
+# "gesamt" importiert alles in einer Transaktion, "batch" jeden Batch einzeln.
+STUNDEN_IMPORT_BATCH_SIZE = 500
+STUNDEN_IMPORT_TRANSAKTION = "gesamt"
+# Parser und Writer laufen in eigenen Threads, dazwischen höchstens
+# STUNDEN_IMPORT_QUEUE_SIZE fertige Batches. Lohnt sich, wenn der Writer
+# auf die Datenbank wartet (z.B. PostgreSQL über das Netzwerk). Die Zeiten
+# der Stufen zeigt die Status Seite des Import Jobs.
+STUNDEN_IMPORT_PIPELINE = False
+STUNDEN_IMPORT_QUEUE_SIZE = 4
+# Anzahl der Worker für Import Jobs. Mit STUNDEN_IMPORT_SYNCHRON = True laufen
+# Imports direkt im Request. Der Job Status liegt im Cache, bei mehreren
+# Prozessen muss dieser geteilt sein. Nach STUNDEN_IMPORT_JOB_TIMEOUT
+# Sekunden ist der Status eines Jobs nicht mehr abrufbar.
+STUNDEN_IMPORT_WORKER = 2
+STUNDEN_IMPORT_SYNCHRON = False
+STUNDEN_IMPORT_JOB_TIMEOUT = 24 * 60 * 60
+
 INSTALLED_APPS = (
     "django.contrib.auth",
     "django.contrib.contenttypes",
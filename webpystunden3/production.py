@@ -0,0 +1,25 @@
+# Settings für den Betrieb, z.B. mit
+# DJANGO_SETTINGS_MODULE=webpystunden3.production gunicorn webpystunden3.wsgi
+# Baut auf settings.py auf und ändert nur, was für die Produktion nötig ist.
+# Statische Dateien werden mit DEBUG = False nicht mehr von Django
+# ausgeliefert, dafür den Webserver und collectstatic verwenden.
+from .settings import *  # noqa: F401,F403
+from .settings import TEMPLATES
+
+DEBUG = False
+
+# Der cached Loader liest und kompiliert jedes Template nur einmal pro
+# Prozess. Mit eigenen loaders muss APP_DIRS aus sein.
+TEMPLATES[0]["APP_DIRS"] = False
+TEMPLATES[0]["OPTIONS"]["debug"] = False
+TEMPLATES[0]["OPTIONS"]["loaders"] = [
+    ("django.template.loaders.cached.Loader", [
+        "django.template.loaders.filesystem.Loader",
+        "django.template.loaders.app_directories.Loader",
+    ]),
+]
+
+# Kompiliert alle Templates der App beim Start des Prozesses, damit der
+# erste Request nicht darauf warten muss. "python manage.py template_zeiten
+# --settings=webpystunden3.production" zeigt die Zeiten.
+STUNDEN_TEMPLATES_VORKOMPILIEREN = True